@@ -0,0 +1,212 @@
+import asyncio
+import ipaddress
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import List, Optional, Union
+
+import aio_pika
+from fastapi import HTTPException
+
+from .autoscaling import queue_stats
+from .eta import EtaEstimator
+from .schemas import QueueStats
+from .throughput import PresetThroughput
+
+
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_networks(value: str) -> List[IPNetwork]:
+    """
+    Parse a comma-separated list of addresses and CIDR ranges.
+
+    :raises ValueError: If an entry is neither.
+    """
+    return [
+        ipaddress.ip_network(entry.strip(), strict=False)
+        for entry in value.split(",")
+        if entry.strip()
+    ]
+
+
+def client_key(
+    peer: Optional[str], claimed: Optional[str], trusted_proxies: List[IPNetwork]
+) -> str:
+    """
+    Identify the client a submission is rate limited as. Clients could dodge their
+    limit by claiming a new identity with every request, so the identity they claim
+    is only taken from a trusted proxy, which is expected to set it itself.
+
+    :param peer: The address the request came from.
+    :param claimed: The identity the request claims, if any.
+    :param trusted_proxies: The networks of proxies whose claims are taken.
+    :return: The claimed identity if the peer is a trusted proxy, otherwise the peer.
+    """
+    if peer is None:
+        return "unknown"
+    if claimed:
+        try:
+            address = ipaddress.ip_address(peer)
+        except ValueError:
+            return peer
+        if any(address in network for network in trusted_proxies):
+            return claimed
+    return peer
+
+
+class TokenBucket:
+    """
+    Allows a sustained rate of requests with bursts of up to its capacity.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self, tokens: float) -> float:
+        """
+        Take tokens from the bucket if it holds enough of them.
+
+        :param tokens: The tokens to take, at most the bucket's capacity.
+        :return: 0 if they were taken, otherwise the seconds until they could be.
+        """
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Turns submissions away with a 429 while the job queue or the estimated time to
+    drain it is over its limit, and while a client submits faster than its token
+    bucket allows, so that upstream systems back off instead of the backlog growing
+    without bound.
+    """
+
+    def __init__(
+        self,
+        channel: aio_pika.Channel,
+        throughput: PresetThroughput,
+        eta_estimator: EtaEstimator,
+        logger: logging.Logger,
+        max_queue_depth: Optional[int],
+        max_drain_seconds: Optional[float],
+        client_rate: Optional[float],
+        client_burst: float,
+        refresh_seconds: float = 5,
+        max_retry_after_seconds: float = 300,
+        max_clients: int = 10_000,
+    ):
+        self.channel = channel
+        self.throughput = throughput
+        self.eta_estimator = eta_estimator
+        self.logger = logger
+        self.max_queue_depth = max_queue_depth
+        self.max_drain_seconds = max_drain_seconds
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.refresh_seconds = refresh_seconds
+        self.max_retry_after_seconds = max_retry_after_seconds
+        self.max_clients = max_clients
+        # Buckets of the clients seen most recently, the least recent are evicted first
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.stats: Optional[QueueStats] = None
+        self.stats_updated_at = 0.0
+        self.refresh_lock = asyncio.Lock()
+        self.rejected = 0
+
+    async def load(self) -> QueueStats:
+        """
+        The latest queue stats, gathered at most once per refresh interval however
+        many submissions ask for them.
+        """
+        async with self.refresh_lock:
+            if (
+                self.stats is None
+                or time.monotonic() - self.stats_updated_at >= self.refresh_seconds
+            ):
+                self.stats = await queue_stats(
+                    self.channel, self.throughput, self.eta_estimator
+                )
+                self.stats_updated_at = time.monotonic()
+        return self.stats
+
+    def reject(self, client_id: str, reason: str, retry_after: float):
+        self.rejected += 1
+        retry_after = min(max(retry_after, 1), self.max_retry_after_seconds)
+        self.logger.info(
+            f"Turning away a submission from {client_id} ({reason}), retry after {retry_after:.0f}s"
+        )
+        raise HTTPException(
+            status_code=429,
+            detail=reason,
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    def bucket(self, client_id: str) -> TokenBucket:
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self.buckets[client_id] = bucket
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client_id)
+        return bucket
+
+    async def admit(self, client_id: str, jobs: int = 1):
+        """
+        Check that a client may submit jobs now.
+
+        :param client_id: Who is submitting, each client has a bucket of its own.
+        :param jobs: The number of jobs being submitted.
+        :raises HTTPException: A 429 with Retry-After if the submission is refused.
+        """
+        if self.max_queue_depth is not None or self.max_drain_seconds is not None:
+            try:
+                stats = await self.load()
+            except Exception as e:
+                # Shedding load is best-effort, and shouldn't fail submissions itself
+                self.logger.error(f"Unable to gather queue stats for admission: {e}")
+                stats = None
+            if stats is not None:
+                self.check_load(client_id, stats)
+
+        if self.client_rate:
+            wait = self.bucket(client_id).take(min(jobs, self.client_burst))
+            if wait > 0:
+                self.reject(client_id, "Too many submissions from this client", wait)
+
+    def check_load(self, client_id: str, stats: QueueStats):
+        queue_depth = stats.queue_depth + stats.retry_queue_depth
+        if self.max_queue_depth is not None and queue_depth >= self.max_queue_depth:
+            # Wait for the share of the queue over the limit to drain, at its current pace
+            retry_after = self.refresh_seconds
+            if stats.drain_seconds and queue_depth:
+                excess = queue_depth - self.max_queue_depth + 1
+                retry_after = stats.drain_seconds * excess / queue_depth
+            self.reject(client_id, "The job queue is full", retry_after)
+
+        # Without workers there is no drain time, the queue depth limit applies alone
+        if (
+            self.max_drain_seconds is not None
+            and stats.drain_seconds is not None
+            and stats.drain_seconds >= self.max_drain_seconds
+        ):
+            self.reject(
+                client_id,
+                "The job backlog is too deep",
+                stats.drain_seconds - self.max_drain_seconds,
+            )
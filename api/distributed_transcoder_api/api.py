@@ -1,53 +1,87 @@
 import asyncio
 import contextlib
-import json
 import logging
 import os
 import random
+import re
 import string
 import tempfile
 from dataclasses import asdict
+from datetime import datetime
 from typing import Dict, List, Optional, Union
 
-import aio_pika
-import boto3
-from botocore.exceptions import ClientError
-from distributed_transcoder_common import JobResultMessage, JobSubmissionMessage
+from distributed_transcoder_common import (
+    JobResultMessage,
+    ObjectNotFound,
+    StorageError,
+    current_traceparent,
+    init_tracing,
+    shutdown_tracing,
+    span,
+    storage_from_env,
+)
 from distributed_transcoder_common.models import (
     Job,
     JobOut,
+    MediaInfo,
+    MediaInfoOut,
     Preset,
     PresetOut,
     Playlist,
     PlaylistOut,
 )
-from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile, WebSocket
+from fastapi import (
+    FastAPI,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    WebSocket,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 from starlette.websockets import WebSocketDisconnect
 from tortoise import Tortoise, connections
 from tortoise.exceptions import DoesNotExist, IntegrityError
+from tortoise.expressions import Q
 
+from .admission import AdmissionController, client_key, parse_networks
+from .autoscaling import queue_stats
+from .dedup import OutputDeduplicator
+from .eta import EtaEstimator
 from .managers import EventManager
+from .manifests import (
+    HLS_MASTER_PLAYLIST_NAME,
+    HLS_MEDIA_PLAYLIST_NAME,
+    hls_master_playlist,
+)
+from .migrations import upgrade_schema
+from .pagination import decode_cursor, encode_cursor
+from .pipelines import apply_speed_tier, compile_pipeline, preset_fields
+from .preset_cache import PresetCache, presets_etag
+from .queries import job_etag, job_etag_by_id, playlist_job_ids, playlist_summaries
 from .schemas import (
+    JobStatusOut,
     JobUpdate,
+    PlaylistCancelOut,
     PlaylistShallowOut,
+    PlaylistSummary,
     PresetCreate,
     PlaylistCreateOut,
     PresetUpdate,
+    QueueStats,
     TranscodingJob,
     PlaylistCreate,
 )
 from .seed import seed_presets
-from .work_queue import JOB_QUEUE_NAME, WorkQueue, init_channels
+from .speculation import StragglerDetector
+from .throughput import PresetThroughput
+from .webhooks import WebhookDispatcher, check_callback_url
+from .work_queue import CANCELLABLE_STATES, WorkQueue, init_channels, publish_job
 
 # Constants
-# S3 Config
-S3_ACCESS_KEY_ID = os.environ["S3_ACCESS_KEY_ID"]
-S3_SECRET_ACCESS_KEY = os.environ["S3_SECRET_ACCESS_KEY"]
-S3_BUCKET_NAME = os.environ["S3_BUCKET_NAME"]
-S3_ENDPOINT_URL = os.environ["S3_ENDPOINT_URL"]
-
 # DB Config
 POSTGRES_USER = os.environ["POSTGRES_USER"]
 POSTGRES_PASSWORD = os.environ["POSTGRES_PASSWORD"]
@@ -60,6 +94,58 @@ RMQ_PORT = int(os.environ["RMQ_PORT"])
 RMQ_USER = os.environ["RMQ_USER"]
 RMQ_PASSWORD = os.environ["RMQ_PASSWORD"]
 
+# Preset Cache Config
+PRESET_CACHE_TTL_SECONDS = float(os.environ.get("PRESET_CACHE_TTL_SECONDS", "60"))
+
+# Speculative Execution Config
+# A job encoding slower than this fraction of its preset's usual speed gets a backup copy
+SPECULATION_SLOWDOWN_THRESHOLD = float(
+    os.environ.get("SPECULATION_SLOWDOWN_THRESHOLD", "0.5")
+)
+SPECULATION_MIN_ELAPSED_SECONDS = float(
+    os.environ.get("SPECULATION_MIN_ELAPSED_SECONDS", "60")
+)
+SPECULATION_CHECK_INTERVAL_SECONDS = float(
+    os.environ.get("SPECULATION_CHECK_INTERVAL_SECONDS", "15")
+)
+
+# Webhook Config
+# Key the bodies of webhook deliveries are signed with, see webhooks.sign
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+# Hosts callback URLs may point at even though they are private, comma-separated
+WEBHOOK_ALLOWED_HOSTS = [
+    host.strip().lower()
+    for host in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",")
+    if host.strip()
+]
+# How long events are held to be batched with others for the same callback URL
+WEBHOOK_BATCH_WINDOW_SECONDS = float(
+    os.environ.get("WEBHOOK_BATCH_WINDOW_SECONDS", "1")
+)
+
+# Long-Polling Config
+# The longest a GET /jobs/{job_id}?wait= request is parked for
+LONG_POLL_MAX_SECONDS = float(os.environ.get("LONG_POLL_MAX_SECONDS", "60"))
+# How often a parked request rechecks the job, to see changes made by other instances
+LONG_POLL_RECHECK_SECONDS = float(os.environ.get("LONG_POLL_RECHECK_SECONDS", "5"))
+
+# Admission Control Config, set any of these to 0 to turn its limit off
+# Submissions are turned away while this many jobs are queued to run or be retried
+ADMISSION_MAX_QUEUE_DEPTH = int(os.environ.get("ADMISSION_MAX_QUEUE_DEPTH", "10000"))
+# or while the workers would take longer than this to drain the backlog
+ADMISSION_MAX_DRAIN_SECONDS = float(
+    os.environ.get("ADMISSION_MAX_DRAIN_SECONDS", "14400")
+)
+# How often the queue depth and backlog are gathered for admission
+ADMISSION_REFRESH_SECONDS = float(os.environ.get("ADMISSION_REFRESH_SECONDS", "5"))
+# Jobs each client may submit per second, with bursts of up to CLIENT_SUBMIT_BURST
+CLIENT_SUBMIT_RATE = float(os.environ.get("CLIENT_SUBMIT_RATE", "20"))
+CLIENT_SUBMIT_BURST = float(os.environ.get("CLIENT_SUBMIT_BURST", "100"))
+# Header clients are identified by instead of their address, only taken from requests
+# coming from the comma-separated addresses or CIDR ranges in TRUSTED_PROXIES
+CLIENT_ID_HEADER = "X-Client-ID"
+TRUSTED_PROXIES = parse_networks(os.environ.get("TRUSTED_PROXIES", ""))
+
 # Generate a random 5-character API Instance ID
 api_instance_id = "".join(random.choices(string.ascii_lowercase + string.digits, k=5))
 
@@ -82,13 +168,18 @@ global channel
 
 
 @contextlib.asynccontextmanager
-async def lifespan(app: FastAPI) -> Dict[str, Union[WorkQueue, EventManager]]:
+async def lifespan(
+    app: FastAPI,
+) -> Dict[str, Union[WorkQueue, EventManager, PresetCache]]:
     logger.info("Lifecycle starting up...")
+    if init_tracing("transcoder-api", api_instance_id):
+        logger.info("Exporting traces")
     logger.info("Initializing Tortoise ORM...")
     await Tortoise.init(
         db_url=f"postgres://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}/{POSTGRES_DB}",
         modules={"models": ["distributed_transcoder_common.models"]},
     )
+    await upgrade_schema()
     await Tortoise.generate_schemas()
     logger.info("Tortoise-ORM started")
 
@@ -102,23 +193,89 @@ async def lifespan(app: FastAPI) -> Dict[str, Union[WorkQueue, EventManager]]:
 
     logger.info("Starting RabbitMQ event consumer...")
     event_manager = EventManager()
-    event_consumer = WorkQueue(channel, event_manager, logger)
+    deduplicator = OutputDeduplicator(storage, logger)
+    preset_throughput = PresetThroughput()
+    eta_estimator = EtaEstimator(preset_throughput)
+    preset_cache = PresetCache(PRESET_CACHE_TTL_SECONDS, api_instance_id, logger)
+    straggler_detector = StragglerDetector(
+        channel,
+        preset_cache,
+        preset_throughput,
+        logger,
+        SPECULATION_SLOWDOWN_THRESHOLD,
+        SPECULATION_MIN_ELAPSED_SECONDS,
+    )
+    webhooks = WebhookDispatcher(
+        WEBHOOK_SECRET,
+        logger,
+        batch_window_seconds=WEBHOOK_BATCH_WINDOW_SECONDS,
+        allowed_hosts=WEBHOOK_ALLOWED_HOSTS,
+    )
+    await webhooks.start()
+    event_consumer = WorkQueue(
+        channel,
+        preset_cache,
+        event_manager,
+        logger,
+        deduplicator,
+        straggler_detector,
+        webhooks,
+        eta_estimator,
+    )
     # Start the event consumer and prevent it from being GC'd
     event_consumption = loop.create_task(event_consumer.consume_events())
 
+    admission = AdmissionController(
+        channel,
+        preset_throughput,
+        eta_estimator,
+        logger,
+        max_queue_depth=ADMISSION_MAX_QUEUE_DEPTH or None,
+        max_drain_seconds=ADMISSION_MAX_DRAIN_SECONDS or None,
+        client_rate=CLIENT_SUBMIT_RATE or None,
+        client_burst=CLIENT_SUBMIT_BURST,
+        refresh_seconds=ADMISSION_REFRESH_SECONDS,
+    )
+
+    logger.info("Starting straggler detector...")
+    # Held on the app, as the event loop only keeps a weak reference to its tasks
+    app.state.straggler_detection = loop.create_task(
+        straggler_detector.run(SPECULATION_CHECK_INTERVAL_SECONDS)
+    )
+
     logger.info("Seeding presets...")
-    await seed_presets()
+    await seed_presets(logger)
+    # Jobs consumed meanwhile may have loaded the presets from before seeding
+    preset_cache.invalidate()
     logger.info("Finished seeding presets")
 
+    logger.info("Subscribing to preset cache invalidations...")
+    await preset_cache.subscribe(channel)
+
     # Yield control back to the application
-    yield {"event_manager": event_manager, "event_consumer": event_consumer}
+    yield {
+        "event_manager": event_manager,
+        "event_consumer": event_consumer,
+        "preset_cache": preset_cache,
+        "deduplicator": deduplicator,
+        "preset_throughput": preset_throughput,
+        "eta_estimator": eta_estimator,
+        "admission": admission,
+    }
 
     # Run on FastAPI shutdown
+    app.state.straggler_detection.cancel()
+
+    logger.info("Flushing webhook deliveries...")
+    await webhooks.close()
+
     logger.info("Closing RabbitMQ connection...")
     await connection.close()
 
     logger.info("Closing Tortoise ORM connection...")
     await connections.close_all()
+
+    shutdown_tracing()
     logger.info("Lifecycle shutdown complete")
 
 
@@ -150,13 +307,60 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link", "ETag", "Retry-After"],
 )
-s3 = boto3.client(
-    service_name="s3",
-    aws_access_key_id=S3_ACCESS_KEY_ID,
-    aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-    endpoint_url=S3_ENDPOINT_URL,
-)
+
+# Set up the storage backend inputs and outputs live in
+storage = storage_from_env()
+
+
+def validate_callback_url(url: Optional[str]):
+    if url is None:
+        return
+    try:
+        check_callback_url(str(url), WEBHOOK_ALLOWED_HOSTS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def client_id(request: Request) -> str:
+    return client_key(
+        request.client.host if request.client is not None else None,
+        request.headers.get(CLIENT_ID_HEADER),
+        TRUSTED_PROXIES,
+    )
+
+
+async def enqueue_job(request: Request, job: Job, dedupe: bool):
+    """
+    Hand a newly created job to the workers, unless it can reuse the output of an
+    identical job.
+
+    :param request: The request that created the job.
+    :param job: The job to enqueue.
+    :param dedupe: Whether the job may reuse the output of an identical job.
+    """
+    # Reused outputs come without thumbnails, so jobs asking for them always run
+    if dedupe and job.thumbnail_interval is None:
+        deduplicator = request.state.deduplicator
+        job.dedup_key = await asyncio.to_thread(
+            deduplicator.compute_key, job.input_s3_path, job.pipeline
+        )
+        if job.dedup_key is not None:
+            await job.save(update_fields=["dedup_key"])
+            if await deduplicator.try_reuse(job):
+                if job.state == Job.STATE_COMPLETED:
+                    await request.state.event_consumer.send_completion(
+                        job,
+                        JobResultMessage(
+                            job_id=job.job_id,
+                            status=job.state,
+                            output_s3_path=job.output_s3_path,
+                        ),
+                    )
+                return
+
+    await publish_job(channel, job, request.state.preset_cache)
 
 
 @app.post("/upload")
@@ -164,14 +368,21 @@ async def upload_file(file: UploadFile = File(...)):
     with tempfile.NamedTemporaryFile() as temp_file:
         temp_file.write(file.file.read())
         temp_file.flush()
-        s3.upload_file(temp_file.name, S3_BUCKET_NAME, file.filename)
+        storage.upload(temp_file.name, file.filename)
     return {"filename": file.filename}
 
 
 @app.post("/submit_job")
-async def submit_job(job: TranscodingJob):
+async def submit_job(request: Request, job: TranscodingJob):
     """
-    Submit a job to the work queue.
+    Submit a job to the work queue. Jobs which depend on other jobs wait until those
+    have completed, and fail if any of them doesn't.
+
+    A speed tier of fast or quality overrides the encoder settings of the job's
+    pipeline, trading compression efficiency for a quicker encode or the reverse.
+
+    Submissions are turned away with a 429 and a Retry-After header while the backlog
+    is over its limits, or the client is submitting faster than its rate limit.
 
     Args:
         job (TranscodingJob): The job to submit
@@ -180,56 +391,188 @@ async def submit_job(job: TranscodingJob):
         Dict[str, str]: A dictionary containing the job ID
     """
     if job.preset_id:
-        preset = await Preset.get_or_none(preset_id=job.preset_id)
+        preset = await request.state.preset_cache.get(job.preset_id)
         if not preset:
             raise HTTPException(status_code=404, detail="Preset not found")
         job.preset_id = preset.preset_id
         job.pipeline = preset.pipeline
+        if job.thumbnail_interval is None:
+            job.thumbnail_interval = preset.thumbnail_interval
     elif job.pipeline is None:
         raise HTTPException(
             status_code=400,
             detail="Either preset_id or pipeline must be provided",
         )
+    job.pipeline = apply_speed_tier(job.pipeline, job.speed_tier)
+    validate_callback_url(job.callback_url)
+    if await Job.exists(job_id=job.job_id):
+        raise HTTPException(status_code=422, detail="A job with this ID already exists")
+
+    if job.depends_on:
+        if job.job_id in job.depends_on:
+            raise HTTPException(status_code=400, detail="A job can't depend on itself")
+        dependencies = await Job.filter(job_id__in=job.depends_on)
+        if len(dependencies) < len(set(job.depends_on)):
+            found = {dependency.job_id for dependency in dependencies}
+            missing = [job_id for job_id in job.depends_on if job_id not in found]
+            raise HTTPException(
+                status_code=404, detail=f"Dependencies not found: {', '.join(missing)}"
+            )
+
+    # Only submissions which would be accepted count against the client's rate limit
+    await request.state.admission.admit(client_id(request))
+
+    # The job's trace starts here, and every attempt at it continues this span
+    with span("submit_job", attributes={"job.id": job.job_id}):
+        if job.depends_on:
+            # Jobs with dependencies wait to be dispatched by the work queue. They aren't
+            # deduplicated, as their input usually doesn't exist until a dependency
+            # completes.
+            new_job = await Job.create(
+                **job.dict(exclude={"dedupe", "depends_on"}),
+                state=Job.STATE_WAITING,
+                trace_parent=current_traceparent(),
+            )
+            await new_job.dependencies.add(*dependencies)
+            await request.state.event_consumer.settle_dependencies(new_job)
+            return {"job_id": job.job_id}
+
+        # Create a record in the database
+        new_job = await Job.create(
+            **job.dict(exclude={"dedupe", "depends_on"}),
+            trace_parent=current_traceparent(),
+        )
 
-    # Create a record in the database
-    await Job.create(**job.dict())
+        with span("enqueue_job"):
+            await enqueue_job(request, new_job, job.dedupe)
 
-    job_submission_message = JobSubmissionMessage(
-        job_id=job.job_id,
-        input_s3_path=job.input_s3_path,
-        output_s3_path=job.output_s3_path,
-        transcode_options=job.pipeline,
-    )
+    return {"job_id": job.job_id}
 
-    await channel.default_exchange.publish(
-        aio_pika.Message(
-            json.dumps(asdict(job_submission_message)).encode(),
-            content_type="application/json",
-        ),
-        routing_key=JOB_QUEUE_NAME,
-    )
 
-    return {"job_id": job.job_id}
+@app.get("/jobs", response_model=List[JobStatusOut])
+async def list_jobs(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(
+        None, description="Opaque cursor from the X-Next-Cursor header of a prior page"
+    ),
+    state: Optional[List[str]] = Query(None),
+    preset_id: Optional[str] = None,
+    error_type: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+):
+    """
+    List jobs, newest first.
 
+    Pages are walked with keyset pagination on (created_at, id): pass the value of the
+    X-Next-Cursor response header as `cursor` to fetch the next page. `skip` is still
+    accepted for offset pagination when no cursor is given, but gets slower the deeper
+    the page.
+    """
+    query = Job.all()
+
+    if state:
+        query = query.filter(state__in=state)
+    if preset_id:
+        query = query.filter(preset_id=preset_id)
+    if error_type:
+        query = query.filter(error_type=error_type)
+    if created_after:
+        query = query.filter(created_at__gte=created_after)
+    if created_before:
+        query = query.filter(created_at__lt=created_before)
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        # The redundant created_at bound keeps this a single index range scan
+        query = query.filter(created_at__lte=cursor_created_at).filter(
+            Q(created_at__lt=cursor_created_at) | Q(id__lt=cursor_id)
+        )
+    elif skip:
+        query = query.offset(skip)
 
-@app.get("/jobs", response_model=List[JobOut])
-async def list_jobs(skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100)):
+    # Fetch one extra row to find out if there is another page
     jobs = (
-        await Job.all()
-        .offset(skip)
-        .limit(limit)
+        await query.order_by("-created_at", "-id")
+        .limit(limit + 1)
         .prefetch_related("preset", "playlists")
     )
     if len(jobs) == 0:
         raise HTTPException(status_code=404, detail="No jobs found")
+
+    if len(jobs) > limit:
+        jobs = jobs[:limit]
+        next_cursor = encode_cursor(jobs[-1].created_at, jobs[-1].id)
+        next_url = request.url.remove_query_params("skip").include_query_params(
+            cursor=next_cursor
+        )
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    for job in jobs:
+        job.eta_seconds = request.state.event_consumer.eta(job.job_id)
     return jobs
 
 
-@app.get("/jobs/{job_id}", response_model=JobOut)
-async def get_job(job_id: str):
+def parse_wait(wait: str) -> float:
+    """
+    Parse a long-poll duration such as "30", "30s", "1500ms" or "1m".
+
+    :param wait: The duration.
+    :return: The duration in seconds, capped at LONG_POLL_MAX_SECONDS.
+    """
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)(ms|s|m)?", wait.strip())
+    if match is None:
+        raise HTTPException(status_code=400, detail=f"Invalid wait duration: {wait}")
+    value, unit = float(match.group(1)), match.group(2) or "s"
+    seconds = value * {"ms": 0.001, "s": 1, "m": 60}[unit]
+    return min(seconds, LONG_POLL_MAX_SECONDS)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusOut)
+async def get_job(
+    request: Request, response: Response, job_id: str, wait: Optional[str] = None
+):
+    """
+    Fetch a job. Responses carry an ETag, and a request whose If-None-Match still
+    matches gets a 304 without the job being loaded.
+
+    With wait, a request whose If-None-Match matches is parked until the job changes
+    or the wait runs out, whichever is first, so clients see changes as they happen
+    without polling.
+
+    Running jobs carry an estimate of the seconds they have left. It is left out of
+    the ETag, so that it alone doesn't wake up parked requests.
+    """
+    timeout = parse_wait(wait) if wait is not None else 0
+    if_none_match = [
+        tag.strip() for tag in request.headers.get("if-none-match", "").split(",")
+    ]
+    deadline = asyncio.get_running_loop().time() + timeout
+
+    etag = await job_etag_by_id(job_id)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    while etag in if_none_match:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            return Response(status_code=304, headers={"ETag": etag})
+        # Results and progress reach whichever instance consumes them, so also wake
+        # up now and then to see changes another instance made
+        await request.state.event_manager.wait_for_event(
+            job_id, min(remaining, LONG_POLL_RECHECK_SECONDS)
+        )
+        etag = await job_etag_by_id(job_id)
+        if etag is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+
     job = await Job.get_or_none(job_id=job_id).prefetch_related("preset", "playlists")
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    response.headers["ETag"] = job_etag(job.updated_at)
+    job.eta_seconds = request.state.event_consumer.eta(job.job_id)
     return job
 
 
@@ -247,60 +590,115 @@ async def update_job(job_id: str, job: JobUpdate):
     return existing_job
 
 
+@app.post("/jobs/{job_id}/cancel", response_model=JobOut)
+async def cancel_job(request: Request, job_id: str):
+    job = await Job.get_or_none(job_id=job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not await request.state.event_consumer.cancel_job(job, "cancelled by request"):
+        raise HTTPException(status_code=409, detail="Job has already finished")
+    return await Job.get(job_id=job_id).prefetch_related("preset", "playlists")
+
+
 @app.post("/presets", response_model=PresetOut)
-async def create_preset(preset: PresetCreate):
-    new_preset = await Preset.create(**preset.dict())
+async def create_preset(request: Request, preset: PresetCreate):
+    """
+    Create a preset. Its pipeline is compiled from its structured fields unless one
+    is given.
+    """
+    compiled = preset.pipeline is None
+    if compiled:
+        try:
+            preset.pipeline = compile_pipeline(**preset_fields(preset))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    new_preset = await Preset.create(**preset.dict(), compiled=compiled)
+    await request.state.preset_cache.broadcast_invalidation(
+        channel, new_preset.preset_id
+    )
     return new_preset
 
 
 @app.get("/presets", response_model=List[PresetOut])
 async def list_presets(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
     input_type: Optional[str] = None,
     output_type: Optional[str] = None,
 ):
-    query = Preset.all()
+    presets = await request.state.preset_cache.load()
 
     if input_type:
-        query = query.filter(input_type=input_type)
+        presets = [preset for preset in presets if preset.input_type == input_type]
 
     if output_type:
-        query = query.filter(output_type=output_type)
+        presets = [preset for preset in presets if preset.output_type == output_type]
 
-    presets = await query.offset(skip).limit(limit)
+    presets = presets[skip : skip + limit]
 
     if len(presets) == 0:
         raise HTTPException(status_code=404, detail="No presets found")
+
+    etag = presets_etag(presets)
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return presets
 
 
 @app.get("/presets/{preset_id}", response_model=PresetOut)
-async def get_preset(preset_id: str):
-    preset = await Preset.get_or_none(preset_id=preset_id)
+async def get_preset(request: Request, preset_id: str):
+    preset = await request.state.preset_cache.get(preset_id)
     if not preset:
         raise HTTPException(status_code=404, detail="Preset not found")
     return preset
 
 
 @app.put("/presets/{preset_id}", response_model=PresetOut)
-async def update_preset(preset_id: str, preset: PresetUpdate):
+async def update_preset(request: Request, preset_id: str, preset: PresetUpdate):
+    """
+    Update a preset. A pipeline which was compiled from the preset's structured
+    fields is compiled again from the updated ones. Giving a pipeline replaces it,
+    and the preset then keeps that pipeline when its fields change.
+    """
     existing_preset = await Preset.get_or_none(preset_id=preset_id)
     if not existing_preset:
         raise HTTPException(status_code=404, detail="Preset not found")
 
+    if preset.pipeline is not None:
+        existing_preset.compiled = False
+    elif existing_preset.compiled is None:
+        # Created before this was recorded, so only the pipeline itself can tell
+        try:
+            existing_preset.compiled = existing_preset.pipeline == compile_pipeline(
+                **preset_fields(existing_preset)
+            )
+        except ValueError:
+            existing_preset.compiled = False
     for key, value in preset.dict(exclude_none=True).items():
         setattr(existing_preset, key, value)
+    if existing_preset.compiled:
+        try:
+            existing_preset.pipeline = compile_pipeline(
+                **preset_fields(existing_preset)
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     await existing_preset.save()
+    await request.state.preset_cache.broadcast_invalidation(channel, preset_id)
     return existing_preset
 
 
 @app.delete("/presets/{preset_id}", response_model=PresetOut)
-async def delete_preset(preset_id: str):
+async def delete_preset(request: Request, preset_id: str):
     preset = await Preset.get_or_none(preset_id=preset_id)
     if not preset:
         raise HTTPException(status_code=404, detail="Preset not found")
     await preset.delete()
+    await request.state.preset_cache.broadcast_invalidation(channel, preset_id)
     return preset
 
 
@@ -311,79 +709,162 @@ async def delete_preset(preset_id: str):
 async def list_playlists(
     skip: int = Query(0, ge=0),
     deep: bool = Query(False, description="Include full jobs in response"),
+    summary: bool = Query(
+        False, description="Include a rollup of job states (shallow listing only)"
+    ),
     limit: int = Query(10, ge=1, le=100),
     name: Optional[str] = None,
 ):
-    query = Playlist.all().prefetch_related("jobs", "jobs__preset")
+    query = Playlist.all()
 
     if name:
         query = query.filter(name=name)
 
+    if deep:
+        query = query.prefetch_related("jobs", "jobs__preset")
+
     playlists = await query.offset(skip).limit(limit)
 
     if len(playlists) == 0:
         raise HTTPException(status_code=404, detail="No playlists found")
     if deep:
         return playlists
+
+    # Shallow listings only need the job IDs, which live in the join table
+    playlist_ids = [playlist.id for playlist in playlists]
+    job_ids = await playlist_job_ids(playlist_ids)
+    summaries = await playlist_summaries(playlist_ids) if summary else {}
     return [
         PlaylistShallowOut(
             playlist_id=str(playlist.id),
             name=playlist.name,
-            jobs=[str(job.id) for job in playlist.jobs],
+            jobs=job_ids.get(playlist.id, []),
             created_at=playlist.created_at,
             updated_at=playlist.updated_at,
+            packaging=playlist.packaging,
+            manifest_s3_path=playlist.manifest_s3_path,
+            summary=summaries.get(playlist.id, PlaylistSummary()) if summary else None,
         )
         for playlist in playlists
     ]
 
 
-@app.post("/playlists", response_model=PlaylistCreateOut)
-async def create_playlist(playlist: PlaylistCreate):
-    # Create the playlist
-    new_playlist = await Playlist.create(
-        name=playlist.name, input_s3_path=playlist.input_s3_path
-    )
+@app.get("/playlists/{playlist_id}/summary", response_model=PlaylistSummary)
+async def get_playlist_summary(playlist_id: str):
+    playlist = await Playlist.get_or_none(id=playlist_id)
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    summaries = await playlist_summaries([playlist.id])
+    return summaries.get(playlist.id, PlaylistSummary())
 
-    # Create jobs for each preset
-    jobs = []
-    for idx, preset_id in enumerate(playlist.presets):
-        job_id = f"{playlist.name}-{idx}"
 
-        # Get the preset
-        preset = await Preset.get_or_none(preset_id=preset_id)
+@app.post("/playlists/{playlist_id}/cancel", response_model=PlaylistCancelOut)
+async def cancel_playlist(request: Request, playlist_id: str):
+    playlist = await Playlist.get_or_none(id=playlist_id)
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    cancelled = []
+    for job in await Job.filter(
+        playlists__id=playlist.id, state__in=CANCELLABLE_STATES
+    ):
+        if await request.state.event_consumer.cancel_job(
+            job, f"playlist {playlist.name} cancelled by request"
+        ):
+            cancelled.append(job.job_id)
+    return PlaylistCancelOut(playlist_id=str(playlist.id), cancelled=cancelled)
+
+
+@app.post("/playlists", response_model=PlaylistCreateOut)
+async def create_playlist(request: Request, playlist: PlaylistCreate):
+    if playlist.packaging not in (None, Playlist.PACKAGING_HLS):
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported packaging: {playlist.packaging}"
+        )
+
+    # Get the presets
+    presets = []
+    for preset_id in playlist.presets:
+        preset = await request.state.preset_cache.get(preset_id)
         if not preset:
             raise HTTPException(status_code=404, detail="Preset not found")
+        presets.append(preset)
 
-        # Define the output S3 path
-        output_s3_path = f"{new_playlist.id}/{preset_id}/{job_id}.mp4"
-
-        # Create the job
-        job = await Job.create(
-            job_id=job_id,
-            input_s3_path=playlist.input_s3_path,
-            output_s3_path=output_s3_path,
-            pipeline=preset.pipeline,
-            preset_id=preset_id,
+    validate_callback_url(playlist.callback_url)
+    if await Playlist.exists(name=playlist.name):
+        raise HTTPException(
+            status_code=422, detail="A playlist with this name already exists"
+        )
+    job_ids = [f"{playlist.name}-{idx}" for idx in range(len(presets))]
+    if await Job.exists(job_id__in=job_ids):
+        raise HTTPException(
+            status_code=422, detail="A job with this playlist's job IDs already exists"
         )
 
-        # Add the job to the playlist
-        await new_playlist.jobs.add(job)
+    # Each rendition counts as a submission of its own, once the playlist would be
+    # accepted
+    await request.state.admission.admit(client_id(request), len(presets))
 
-        job_submission_message = JobSubmissionMessage(
-            job_id=job.job_id,
-            input_s3_path=job.input_s3_path,
-            output_s3_path=job.output_s3_path,
-            transcode_options=job.pipeline,
-        )
+    # Create the playlist
+    new_playlist = await Playlist.create(
+        name=playlist.name,
+        input_s3_path=playlist.input_s3_path,
+        packaging=playlist.packaging,
+        callback_url=playlist.callback_url,
+    )
 
-        await channel.default_exchange.publish(
-            aio_pika.Message(
-                json.dumps(asdict(job_submission_message)).encode(),
-                content_type="application/json",
-            ),
-            routing_key=JOB_QUEUE_NAME,
+    if playlist.packaging == Playlist.PACKAGING_HLS:
+        # Publish the master playlist up front so players can start on whichever
+        # renditions have segments available
+        new_playlist.manifest_s3_path = f"{new_playlist.id}/{HLS_MASTER_PLAYLIST_NAME}"
+        master_playlist = hls_master_playlist(
+            [
+                (preset, f"{preset_id}/{HLS_MEDIA_PLAYLIST_NAME}")
+                for preset_id, preset in zip(playlist.presets, presets)
+            ]
+        )
+        await asyncio.to_thread(
+            storage.put_bytes,
+            new_playlist.manifest_s3_path,
+            master_playlist.encode(),
+            content_type="application/vnd.apple.mpegurl",
         )
 
+    # Create jobs for each preset
+    jobs = []
+    for job_id, preset_id, preset in zip(job_ids, playlist.presets, presets):
+        # Define the output S3 path
+        if playlist.packaging == Playlist.PACKAGING_HLS:
+            output_s3_path = f"{new_playlist.id}/{preset_id}/{HLS_MEDIA_PLAYLIST_NAME}"
+        else:
+            output_s3_path = f"{new_playlist.id}/{preset_id}/{job_id}.mp4"
+
+        # Each rendition is traced as a job of its own
+        with span(
+            "submit_job",
+            attributes={"job.id": job_id, "playlist.id": str(new_playlist.id)},
+        ):
+            # Create the job
+            job = await Job.create(
+                job_id=job_id,
+                input_s3_path=playlist.input_s3_path,
+                output_s3_path=output_s3_path,
+                pipeline=apply_speed_tier(preset.pipeline, playlist.speed_tier),
+                preset_id=preset_id,
+                packaging=playlist.packaging,
+                thumbnail_interval=preset.thumbnail_interval,
+                speed_tier=playlist.speed_tier,
+                trace_parent=current_traceparent(),
+            )
+
+            # Add the job to the playlist
+            await new_playlist.jobs.add(job)
+
+            # Packaged outputs are a set of segments, which deduplication can't copy
+            with span("enqueue_job"):
+                await enqueue_job(
+                    request, job, playlist.dedupe and not playlist.packaging
+                )
+
         jobs.append(job_id)
 
     await new_playlist.save()
@@ -392,6 +873,41 @@ async def create_playlist(playlist: PlaylistCreate):
         playlist_id=str(new_playlist.id),
         input_s3_path=playlist.input_s3_path,
         jobs=jobs,
+        manifest_s3_path=new_playlist.manifest_s3_path,
+    )
+
+
+@app.get("/media/{s3_path:path}", response_model=MediaInfoOut)
+async def get_media_info(s3_path: str):
+    """
+    Get the probed properties of a source, which workers record the first time they run
+    a job on it.
+    """
+    media = await MediaInfo.get_or_none(s3_path=s3_path)
+    if not media:
+        raise HTTPException(status_code=404, detail="Media has not been probed")
+    return media
+
+
+@app.get("/stats/dedup")
+async def dedup_stats(request: Request):
+    """
+    Report how often submitted jobs reused the output of an identical job on this API
+    instance.
+    """
+    return request.state.deduplicator.stats()
+
+
+@app.get("/stats/queue", response_model=QueueStats)
+async def get_queue_stats(request: Request):
+    """
+    Report queue depth, estimated backlog and worker count, for autoscaling the workers.
+
+    Backlog estimates come from the preset throughput and job progress this API
+    instance has observed.
+    """
+    return await queue_stats(
+        channel, request.state.preset_throughput, request.state.eta_estimator
     )
 
 
@@ -420,7 +936,7 @@ async def progress(websocket: WebSocket, job_id: str):
         await websocket.send_json({"error": "Job not yet submitted"})
 
     # If the job is already done, send the completion message and close the connection
-    if job.state != Job.STATE_IN_PROGRESS and job.state != Job.STATE_QUEUED:
+    if job.state not in CANCELLABLE_STATES:
         result_message = JobResultMessage(
             timestamp=None,
             worker_id=None,
@@ -436,8 +952,9 @@ async def progress(websocket: WebSocket, job_id: str):
 
     # If we have a progress message for the job, send it to the client
     if job_id in websocket.state.event_consumer.last_progress_messages:
-        message = websocket.state.event_consumer.last_progress_messages[job_id]
-        await websocket.send_json(asdict(message))
+        event_consumer = websocket.state.event_consumer
+        message = event_consumer.last_progress_messages[job_id]
+        await websocket.send_json(event_consumer.progress_frame(message))
 
     # Add the client to the event manager so we can send it progress messages
     websocket.state.event_manager.add_connection(job_id, websocket)
@@ -455,12 +972,11 @@ async def progress(websocket: WebSocket, job_id: str):
 
 @app.get("/download/{filename}")
 async def download_file(filename: str):
-    if not s3.head_object(Bucket=S3_BUCKET_NAME, Key=filename):
+    try:
+        file = storage.get_bytes(filename)
+    except ObjectNotFound:
         raise HTTPException(status_code=404, detail="File not found")
 
-    fileobj = s3.get_object(Bucket=S3_BUCKET_NAME, Key=filename)
-    file = fileobj["Body"].read()
-
     def file_stream():
         yield file
 
@@ -471,12 +987,10 @@ async def download_file(filename: str):
 async def generate_presigned_url(filename: str):
     try:
         # Generate a pre-signed URL for the given file
-        presigned_url = s3.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": S3_BUCKET_NAME, "Key": filename},
-            ExpiresIn=3600,  # URL valid for 1 hour
+        presigned_url = storage.presigned_url(
+            filename, expires_in=3600  # URL valid for 1 hour
         )
-    except ClientError as e:
+    except StorageError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
     if not presigned_url:
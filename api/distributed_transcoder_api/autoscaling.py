@@ -0,0 +1,133 @@
+from typing import Dict, Optional, Tuple
+
+import aio_pika
+from distributed_transcoder_common.models import Job
+
+from .dispatch import (
+    DEAD_LETTER_QUEUE_NAME,
+    JOB_QUEUE_NAME,
+    RETRY_DELAYS_SECONDS,
+    retry_queue_name,
+)
+from .eta import EtaEstimator
+from .queries import running_jobs, unfinished_job_counts
+from .schemas import PresetBacklog, QueueStats
+from .throughput import PresetThroughput
+
+
+async def _queue_size(channel: aio_pika.Channel, name: str) -> Tuple[int, int]:
+    queue = await channel.declare_queue(name, passive=True)
+    return (
+        queue.declaration_result.message_count,
+        queue.declaration_result.consumer_count,
+    )
+
+
+async def queue_stats(
+    channel: aio_pika.Channel,
+    throughput: PresetThroughput,
+    eta_estimator: EtaEstimator,
+) -> QueueStats:
+    """
+    Gather the signals an autoscaler needs to size the worker fleet: how much work is
+    waiting, how long it should take, and how many workers are taking it.
+
+    :param channel: The channel to inspect the job queues through.
+    :param throughput: The usual encode speed of each preset.
+    :param eta_estimator: The progress seen of each running job.
+    :return: The queue stats.
+    """
+    queue_depth, workers = await _queue_size(channel, JOB_QUEUE_NAME)
+    retry_queue_depth = 0
+    for delay in RETRY_DELAYS_SECONDS:
+        retry_queue_depth += (await _queue_size(channel, retry_queue_name(delay)))[0]
+    dead_letter_queue_depth, _ = await _queue_size(channel, DEAD_LETTER_QUEUE_NAME)
+
+    presets: Dict[str, PresetBacklog] = {}
+    backlog_seconds = 0.0
+    unestimated_jobs = 0
+
+    def add_backlog(preset_id: Optional[str], seconds: Optional[float], jobs: int = 1):
+        nonlocal backlog_seconds, unestimated_jobs
+        if seconds is None:
+            unestimated_jobs += jobs
+            return
+        backlog_seconds += seconds
+        if preset_id is not None:
+            backlog = presets.setdefault(str(preset_id), PresetBacklog())
+            backlog.backlog_seconds = (backlog.backlog_seconds or 0.0) + seconds
+
+    unfinished = await unfinished_job_counts()
+    # How long the sources of each preset's jobs usually are, from those probed so far
+    probed: Dict[str, Tuple[int, float]] = {}
+    for (preset_id, state), jobs in unfinished.items():
+        if preset_id is not None:
+            count, media_seconds = probed.get(str(preset_id), (0, 0.0))
+            probed[str(preset_id)] = (
+                count + jobs.probed,
+                media_seconds + jobs.media_seconds,
+            )
+
+    def mean_source_seconds(preset_id: Optional[str]) -> Optional[float]:
+        count, media_seconds = probed.get(str(preset_id), (0, 0.0))
+        return media_seconds / count if count else None
+
+    for (preset_id, state), jobs in unfinished.items():
+        if preset_id is not None:
+            backlog = presets.setdefault(str(preset_id), PresetBacklog())
+            if state == Job.STATE_IN_PROGRESS:
+                backlog.in_progress += jobs.count
+            elif state == Job.STATE_WAITING:
+                backlog.waiting += jobs.count
+            else:
+                backlog.queued += jobs.count
+        if state == Job.STATE_IN_PROGRESS:
+            continue
+        # Encode time follows the length of the source at the preset's usual speed,
+        # jobs whose source isn't probed yet are assumed to be of the usual length
+        speed = throughput.speed(preset_id)
+        mean_seconds = mean_source_seconds(preset_id)
+        if speed is None or mean_seconds is None:
+            add_backlog(preset_id, None, jobs.count)
+            continue
+        unprobed = jobs.count - jobs.probed
+        add_backlog(
+            preset_id,
+            (jobs.media_seconds + unprobed * mean_seconds) / speed,
+            jobs.count,
+        )
+
+    for preset_id, backlog in presets.items():
+        speed = throughput.speed(preset_id)
+        mean_seconds = mean_source_seconds(preset_id)
+        if speed is not None and mean_seconds is not None:
+            backlog.seconds_per_job = mean_seconds / speed
+
+    # Running jobs only count for the part they have left, as estimated from their
+    # own progress where it has been seen
+    for job_id, preset_id, duration_seconds in await running_jobs():
+        seconds = eta_estimator.eta(job_id)
+        if seconds is None:
+            if duration_seconds is None:
+                duration_seconds = mean_source_seconds(preset_id)
+            rate = throughput.rate(preset_id, duration_seconds)
+            if rate is not None:
+                seconds = (100 - (eta_estimator.percent(job_id) or 0)) / rate
+        add_backlog(preset_id, seconds)
+
+    # Jobs run in parallel across the workers, so the queue drains that much faster
+    # than the backlog adds up to
+    drain_seconds = None
+    if workers > 0:
+        drain_seconds = round(backlog_seconds / workers, 1)
+
+    return QueueStats(
+        queue_depth=queue_depth,
+        retry_queue_depth=retry_queue_depth,
+        dead_letter_queue_depth=dead_letter_queue_depth,
+        workers=workers,
+        backlog_seconds=round(backlog_seconds, 1),
+        unestimated_jobs=unestimated_jobs,
+        drain_seconds=drain_seconds,
+        presets=presets,
+    )
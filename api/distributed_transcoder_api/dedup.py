@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+from distributed_transcoder_common import Storage, StorageError
+from distributed_transcoder_common.models import Job
+
+
+def normalize_pipeline(pipeline: str) -> str:
+    """
+    Normalize a pipeline string so that cosmetic differences don't defeat deduplication.
+
+    :param pipeline: The GStreamer pipeline template.
+    :return: The pipeline with whitespace collapsed around links, caps and properties.
+    """
+    pipeline = re.sub(r"\s+", " ", pipeline.strip())
+    return re.sub(r"\s*([!,=])\s*", r"\1", pipeline)
+
+
+class OutputDeduplicator:
+    """
+    Reuses the output of a previous job when the same input object is transcoded with the
+    same pipeline, rather than encoding it again.
+    """
+
+    def __init__(self, storage: Storage, logger: logging.Logger):
+        self.storage = storage
+        self.logger = logger
+        self.hits = 0
+        self.inflight_hits = 0
+        self.misses = 0
+
+    def compute_key(self, input_s3_path: str, pipeline: str) -> Optional[str]:
+        """
+        Compute the deduplication key for an input object and pipeline.
+
+        :param input_s3_path: The key of the input object.
+        :param pipeline: The GStreamer pipeline template.
+        :return: The hex digest key, or None if the input object can't be inspected.
+        """
+        try:
+            head = self.storage.head(input_s3_path)
+        except StorageError as e:
+            self.logger.info(
+                f"Unable to inspect {input_s3_path} for deduplication: {e}"
+            )
+            return None
+        fingerprint = f"{head.etag}\n{head.size}\n{normalize_pipeline(pipeline)}"
+        return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+    def copy_output(self, source_s3_path: str, output_s3_path: str):
+        """
+        Copy an existing output to a new job's output path.
+
+        :param source_s3_path: The key of the output to reuse.
+        :param output_s3_path: The key the new job expects its output at.
+        """
+        if source_s3_path == output_s3_path:
+            return
+        self.storage.copy(source_s3_path, output_s3_path)
+
+    async def try_reuse(self, job: Job) -> bool:
+        """
+        Satisfy a newly created job from an identical completed or in-flight job.
+
+        :param job: The new job, with its dedup_key set.
+        :return: True if the job was satisfied or attached to an in-flight job and should
+            not be enqueued, False otherwise.
+        """
+        if job.dedup_key is None:
+            return False
+
+        completed = (
+            await Job.filter(dedup_key=job.dedup_key, state=Job.STATE_COMPLETED)
+            .exclude(job_id=job.job_id)
+            .order_by("-transcode_completed_at")
+            .first()
+        )
+        if completed is not None:
+            try:
+                await asyncio.to_thread(
+                    self.copy_output, completed.output_s3_path, job.output_s3_path
+                )
+            except StorageError as e:
+                self.logger.error(
+                    f"Unable to reuse output of job {completed.job_id} for job {job.job_id}: {e}"
+                )
+            else:
+                self.logger.info(
+                    f"Job {job.job_id} reused the output of completed job {completed.job_id}"
+                )
+                job.state = Job.STATE_COMPLETED
+                job.transcode_completed_at = datetime.now()
+                await job.save()
+                self.hits += 1
+                return True
+
+        in_flight = (
+            await Job.filter(
+                dedup_key=job.dedup_key,
+                dedup_of=None,
+                # A job backing off after a transient error will still run again
+                state__in=[
+                    Job.STATE_QUEUED,
+                    Job.STATE_IN_PROGRESS,
+                    Job.STATE_RETRYING,
+                ],
+            )
+            .exclude(job_id=job.job_id)
+            .order_by("created_at")
+            .first()
+        )
+        if in_flight is not None:
+            self.logger.info(
+                f"Job {job.job_id} will reuse the output of in-flight job {in_flight.job_id}"
+            )
+            job.dedup_of = in_flight.job_id
+            await job.save()
+            self.inflight_hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    async def complete_followers(self, primary: Job) -> List[Job]:
+        """
+        Give the output of a finished job to every job that was waiting on it.
+
+        :param primary: The job that just completed.
+        :return: The follower jobs that were completed.
+        """
+        completed = []
+        async for follower in Job.filter(
+            dedup_of=primary.job_id, state=Job.STATE_QUEUED
+        ):
+            try:
+                await asyncio.to_thread(
+                    self.copy_output, primary.output_s3_path, follower.output_s3_path
+                )
+                follower.state = Job.STATE_COMPLETED
+            except StorageError as e:
+                follower.state = Job.STATE_FAILED
+                follower.error = str(e)
+                follower.error_type = "dedup_copy"
+            follower.transcode_completed_at = datetime.now()
+            await follower.save()
+            completed.append(follower)
+        return completed
+
+    async def release_followers(self, primary: Job) -> List[Job]:
+        """
+        Detach the jobs waiting on a job that didn't complete so they can run on their own.
+
+        :param primary: The job that failed or stalled.
+        :return: The follower jobs, which must be enqueued by the caller.
+        """
+        followers = await Job.filter(dedup_of=primary.job_id, state=Job.STATE_QUEUED)
+        for follower in followers:
+            follower.dedup_of = None
+            await follower.save()
+        return followers
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.hits + self.inflight_hits + self.misses
+        return {
+            "hits": self.hits,
+            "inflight_hits": self.inflight_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.inflight_hits) / lookups if lookups else 0.0,
+        }
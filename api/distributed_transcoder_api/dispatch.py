@@ -0,0 +1,140 @@
+import os
+from typing import Dict, Optional
+
+import aio_pika
+from distributed_transcoder_common.message_types import (
+    CONTENT_TYPE_JSON,
+    JobControlMessage,
+    JobSubmissionMessage,
+    encode_message,
+)
+from distributed_transcoder_common.models import Job
+from distributed_transcoder_common.tracing import trace_headers
+
+from .preset_cache import PresetCache
+
+# Define constants for the queue jobs are dispatched on and the exchange workers are
+# controlled through
+JOB_QUEUE_NAME = "transcoding_jobs"
+CONTROL_EXCHANGE_NAME = "job_control"
+DEAD_LETTER_QUEUE_NAME = f"{JOB_QUEUE_NAME}.dead"
+
+# Encoding of published messages. Consumers decode either, so switch this to
+# application/x-msgpack once every worker runs a version that understands it.
+MESSAGE_CONTENT_TYPE = os.environ.get("MESSAGE_CONTENT_TYPE", CONTENT_TYPE_JSON)
+
+# Backoff before each retry of a job that failed with a transient error, these must
+# match the workers' as they declare the same delay queues
+RETRY_DELAYS_SECONDS = [10, 60, 300]
+
+
+# Preset fields describing its output, which workers compare with the probed source
+TARGET_FIELDS = (
+    "output_type",
+    "resolution",
+    "video_encoding",
+    "video_bitrate",
+    "audio_encoding",
+    "audio_bitrate",
+)
+
+
+def retry_queue_name(delay_seconds: int) -> str:
+    return f"{JOB_QUEUE_NAME}.retry.{delay_seconds}s"
+
+
+async def job_target(job: Job, presets: PresetCache) -> Optional[Dict[str, str]]:
+    """
+    Describe the output of a job that runs its preset's pipeline unchanged.
+
+    :param job: The job.
+    :param presets: The cached presets to look the job's preset up in.
+    :return: The preset's output fields, or None for jobs with a custom pipeline.
+    """
+    if job.preset_id is None:
+        return None
+    preset = await presets.get(job.preset_id)
+    if preset is None or preset.pipeline != job.pipeline:
+        return None
+    return {field: getattr(preset, field) for field in TARGET_FIELDS}
+
+
+async def publish_job(
+    channel: aio_pika.Channel,
+    job: Job,
+    presets: PresetCache,
+    speculative: bool = False,
+    attempt: int = 0,
+    routing_key: str = JOB_QUEUE_NAME,
+):
+    """
+    Publish a submission message for a job to the job queue.
+
+    :param channel: The channel to publish on.
+    :param job: The job to hand to the workers.
+    :param presets: The cached presets, which the job's output target comes from.
+    :param speculative: Whether this is a backup copy of a job that is already running.
+    :param attempt: The number of earlier attempts that failed with a transient error.
+    :param routing_key: The queue to publish to, if not the job queue.
+    """
+    job_submission_message = JobSubmissionMessage(
+        job_id=job.job_id,
+        input_s3_path=job.input_s3_path,
+        output_s3_path=job.output_s3_path,
+        transcode_options=job.pipeline,
+        packaging=job.packaging,
+        speculative=speculative,
+        attempt=attempt,
+        target=await job_target(job, presets),
+        thumbnail_interval=job.thumbnail_interval,
+    )
+
+    await channel.default_exchange.publish(
+        aio_pika.Message(
+            encode_message(job_submission_message, MESSAGE_CONTENT_TYPE),
+            content_type=MESSAGE_CONTENT_TYPE,
+            # Workers continue the job's trace, whichever attempt this is
+            headers=trace_headers(job.trace_parent),
+        ),
+        routing_key=routing_key,
+    )
+
+
+async def retry_job(channel: aio_pika.Channel, job: Job, presets: PresetCache) -> bool:
+    """
+    Requeue a job after the backoff for its next attempt, or dead-letter it once it has
+    run out of attempts.
+
+    :param channel: The channel to publish on.
+    :param job: The job to retry, with attempts set to the attempt that just failed.
+    :param presets: The cached presets, which the job's output target comes from.
+    :return: True if the job was requeued, False if it was dead-lettered.
+    """
+    attempt = job.attempts + 1
+    if attempt > len(RETRY_DELAYS_SECONDS):
+        await publish_job(
+            channel, job, presets, attempt=attempt, routing_key=DEAD_LETTER_QUEUE_NAME
+        )
+        return False
+    delay = RETRY_DELAYS_SECONDS[attempt - 1]
+    await publish_job(
+        channel, job, presets, attempt=attempt, routing_key=retry_queue_name(delay)
+    )
+    return True
+
+
+async def publish_control(channel: aio_pika.Channel, msg: JobControlMessage):
+    """
+    Broadcast a control message to every worker.
+
+    :param channel: The channel to publish on.
+    :param msg: The control message.
+    """
+    exchange = await channel.get_exchange(CONTROL_EXCHANGE_NAME)
+    await exchange.publish(
+        aio_pika.Message(
+            encode_message(msg, MESSAGE_CONTENT_TYPE),
+            content_type=MESSAGE_CONTENT_TYPE,
+        ),
+        routing_key="",
+    )
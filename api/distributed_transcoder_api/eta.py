@@ -0,0 +1,167 @@
+import time
+from array import array
+from typing import Dict, Optional, Tuple
+
+from distributed_transcoder_common import JobProgressMessage
+
+from .throughput import PresetThroughput
+
+
+class ProgressHistory:
+    """
+    The latest (timestamp, percent) samples of one running job, in a ring buffer of
+    fixed capacity so that the memory held per job doesn't grow with its length.
+    """
+
+    __slots__ = (
+        "samples",
+        "capacity",
+        "start",
+        "count",
+        "worker_id",
+        "preset_id",
+        "duration_seconds",
+        "first_timestamp",
+    )
+
+    def __init__(
+        self,
+        worker_id: str,
+        preset_id: Optional[str],
+        capacity: int = 32,
+        duration_seconds: Optional[float] = None,
+    ):
+        # Timestamps and percents interleaved, two slots per sample
+        self.samples = array("d", bytes(16 * capacity))
+        self.capacity = capacity
+        self.start = 0
+        self.count = 0
+        self.worker_id = worker_id
+        self.preset_id = preset_id
+        # The duration of the job's source, which the preset's usual speed is scaled by
+        self.duration_seconds = duration_seconds
+        self.first_timestamp: Optional[float] = None
+
+    def add(self, timestamp: float, percent: float):
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        if self.count < self.capacity:
+            index = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            # Overwrite the oldest sample
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.samples[2 * index] = timestamp
+        self.samples[2 * index + 1] = percent
+
+    def last(self) -> Tuple[float, float]:
+        index = (self.start + self.count - 1) % self.capacity
+        return self.samples[2 * index], self.samples[2 * index + 1]
+
+    def rate(self) -> Optional[float]:
+        """
+        The progress rate over the buffered samples, as the least-squares slope of
+        percent against time, which smooths out the jitter of individual reports.
+
+        :return: The rate in percent per second, or None until the job has progressed.
+        """
+        if self.count < 2:
+            return None
+        t0 = self.samples[2 * self.start]
+        sum_t = sum_p = sum_tt = sum_tp = 0.0
+        for i in range(self.count):
+            index = (self.start + i) % self.capacity
+            t = self.samples[2 * index] - t0
+            p = self.samples[2 * index + 1]
+            sum_t += t
+            sum_p += p
+            sum_tt += t * t
+            sum_tp += t * p
+        denominator = self.count * sum_tt - sum_t * sum_t
+        if denominator <= 0:
+            return None
+        slope = (self.count * sum_tp - sum_t * sum_p) / denominator
+        return slope if slope > 0 else None
+
+
+class EtaEstimator:
+    """
+    Estimates the time left of each running job from the progress it reported, leaning
+    on its preset's usual throughput until the job has been observed for long enough
+    for its own rate to be trusted.
+    """
+
+    def __init__(
+        self,
+        throughput: PresetThroughput,
+        capacity: int = 32,
+        blend_seconds: float = 60,
+    ):
+        self.throughput = throughput
+        self.capacity = capacity
+        self.blend_seconds = blend_seconds
+        self.histories: Dict[str, ProgressHistory] = {}
+
+    def record(
+        self,
+        msg: JobProgressMessage,
+        preset_id: Optional[str],
+        duration_seconds: Optional[float] = None,
+    ):
+        """
+        Add a progress report to its job's history. While a speculative copy races the
+        original, the history follows whichever is further along, and a report from
+        another worker which overtakes it starts the history over.
+
+        :param msg: The progress report.
+        :param preset_id: The preset the job runs.
+        :param duration_seconds: The duration of the job's source, if it was probed.
+        """
+        history = self.histories.get(msg.job_id)
+        if history is not None and history.worker_id != msg.worker_id:
+            if msg.progress < history.last()[1]:
+                return
+            history = None
+        if history is None:
+            history = ProgressHistory(
+                msg.worker_id, preset_id, self.capacity, duration_seconds
+            )
+            self.histories[msg.job_id] = history
+        history.add(msg.timestamp, msg.progress)
+
+    def forget(self, job_id: str):
+        self.histories.pop(job_id, None)
+
+    def percent(self, job_id: str) -> Optional[float]:
+        history = self.histories.get(job_id)
+        return history.last()[1] if history is not None else None
+
+    def eta(self, job_id: str, now: Optional[float] = None) -> Optional[float]:
+        """
+        Estimate the seconds left of a running job.
+
+        :param job_id: The job.
+        :param now: The current time, defaulting to the wall clock.
+        :return: The seconds left, or None if the job hasn't reported progress or
+            neither it nor its preset has a known rate for its source.
+        """
+        history = self.histories.get(job_id)
+        if history is None:
+            return None
+        observed = history.rate()
+        expected = self.throughput.rate(history.preset_id, history.duration_seconds)
+        last_timestamp, percent = history.last()
+        if observed is None and expected is None:
+            return None
+        if observed is None:
+            rate = expected
+        elif expected is None:
+            rate = observed
+        else:
+            # Trust the job's own rate more the longer it has been observed
+            observed_seconds = last_timestamp - history.first_timestamp
+            weight = min(1.0, observed_seconds / self.blend_seconds)
+            rate = weight * observed + (1 - weight) * expected
+        now = time.time() if now is None else now
+        return max(0.0, (100 - percent) / rate - max(0.0, now - last_timestamp))
@@ -1,4 +1,5 @@
-from typing import Dict, List
+import asyncio
+from typing import Dict, List, Set
 
 from fastapi import WebSocket
 from starlette.websockets import WebSocketDisconnect
@@ -7,6 +8,7 @@ from starlette.websockets import WebSocketDisconnect
 class EventManager:
     def __init__(self):
         self.connections: Dict[str, List[WebSocket]] = {}
+        self.waiters: Dict[str, Set[asyncio.Event]] = {}
 
     def add_connection(self, job_id: str, websocket: WebSocket):
         if job_id not in self.connections:
@@ -16,7 +18,31 @@ class EventManager:
     def disconnect(self, job_id: str, websocket: WebSocket):
         self.connections[job_id].remove(websocket)
 
+    async def wait_for_event(self, job_id: str, timeout: float) -> bool:
+        """
+        Park until the next progress or completion message for a job, as long-polling
+        requests do.
+
+        :param job_id: The job to wait on.
+        :param timeout: The longest to wait, in seconds.
+        :return: True if a message arrived, False if the wait timed out.
+        """
+        event = asyncio.Event()
+        self.waiters.setdefault(job_id, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiters[job_id].discard(event)
+            if not self.waiters[job_id]:
+                del self.waiters[job_id]
+
     async def send_message(self, job_id: str, message_type: str, message: str):
+        for event in self.waiters.get(job_id, ()):
+            event.set()
+
         if job_id in self.connections:
             dead_connections = []
             for websocket in self.connections[job_id]:
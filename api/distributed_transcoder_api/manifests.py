@@ -0,0 +1,39 @@
+from typing import List, Tuple
+
+from distributed_transcoder_common.models import Preset
+
+HLS_MASTER_PLAYLIST_NAME = "master.m3u8"
+HLS_MEDIA_PLAYLIST_NAME = "index.m3u8"
+
+
+def _kbit(value: str) -> int:
+    try:
+        return int(float(value))
+    except ValueError:
+        return 0
+
+
+def hls_master_playlist(renditions: List[Tuple[Preset, str]]) -> str:
+    """
+    Build an HLS master playlist pointing at the media playlist of each rendition.
+
+    The media playlists don't have to exist yet: players pick them up as workers
+    upload their first segments.
+
+    :param renditions: Pairs of each rendition's preset and its media playlist URI,
+        relative to the master playlist.
+    :return: The master playlist contents.
+    """
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    # List the highest bandwidth rendition first, as players start with the first one
+    for preset, uri in sorted(
+        renditions,
+        key=lambda rendition: _kbit(rendition[0].video_bitrate),
+        reverse=True,
+    ):
+        bandwidth = (_kbit(preset.video_bitrate) + _kbit(preset.audio_bitrate)) * 1000
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={preset.resolution}"
+        )
+        lines.append(uri)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,32 @@
+from tortoise import connections
+
+# Tortoise's generate_schemas only creates missing tables, so columns added to existing
+# models are brought in here. Every statement must be idempotent, as they run on every
+# startup before generate_schemas (which then creates any missing indexes).
+SCHEMA_UPGRADES = [
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "dedup_key" VARCHAR(64)',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "dedup_of" VARCHAR(50)',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "packaging" VARCHAR(20)',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "attempts" INT NOT NULL DEFAULT 0',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "checkpoint" JSONB',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "thumbnail_interval" INT',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "callback_url" VARCHAR(2048)',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "worker_id" VARCHAR(50)',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "claim_token" INT NOT NULL DEFAULT 0',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "speed_tier" VARCHAR(20)',
+    'ALTER TABLE IF EXISTS "job" ADD COLUMN IF NOT EXISTS "trace_parent" VARCHAR(100)',
+    'ALTER TABLE IF EXISTS "preset" ADD COLUMN IF NOT EXISTS "thumbnail_interval" INT',
+    'ALTER TABLE IF EXISTS "preset" ADD COLUMN IF NOT EXISTS "compiled" BOOLEAN',
+    'ALTER TABLE IF EXISTS "playlist" ADD COLUMN IF NOT EXISTS "packaging" VARCHAR(20)',
+    'ALTER TABLE IF EXISTS "playlist" ADD COLUMN IF NOT EXISTS "manifest_s3_path" VARCHAR(255)',
+    'ALTER TABLE IF EXISTS "playlist" ADD COLUMN IF NOT EXISTS "callback_url" VARCHAR(2048)',
+]
+
+
+async def upgrade_schema():
+    """
+    Add columns introduced since a database was first created.
+    """
+    connection = connections.get("default")
+    for statement in SCHEMA_UPGRADES:
+        await connection.execute_script(statement)
@@ -0,0 +1,35 @@
+import base64
+import binascii
+import uuid
+from datetime import datetime
+from typing import Tuple
+
+from fastapi import HTTPException
+
+
+def encode_cursor(created_at: datetime, id: uuid.UUID) -> str:
+    """
+    Encode a keyset pagination cursor pointing at the given row.
+
+    :param created_at: The creation time of the last row on the page.
+    :param id: The primary key of the last row on the page.
+    :return: An opaque, URL-safe cursor string.
+    """
+    raw = f"{created_at.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """
+    Decode a keyset pagination cursor produced by encode_cursor.
+
+    :param cursor: The opaque cursor string.
+    :return: A tuple of the creation time and primary key of the last row seen.
+    :raises HTTPException: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), uuid.UUID(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,165 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Containers a preset can read or write, mapped to their demuxer and muxer
+DEMUXERS = {"mp4": "qtdemux", "mov": "qtdemux", "mkv": "matroskademux"}
+MUXERS = {"mp4": "mp4mux", "mov": "qtmux", "mkv": "matroskamux"}
+# Video encodings mapped to their encoder, which takes a bitrate in kbit/s, and parser
+VIDEO_ENCODERS = {"h264": ("x264enc", "h264parse"), "h265": ("x265enc", "h265parse")}
+# Audio encodings mapped to their encoder, which takes a bitrate in bit/s
+AUDIO_ENCODERS = {"aac": "avenc_aac", "opus": "opusenc"}
+
+# Queues between the demuxer and decoders, unbounded so neither branch starves the other
+UNBOUNDED_QUEUE = "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0"
+
+SPEED_TIER_FAST = "fast"
+SPEED_TIER_BALANCED = "balanced"
+SPEED_TIER_QUALITY = "quality"
+SPEED_TIERS = (SPEED_TIER_FAST, SPEED_TIER_BALANCED, SPEED_TIER_QUALITY)
+
+# Encoder properties of each tier, balanced keeps the preset's encoder settings. Fast
+# gives up compression efficiency for encodes several times quicker, quality the
+# reverse. Threads are left to the encoder, which sizes them to the worker's cores.
+SPEED_TIER_PROPERTIES: Dict[str, Dict[str, Dict[str, str]]] = {
+    "x264enc": {
+        SPEED_TIER_FAST: {"speed-preset": "veryfast", "rc-lookahead": "10"},
+        SPEED_TIER_QUALITY: {"speed-preset": "slow", "rc-lookahead": "60"},
+    },
+    "x265enc": {
+        SPEED_TIER_FAST: {
+            "speed-preset": "veryfast",
+            "option-string": "rc-lookahead=10",
+        },
+        SPEED_TIER_QUALITY: {
+            "speed-preset": "slow",
+            "option-string": "rc-lookahead=40",
+        },
+    },
+}
+
+# Matches a video encoder and its properties up to the next link
+ENCODER_PATTERN = re.compile(
+    r"\b(?P<encoder>%s)\b(?P<properties>[^!]*)" % "|".join(SPEED_TIER_PROPERTIES)
+)
+
+
+def _lookup(table: Dict, field: str, value: str):
+    try:
+        return table[value.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unsupported {field} {value!r}, expected one of {', '.join(table)}"
+        )
+
+
+def _kbps(field: str, value: str) -> int:
+    try:
+        kbps = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {field} {value!r}, expected kbit/s")
+    if kbps <= 0:
+        raise ValueError(f"Invalid {field} {value!r}, expected kbit/s")
+    return kbps
+
+
+def _resolution(value: str) -> Tuple[int, int]:
+    match = re.fullmatch(r"(\d+)x(\d+)", value.strip())
+    if match is None:
+        raise ValueError(f"Invalid resolution {value!r}, expected WIDTHxHEIGHT")
+    return int(match.group(1)), int(match.group(2))
+
+
+def compile_pipeline(
+    input_type: str,
+    output_type: str,
+    resolution: str,
+    video_encoding: str,
+    video_bitrate: str,
+    audio_encoding: str,
+    audio_bitrate: str,
+) -> str:
+    """
+    Generate the pipeline template of a preset from its structured fields, so that the
+    demuxing and muxing around the encoders doesn't have to be written by hand.
+
+    :return: The GStreamer pipeline template.
+    :raises ValueError: If a field has a value there is no element for.
+    """
+    demuxer = _lookup(DEMUXERS, "input type", input_type)
+    muxer = _lookup(MUXERS, "output type", output_type)
+    video_encoder, video_parser = _lookup(
+        VIDEO_ENCODERS, "video encoding", video_encoding
+    )
+    audio_encoder = _lookup(AUDIO_ENCODERS, "audio encoding", audio_encoding)
+    width, height = _resolution(resolution)
+    video_kbps = _kbps("video bitrate", video_bitrate)
+    audio_kbps = _kbps("audio bitrate", audio_bitrate)
+    return (
+        f"filesrc location={{{{input_file}}}} ! {demuxer} name=d {muxer} name=mux ! "
+        f"filesink location={{{{output_file}}}} "
+        f"d.audio_0 ! {UNBOUNDED_QUEUE} ! decodebin ! audioconvert ! "
+        f"{audio_encoder} bitrate={audio_kbps * 1000} ! mux.audio_0 "
+        f"d.video_0 ! {UNBOUNDED_QUEUE} ! decodebin ! videoscale ! "
+        f"video/x-raw,width={width},height={height} ! "
+        f"{video_encoder} bitrate={video_kbps} ! {{{{progress}}}} ! "
+        f"{video_parser} ! mux.video_0"
+    )
+
+
+def preset_fields(preset) -> Dict[str, str]:
+    "The structured fields of a preset its pipeline is compiled from."
+    return {
+        "input_type": preset.input_type,
+        "output_type": preset.output_type,
+        "resolution": preset.resolution,
+        "video_encoding": preset.video_encoding,
+        "video_bitrate": preset.video_bitrate,
+        "audio_encoding": preset.audio_encoding,
+        "audio_bitrate": preset.audio_bitrate,
+    }
+
+
+def _set_properties(properties: str, updates: Dict[str, str]) -> str:
+    tokens: List[str] = []
+    for token in properties.split():
+        key, _, value = token.partition("=")
+        if key in updates:
+            # Fold lookahead into an existing x265 option string rather than losing it
+            if key == "option-string":
+                options = [
+                    option
+                    for option in value.strip("\"'").split(":")
+                    if option and not option.startswith("rc-lookahead=")
+                ]
+                updates = {
+                    **updates,
+                    key: ":".join(options + [updates[key]]),
+                }
+            continue
+        tokens.append(token)
+    for key, value in updates.items():
+        tokens.append(
+            f'{key}="{value}"' if key == "option-string" else f"{key}={value}"
+        )
+    return " " + " ".join(tokens) + " "
+
+
+def apply_speed_tier(pipeline: str, tier: Optional[str]) -> str:
+    """
+    Set the encoder properties of a speed tier on a pipeline's video encoder,
+    overriding any the pipeline already sets.
+
+    :param pipeline: The GStreamer pipeline template.
+    :param tier: The speed tier, None or balanced leave the pipeline as it is.
+    :return: The pipeline template for the tier.
+    """
+    if tier is None or tier == SPEED_TIER_BALANCED:
+        return pipeline
+
+    def replace(match: re.Match) -> str:
+        updates = SPEED_TIER_PROPERTIES[match.group("encoder")][tier]
+        return match.group("encoder") + _set_properties(
+            match.group("properties"), updates
+        )
+
+    return ENCODER_PATTERN.sub(replace, pipeline)
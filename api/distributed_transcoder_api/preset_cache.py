@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import aio_pika
+from distributed_transcoder_common.models import Preset
+
+# Fanout exchange used to tell every API instance to drop its cached presets
+PRESET_INVALIDATION_EXCHANGE = "preset_invalidations"
+
+
+class PresetCache:
+    """
+    In-process cache of every preset, refreshed after a TTL or when any API instance
+    broadcasts that a preset has changed.
+
+    Presets are few and change rarely, so the whole table is loaded at once; lookups
+    by ID and filtered listings are then served without touching the database.
+    """
+
+    def __init__(self, ttl_seconds: float, instance_id: str, logger: logging.Logger):
+        self.ttl_seconds = ttl_seconds
+        self.instance_id = instance_id
+        self.logger = logger
+        self.presets: List[Preset] = []
+        self.presets_by_id: Dict[str, Preset] = {}
+        self.loaded_at: Optional[float] = None
+        # Bumped by every invalidation, so a reload which raced one can be told apart
+        self.generation = 0
+        self.lock = asyncio.Lock()
+
+    def is_fresh(self) -> bool:
+        return (
+            self.loaded_at is not None
+            and time.monotonic() - self.loaded_at < self.ttl_seconds
+        )
+
+    async def load(self) -> List[Preset]:
+        """
+        Return the cached presets, reloading them from the database if they are stale.
+
+        :return: All presets, ordered by name.
+        """
+        if self.is_fresh():
+            return self.presets
+        async with self.lock:
+            # Another request may have reloaded the cache while we waited on the lock
+            while not self.is_fresh():
+                generation = self.generation
+                presets = await Preset.all()
+                if generation != self.generation:
+                    # A preset changed during the query, which may have missed it
+                    continue
+                self.presets = presets
+                self.presets_by_id = {
+                    str(preset.preset_id): preset for preset in presets
+                }
+                self.loaded_at = time.monotonic()
+        return self.presets
+
+    async def get(self, preset_id: str) -> Optional[Preset]:
+        """
+        Look up a preset by ID.
+
+        :param preset_id: The preset ID, in any format accepted by uuid.UUID.
+        :return: The preset, or None if it does not exist.
+        """
+        try:
+            key = str(uuid.UUID(str(preset_id)))
+        except ValueError:
+            return None
+        await self.load()
+        return self.presets_by_id.get(key)
+
+    def invalidate(self):
+        self.generation += 1
+        self.loaded_at = None
+
+    async def broadcast_invalidation(self, channel: aio_pika.Channel, preset_id: str):
+        """
+        Invalidate the local cache and tell every other API instance to do the same.
+
+        :param channel: The channel to publish the invalidation on.
+        :param preset_id: The ID of the preset that changed.
+        """
+        self.invalidate()
+        exchange = await channel.get_exchange(PRESET_INVALIDATION_EXCHANGE)
+        await exchange.publish(
+            aio_pika.Message(
+                json.dumps(
+                    {"preset_id": str(preset_id), "instance_id": self.instance_id}
+                ).encode(),
+                content_type="application/json",
+            ),
+            routing_key="",
+        )
+
+    async def invalidation_callback(
+        self, message: aio_pika.abc.AbstractIncomingMessage
+    ):
+        body = json.loads(message.body.decode())
+        if body.get("instance_id") != self.instance_id:
+            self.logger.info(
+                f"Preset {body.get('preset_id')} changed on instance {body.get('instance_id')}, invalidating preset cache"
+            )
+        self.invalidate()
+
+    async def subscribe(self, channel: aio_pika.Channel):
+        """
+        Listen for invalidations broadcast by any API instance.
+
+        :param channel: The channel to consume on.
+        """
+        # Each instance gets its own exclusive queue so every one sees every invalidation
+        queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(PRESET_INVALIDATION_EXCHANGE)
+        await queue.consume(self.invalidation_callback, no_ack=True)
+
+
+def presets_etag(presets: List[Preset]) -> str:
+    """
+    Compute an ETag for a listing of presets from their IDs and modification times.
+
+    :param presets: The presets in the listing, in response order.
+    :return: A weak ETag header value.
+    """
+    digest = hashlib.sha1()
+    for preset in presets:
+        digest.update(f"{preset.preset_id}:{preset.updated_at.isoformat()};".encode())
+    return f'W/"{digest.hexdigest()}"'
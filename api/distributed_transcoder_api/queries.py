@@ -0,0 +1,179 @@
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from distributed_transcoder_common.models import Job, MediaInfo, Playlist
+
+from .schemas import PlaylistSummary
+
+# States a job can no longer leave on its own, used for playlist completion
+TERMINAL_STATES = (
+    Job.STATE_COMPLETED,
+    Job.STATE_FAILED,
+    Job.STATE_CANCELLED,
+    Job.STATE_STALLED,
+)
+
+# States of jobs that are still waiting to run or running
+UNFINISHED_STATES = (
+    Job.STATE_WAITING,
+    Job.STATE_QUEUED,
+    Job.STATE_RETRYING,
+    Job.STATE_IN_PROGRESS,
+)
+
+
+def job_etag(updated_at: datetime) -> str:
+    """
+    Compute an ETag for a job from its modification time, which every state change
+    moves forward.
+
+    :param updated_at: When the job was last modified.
+    :return: A weak ETag header value.
+    """
+    return f'W/"{updated_at.isoformat()}"'
+
+
+async def job_etag_by_id(job_id: str) -> Optional[str]:
+    """
+    Look up the current ETag of a job without loading the job itself.
+
+    :param job_id: The job to look up.
+    :return: The ETag, or None if the job doesn't exist.
+    """
+    updated_at = (
+        await Job.filter(job_id=job_id).first().values_list("updated_at", flat=True)
+    )
+    return job_etag(updated_at) if updated_at is not None else None
+
+
+def _playlist_jobs_table():
+    """
+    Look up the join table backing Playlist.jobs along with its key columns.
+
+    :return: A tuple of the table name, the playlist key column, and the job key column.
+    """
+    field = Playlist._meta.fields_map["jobs"]
+    return field.through, field.backward_key, field.forward_key
+
+
+async def playlist_job_ids(playlist_ids: List[uuid.UUID]) -> Dict[uuid.UUID, List[str]]:
+    """
+    Fetch the IDs of the jobs in each playlist straight from the join table.
+
+    :param playlist_ids: The playlists to look up.
+    :return: A mapping of playlist ID to the IDs of its jobs.
+    """
+    table, playlist_key, job_key = _playlist_jobs_table()
+    rows = await Playlist._meta.db.execute_query_dict(
+        f'SELECT "{playlist_key}" AS playlist_id, "{job_key}" AS job_id '
+        f'FROM "{table}" WHERE "{playlist_key}" = ANY($1::uuid[])',
+        [playlist_ids],
+    )
+
+    job_ids: Dict[uuid.UUID, List[str]] = defaultdict(list)
+    for row in rows:
+        job_ids[row["playlist_id"]].append(str(row["job_id"]))
+    return job_ids
+
+
+async def playlist_summaries(
+    playlist_ids: List[uuid.UUID],
+) -> Dict[uuid.UUID, PlaylistSummary]:
+    """
+    Roll up the state of the jobs in each playlist with a single aggregate query.
+
+    :param playlist_ids: The playlists to summarize.
+    :return: A mapping of playlist ID to its summary. Empty playlists are omitted.
+    """
+    table, playlist_key, job_key = _playlist_jobs_table()
+    rows = await Playlist._meta.db.execute_query_dict(
+        f'SELECT pj."{playlist_key}" AS playlist_id, j."state" AS state, '
+        f"COUNT(*) AS count, "
+        f'MIN(j."created_at") AS first_created_at, '
+        f'MIN(j."transcode_started_at") AS first_started_at, '
+        f'MAX(j."transcode_completed_at") AS last_completed_at, '
+        f'MAX(j."updated_at") AS last_updated_at '
+        f'FROM "{table}" pj JOIN "{Job._meta.db_table}" j ON j."id" = pj."{job_key}" '
+        f'WHERE pj."{playlist_key}" = ANY($1::uuid[]) '
+        f'GROUP BY pj."{playlist_key}", j."state"',
+        [playlist_ids],
+    )
+
+    # Fold the per-state groups into one summary per playlist
+    summaries: Dict[uuid.UUID, PlaylistSummary] = {}
+    for row in rows:
+        summary = summaries.setdefault(row["playlist_id"], PlaylistSummary())
+        summary.total += row["count"]
+        summary.states[row["state"]] = row["count"]
+        for field, pick in [
+            ("first_created_at", min),
+            ("first_started_at", min),
+            ("last_completed_at", max),
+            ("last_updated_at", max),
+        ]:
+            values = [v for v in (getattr(summary, field), row[field]) if v is not None]
+            setattr(summary, field, pick(values) if values else None)
+
+    for summary in summaries.values():
+        finished = sum(summary.states.get(state, 0) for state in TERMINAL_STATES)
+        summary.percent_complete = round(100 * finished / summary.total, 2)
+    return summaries
+
+
+@dataclass
+class UnfinishedJobs:
+    count: int
+    # Jobs whose source has been probed, and the total duration of those sources
+    probed: int
+    media_seconds: float
+
+
+# Joins each job to the probed properties of its source, if any
+SOURCE_JOIN = (
+    f'FROM "{Job._meta.db_table}" j LEFT JOIN "{MediaInfo._meta.db_table}" m '
+    f'ON m."s3_path" = j."input_s3_path" AND m."duration_ns" > 0 '
+)
+
+
+async def unfinished_job_counts() -> Dict[
+    Tuple[Optional[uuid.UUID], str], UnfinishedJobs
+]:
+    """
+    Count the jobs still waiting or running, per preset and state, along with the
+    duration of their probed sources, with a single aggregate query.
+
+    :return: A mapping of (preset ID, state) to the jobs.
+    """
+    rows = await Job._meta.db.execute_query_dict(
+        f'SELECT j."preset_id" AS preset_id, j."state" AS state, COUNT(*) AS count, '
+        f'COUNT(m."duration_ns") AS probed, '
+        f'COALESCE(SUM(m."duration_ns"), 0)::float8 / 1e9 AS media_seconds '
+        f'{SOURCE_JOIN}WHERE j."state" = ANY($1::text[]) '
+        f'GROUP BY j."preset_id", j."state"',
+        [list(UNFINISHED_STATES)],
+    )
+    return {
+        (row["preset_id"], row["state"]): UnfinishedJobs(
+            row["count"], row["probed"], row["media_seconds"]
+        )
+        for row in rows
+    }
+
+
+async def running_jobs() -> List[Tuple[str, Optional[uuid.UUID], Optional[float]]]:
+    """
+    Fetch the running jobs along with the duration of their sources.
+
+    :return: The (job ID, preset ID, source duration in seconds) of each job, the
+        duration is None if the source hasn't been probed.
+    """
+    rows = await Job._meta.db.execute_query_dict(
+        f'SELECT j."job_id" AS job_id, j."preset_id" AS preset_id, '
+        f'm."duration_ns"::float8 / 1e9 AS duration_seconds '
+        f'{SOURCE_JOIN}WHERE j."state" = $1',
+        [Job.STATE_IN_PROGRESS],
+    )
+    return [(row["job_id"], row["preset_id"], row["duration_seconds"]) for row in rows]
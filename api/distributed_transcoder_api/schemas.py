@@ -1,7 +1,11 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List, Literal
 
-from pydantic import BaseModel
+from distributed_transcoder_common.models import JobOut
+from pydantic import AnyHttpUrl, BaseModel, Field
+
+# Trade-offs between encoding speed and compression efficiency, see pipelines.py
+SpeedTier = Literal["fast", "balanced", "quality"]
 
 
 class TranscodingJob(BaseModel):
@@ -10,6 +14,17 @@ class TranscodingJob(BaseModel):
     output_s3_path: str
     pipeline: Optional[str] = None
     preset_id: Optional[str] = None
+    # Reuse the output of an identical earlier or in-flight job instead of transcoding
+    dedupe: bool = True
+    # IDs of jobs that must complete first, the job is dispatched as soon as they have
+    # and fails if any of them doesn't
+    depends_on: List[str] = []
+    # Seconds between thumbnails, defaulting to the preset's
+    thumbnail_interval: Optional[int] = Field(None, gt=0)
+    # Fast gives up compression efficiency for a quicker encode, quality the reverse
+    speed_tier: Optional[SpeedTier] = None
+    # URL to POST a signed event to when the job finishes
+    callback_url: Optional[AnyHttpUrl] = None
 
 
 class PresetCreate(BaseModel):
@@ -21,7 +36,9 @@ class PresetCreate(BaseModel):
     video_bitrate: str
     audio_encoding: str
     audio_bitrate: str
-    pipeline: str
+    # Compiled from the fields above when not given
+    pipeline: Optional[str] = None
+    thumbnail_interval: Optional[int] = Field(None, gt=0)
 
 
 class PresetUpdate(BaseModel):
@@ -34,6 +51,13 @@ class PresetUpdate(BaseModel):
     video_bitrate: Optional[str] = None
     audio_encoding: Optional[str] = None
     audio_bitrate: Optional[str] = None
+    thumbnail_interval: Optional[int] = Field(None, gt=0)
+
+
+class JobStatusOut(JobOut):
+    # Estimated seconds left of a running job, from the progress seen by the instance
+    # serving the request
+    eta_seconds: Optional[float] = None
 
 
 class JobUpdate(BaseModel):
@@ -50,12 +74,30 @@ class PlaylistCreate(BaseModel):
     name: str
     input_s3_path: str
     presets: List[str]
+    dedupe: bool = True
+    # Set to "hls" to package the renditions as HLS under a shared master playlist
+    packaging: Optional[str] = None
+    # URL to POST a signed event to as each of the playlist's jobs finishes
+    callback_url: Optional[AnyHttpUrl] = None
+    speed_tier: Optional[SpeedTier] = None
 
 
 class PlaylistCreateOut(BaseModel):
     playlist_id: str
     input_s3_path: str
     jobs: List[str]
+    manifest_s3_path: Optional[str] = None
+
+
+class PlaylistSummary(BaseModel):
+    total: int = 0
+    states: Dict[str, int] = {}
+    first_created_at: Optional[datetime] = None
+    first_started_at: Optional[datetime] = None
+    last_completed_at: Optional[datetime] = None
+    last_updated_at: Optional[datetime] = None
+    # Share of jobs that have reached a terminal state
+    percent_complete: float = 0.0
 
 
 class PlaylistShallowOut(BaseModel):
@@ -64,3 +106,39 @@ class PlaylistShallowOut(BaseModel):
     jobs: List[str]
     created_at: datetime
     updated_at: datetime
+    packaging: Optional[str] = None
+    manifest_s3_path: Optional[str] = None
+    summary: Optional[PlaylistSummary] = None
+
+
+class PlaylistCancelOut(BaseModel):
+    playlist_id: str
+    # Jobs that were still running or queued, and are now cancelled
+    cancelled: List[str]
+
+
+class PresetBacklog(BaseModel):
+    # Jobs waiting on their dependencies, which are still counted in the backlog
+    waiting: int = 0
+    queued: int = 0
+    in_progress: int = 0
+    # Typical encode time of the preset's jobs, from the length of their sources and
+    # the preset's usual speed. Unknown until one has completed and one is probed.
+    seconds_per_job: Optional[float] = None
+    backlog_seconds: Optional[float] = None
+
+
+class QueueStats(BaseModel):
+    queue_depth: int
+    retry_queue_depth: int
+    dead_letter_queue_depth: int
+    # Workers currently consuming the job queue
+    workers: int
+    # Estimated encode time left across every unfinished job with a known preset speed
+    backlog_seconds: float
+    # Unfinished jobs left out of the estimate, as their preset has no history yet or
+    # none of its sources have been probed
+    unestimated_jobs: int
+    # Estimated time until the backlog is drained by the current workers
+    drain_seconds: Optional[float] = None
+    presets: Dict[str, PresetBacklog]
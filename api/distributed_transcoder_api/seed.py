@@ -1,11 +1,157 @@
+import logging
+from datetime import datetime
+
 from distributed_transcoder_common.models import Preset
 
+from .pipelines import compile_pipeline, preset_fields
+
+# Pipelines the presets were seeded with before they were compiled from their fields.
+# Presets still holding exactly these are recompiled, any other pipeline was set by
+# an operator and is kept.
+SEEDED_PIPELINES = {
+    "Scale to 1080p x265 (1.5 mbit) mp4->mp4": (
+        "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1920, height=1080 ! "
+        "x265enc bitrate=1536 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 720p x265 (1 mbit) mp4->mp4": (
+        "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! "
+        "x265enc bitrate=1024 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 720p x264 (1 mbit) mp4->mp4": (
+        "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! "
+        "x264enc bitrate=1536 ! {{progress}} ! h264parse ! mux.video_0"
+    ),
+    "Scale to 480p x265 (768 kbit) mp4->mp4": (
+        "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=640, height=480 ! "
+        "x265enc bitrate=768 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 1080p x265 (1.5 mbit) mp4->mkv": (
+        "filesrc location={{input_file}} ! "
+        "qtdemux name=d matroskamux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1920, height=1080 ! "
+        "x265enc bitrate=1536 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 720p x265 (1 mbit) mp4->mkv": (
+        "filesrc location={{input_file}} ! "
+        "qtdemux name=d matroskamux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! "
+        "x265enc bitrate=1024 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 480p x265 (768 kbit) mp4->mkv": (
+        "filesrc location={{input_file}} ! "
+        "qtdemux name=d matroskamux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=640, height=480 ! "
+        "x265enc bitrate=768 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 1080p x265 (1.5 mbit) mkv->mp4": (
+        "filesrc location={{input_file}} ! "
+        "matroskademux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1920, height=1080 ! "
+        "x265enc bitrate=1536 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 720p x265 (1 mbit) mkv->mp4": (
+        "filesrc location={{input_file}} ! "
+        "matroskademux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! "
+        "x265enc bitrate=1024 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 720p x264 (2 mbit) mkv->mp4": (
+        "filesrc location={{input_file}} ! "
+        "matroskademux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! "
+        "x264enc bitrate=2048 ! {{progress}} ! h264parse ! mux.video_0"
+    ),
+    "Scale to 480p x265 (768 kbit) mkv->mp4": (
+        "filesrc location={{input_file}} ! "
+        "matroskademux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=640, height=480 ! "
+        "x265enc bitrate=768 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 1080p x265 (1.5 mbit) mkv->mkv": (
+        "filesrc location={{input_file}} ! "
+        "matroskademux name=d matroskamux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1920, height=1080 ! "
+        "x265enc bitrate=1536 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 720p x265 (1 mbit) mkv->mkv": (
+        "filesrc location={{input_file}} ! "
+        "matroskademux name=d matroskamux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! "
+        "x265enc bitrate=1024 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+    "Scale to 480p x265 (768 kbit) mkv->mkv": (
+        "filesrc location={{input_file}} ! "
+        "matroskademux name=d matroskamux name=mux ! "
+        "filesink location={{output_file}} d.audio_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! "
+        "queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=640, height=480 ! "
+        "x265enc bitrate=768 ! {{progress}} ! h265parse ! mux.video_0"
+    ),
+}
+
 
-async def seed_presets():
+async def seed_presets(logger: logging.Logger):
     presets = [
         {
             "name": "Scale to 1080p x265 (1.5 mbit) mp4->mp4",
-            "pipeline": "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1920, height=1080 ! x265enc bitrate=1536 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mp4",
             "output_type": "mp4",
             "video_encoding": "h265",
@@ -16,7 +162,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 720p x265 (1 mbit) mp4->mp4",
-            "pipeline": "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! x265enc bitrate=1024 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mp4",
             "output_type": "mp4",
             "video_encoding": "h265",
@@ -27,7 +172,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 720p x264 (1 mbit) mp4->mp4",
-            "pipeline": "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! x264enc bitrate=1536 ! {{progress}} ! h264parse ! mux.video_0",
             "input_type": "mp4",
             "output_type": "mp4",
             "video_encoding": "h264",
@@ -45,11 +189,9 @@ async def seed_presets():
             "video_bitrate": "768",
             "audio_encoding": "aac",
             "audio_bitrate": "128",
-            "pipeline": "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=640, height=480 ! x265enc bitrate=768 ! {{progress}} ! h265parse ! mux.video_0",
         },
         {
             "name": "Scale to 1080p x265 (1.5 mbit) mp4->mkv",
-            "pipeline": "filesrc location={{input_file}} ! qtdemux name=d matroskamux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1920, height=1080 ! x265enc bitrate=1536 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mp4",
             "output_type": "mkv",
             "video_encoding": "h265",
@@ -60,7 +202,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 720p x265 (1 mbit) mp4->mkv",
-            "pipeline": "filesrc location={{input_file}} ! qtdemux name=d matroskamux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! x265enc bitrate=1024 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mp4",
             "output_type": "mkv",
             "video_encoding": "h265",
@@ -71,7 +212,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 480p x265 (768 kbit) mp4->mkv",
-            "pipeline": "filesrc location={{input_file}} ! qtdemux name=d matroskamux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=640, height=480 ! x265enc bitrate=768 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mp4",
             "output_type": "mkv",
             "video_encoding": "h265",
@@ -82,7 +222,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 1080p x265 (1.5 mbit) mkv->mp4",
-            "pipeline": "filesrc location={{input_file}} ! matroskademux name=d mp4mux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1920, height=1080 ! x265enc bitrate=1536 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mkv",
             "output_type": "mp4",
             "video_encoding": "h265",
@@ -93,7 +232,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 720p x265 (1 mbit) mkv->mp4",
-            "pipeline": "filesrc location={{input_file}} ! matroskademux name=d mp4mux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! x265enc bitrate=1024 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mkv",
             "output_type": "mp4",
             "video_encoding": "h265",
@@ -104,7 +242,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 720p x264 (2 mbit) mkv->mp4",
-            "pipeline": "filesrc location={{input_file}} ! matroskademux name=d mp4mux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! x264enc bitrate=2048 ! {{progress}} ! h264parse ! mux.video_0",
             "input_type": "mkv",
             "output_type": "mp4",
             "video_encoding": "h264",
@@ -115,7 +252,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 480p x265 (768 kbit) mkv->mp4",
-            "pipeline": "filesrc location={{input_file}} ! matroskademux name=d mp4mux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=640, height=480 ! x265enc bitrate=768 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mkv",
             "output_type": "mp4",
             "video_encoding": "h265",
@@ -126,7 +262,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 1080p x265 (1.5 mbit) mkv->mkv",
-            "pipeline": "filesrc location={{input_file}} ! matroskademux name=d matroskamux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1920, height=1080 ! x265enc bitrate=1536 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mkv",
             "output_type": "mkv",
             "video_encoding": "h265",
@@ -137,7 +272,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 720p x265 (1 mbit) mkv->mkv",
-            "pipeline": "filesrc location={{input_file}} ! matroskademux name=d matroskamux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=1280, height=720 ! x265enc bitrate=1024 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mkv",
             "output_type": "mkv",
             "video_encoding": "h265",
@@ -148,7 +282,6 @@ async def seed_presets():
         },
         {
             "name": "Scale to 480p x265 (768 kbit) mkv->mkv",
-            "pipeline": "filesrc location={{input_file}} ! matroskademux name=d matroskamux name=mux ! filesink location={{output_file}} d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! decodebin ! videoscale ! video/x-raw,width=640, height=480 ! x265enc bitrate=768 ! {{progress}} ! h265parse ! mux.video_0",
             "input_type": "mkv",
             "output_type": "mkv",
             "video_encoding": "h265",
@@ -160,6 +293,31 @@ async def seed_presets():
     ]
 
     for preset in presets:
+        pipeline = compile_pipeline(
+            **{key: value for key, value in preset.items() if key != "name"}
+        )
         existing_preset = await Preset.get_or_none(name=preset["name"])
         if not existing_preset:
-            await Preset.create(**preset)
+            await Preset.create(**preset, pipeline=pipeline, compiled=True)
+            continue
+        if existing_preset.compiled is not None:
+            continue
+        # Seeded before the compiled flag was recorded. Only a pipeline that is still
+        # exactly what was seeded is recompiled, any other was tuned by an operator.
+        compiled = existing_preset.pipeline in (
+            SEEDED_PIPELINES.get(preset["name"]),
+            pipeline,
+        )
+        update = {"compiled": compiled}
+        if compiled:
+            try:
+                update["pipeline"] = compile_pipeline(**preset_fields(existing_preset))
+            except ValueError:
+                update["compiled"] = False
+        if update["compiled"]:
+            logger.info(f"Recompiling the seeded pipeline of preset {preset['name']}")
+        else:
+            logger.info(f"Keeping the custom pipeline of preset {preset['name']}")
+        await Preset.filter(
+            preset_id=existing_preset.preset_id, compiled__isnull=True
+        ).update(**update, updated_at=datetime.now())
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+import aio_pika
+from distributed_transcoder_common import JobControlMessage, JobProgressMessage
+from distributed_transcoder_common.models import Job
+
+from .dispatch import publish_control, publish_job
+from .preset_cache import PresetCache
+from .throughput import PresetThroughput
+
+
+@dataclass
+class AttemptProgress:
+    worker_id: str
+    preset_id: Optional[str]
+    # Duration of the job's source, None until it has been probed
+    duration_seconds: Optional[float]
+    first_timestamp: float
+    first_progress: float
+    last_timestamp: float
+    last_progress: float
+
+    def rate(self) -> Optional[float]:
+        elapsed = self.last_timestamp - self.first_timestamp
+        if elapsed <= 0:
+            return None
+        return (self.last_progress - self.first_progress) / elapsed
+
+    def speed(self) -> Optional[float]:
+        "The attempt's speed in seconds of media per second, once its source is known."
+        rate = self.rate()
+        if rate is None or not self.duration_seconds:
+            return None
+        return rate * self.duration_seconds / 100
+
+
+class StragglerDetector:
+    """
+    Dispatches a backup copy of any job encoding much slower than its preset usually
+    does, and cancels whichever copy is left once a result ends the job. Jobs are
+    compared by speed, so those whose source hasn't been probed are never backed up,
+    and each job is backed up at most once.
+    """
+
+    def __init__(
+        self,
+        channel: aio_pika.Channel,
+        presets: PresetCache,
+        throughput: PresetThroughput,
+        logger: logging.Logger,
+        slowdown_threshold: float,
+        min_elapsed_seconds: float,
+    ):
+        self.channel = channel
+        self.presets = presets
+        self.throughput = throughput
+        self.logger = logger
+        self.slowdown_threshold = slowdown_threshold
+        self.min_elapsed_seconds = min_elapsed_seconds
+        # Progress of the original attempt of each running job
+        self.attempts: Dict[str, AttemptProgress] = {}
+        # Jobs with a backup copy in flight, mapped to the worker running the original
+        self.speculated: Dict[str, str] = {}
+        # Jobs which have been backed up, whether or not the race is still on
+        self.backed_up: Set[str] = set()
+
+    def record_progress(
+        self,
+        msg: JobProgressMessage,
+        preset_id: Optional[str],
+        duration_seconds: Optional[float],
+    ):
+        attempt = self.attempts.get(msg.job_id)
+        if attempt is None:
+            self.attempts[msg.job_id] = AttemptProgress(
+                worker_id=msg.worker_id,
+                preset_id=preset_id,
+                duration_seconds=duration_seconds,
+                first_timestamp=msg.timestamp,
+                first_progress=msg.progress,
+                last_timestamp=msg.timestamp,
+                last_progress=msg.progress,
+            )
+        elif attempt.worker_id == msg.worker_id:
+            # Only the original attempt's samples count towards its rate
+            attempt.last_timestamp = msg.timestamp
+            attempt.last_progress = msg.progress
+
+    async def record_result(
+        self, job_id: str, status: str, worker_id: Optional[str], final: bool
+    ):
+        """
+        Update preset history from a finished job and cancel the losing copy of a race.
+        A copy whose result didn't end the job only drops out of the race, leaving the
+        other copy to carry on and be tracked in its place.
+
+        :param job_id: The job that the result is for.
+        :param status: The state the copy finished in.
+        :param worker_id: The worker that sent the result.
+        :param final: Whether the result was recorded as the job's outcome.
+        """
+        if not final:
+            original_worker_id = self.speculated.pop(job_id, None)
+            if original_worker_id is None:
+                return
+            self.logger.info(
+                f"Copy of job {job_id} on worker {worker_id} ended as {status}, "
+                f"leaving the other copy running"
+            )
+            attempt = self.attempts.get(job_id)
+            if attempt is not None and attempt.worker_id == worker_id:
+                # Start measuring the surviving copy from its next progress report
+                del self.attempts[job_id]
+            return
+
+        attempt = self.attempts.pop(job_id, None)
+        if status == Job.STATE_COMPLETED and attempt is not None:
+            if attempt.worker_id == worker_id:
+                speed = attempt.speed()
+                if speed is not None:
+                    self.throughput.record(attempt.preset_id, speed)
+
+        self.backed_up.discard(job_id)
+        if self.speculated.pop(job_id, None) is None:
+            return
+        self.logger.info(
+            f"Job {job_id} ended as {status} on worker {worker_id}, cancelling the other copy"
+        )
+        await publish_control(
+            self.channel,
+            JobControlMessage(
+                action=JobControlMessage.ACTION_CANCEL,
+                job_id=job_id,
+                except_worker_id=worker_id,
+                reason=f"job {status} on another worker",
+                timestamp=time.time(),
+            ),
+        )
+
+    def forget(self, job_id: str):
+        self.attempts.pop(job_id, None)
+        self.speculated.pop(job_id, None)
+        self.backed_up.discard(job_id)
+
+    async def check(self):
+        """
+        Dispatch backup copies of every job running slower than the threshold.
+        """
+        now = time.time()
+        for job_id, attempt in list(self.attempts.items()):
+            if job_id in self.backed_up:
+                continue
+            if now - attempt.first_timestamp < self.min_elapsed_seconds:
+                continue
+            expected_speed = self.throughput.speed(attempt.preset_id)
+            speed = attempt.speed()
+            if expected_speed is None or speed is None:
+                continue
+            if speed >= self.slowdown_threshold * expected_speed:
+                continue
+
+            job = await Job.get_or_none(job_id=job_id)
+            if job is None or job.state != Job.STATE_IN_PROGRESS:
+                self.forget(job_id)
+                continue
+            self.logger.info(
+                f"Job {job_id} on worker {attempt.worker_id} is encoding at {speed:.2f}x "
+                f"against {expected_speed:.2f}x for its preset, dispatching a backup copy"
+            )
+            self.speculated[job_id] = attempt.worker_id
+            self.backed_up.add(job_id)
+            await publish_job(self.channel, job, self.presets, speculative=True)
+
+    async def run(self, interval_seconds: float):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                self.logger.error(f"Error while checking for straggling jobs: {e}")
+            await asyncio.sleep(interval_seconds)
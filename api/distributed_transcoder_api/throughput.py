@@ -0,0 +1,50 @@
+from typing import Dict, Optional
+
+
+class PresetThroughput:
+    """
+    Tracks how fast jobs of each preset usually encode, as an exponentially weighted
+    moving average across completed jobs of their speed in seconds of source media per
+    second. Speeds compare across sources of any length, unlike progress rates, as a
+    long source gains fewer percent per second than a short one encoded as quickly.
+    """
+
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self.speeds: Dict[str, float] = {}
+
+    def record(self, preset_id: Optional[str], speed: float):
+        """
+        Fold the average speed of a completed job into its preset's history.
+
+        :param preset_id: The preset the job ran, jobs without one are not tracked.
+        :param speed: The job's average speed in seconds of media per second.
+        """
+        if preset_id is None or speed <= 0:
+            return
+        key = str(preset_id)
+        previous = self.speeds.get(key)
+        if previous is None:
+            self.speeds[key] = speed
+        else:
+            self.speeds[key] = previous + self.smoothing * (speed - previous)
+
+    def speed(self, preset_id: Optional[str]) -> Optional[float]:
+        if preset_id is None:
+            return None
+        return self.speeds.get(str(preset_id))
+
+    def rate(
+        self, preset_id: Optional[str], duration_seconds: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        The progress rate the preset's jobs usually make on a source.
+
+        :param preset_id: The preset.
+        :param duration_seconds: The duration of the source, if it has been probed.
+        :return: The rate in percent per second, or None if either isn't known.
+        """
+        speed = self.speed(preset_id)
+        if speed is None or not duration_seconds:
+            return None
+        return 100 * speed / duration_seconds
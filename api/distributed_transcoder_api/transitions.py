@@ -0,0 +1,349 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+import aio_pika
+from distributed_transcoder_common.message_types import (
+    JobResultMessage,
+    JobTransitionMessage,
+    JobTransitionReplyMessage,
+)
+from distributed_transcoder_common.models import Job, MediaInfo
+
+# Define constants for the queues workers report to the API on, in place of writing to
+# the database themselves
+JOB_TRANSITIONS_QUEUE_NAME = "job_transitions"
+MEDIA_INFO_QUEUE_NAME = "media_info"
+
+# States a job can be claimed from
+CLAIMABLE_STATES = (Job.STATE_QUEUED, Job.STATE_RETRYING)
+
+# Matches reports made under the job's current claim. Reports without a token never
+# match, as every claim is granted one.
+FENCED = 'j."claim_token" = r.claim_token'
+
+# MediaInfo columns reported by workers, with their types for unnesting
+MEDIA_COLUMNS = (
+    ("size", "bigint"),
+    ("duration_ns", "bigint"),
+    ("container", "text"),
+    ("video_codec", "text"),
+    ("width", "int"),
+    ("height", "int"),
+    ("frame_rate", "float8"),
+    ("video_bitrate", "int"),
+    ("audio_codec", "text"),
+    ("audio_bitrate", "int"),
+)
+
+
+class MessageBatcher:
+    """
+    Collects messages consumed from a queue and hands them to a handler in batches,
+    once a batch is full or the first message in it has waited out the window. Messages
+    are acknowledged once the handler has dealt with their batch, and requeued if it
+    fails.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[
+            [List[aio_pika.abc.AbstractIncomingMessage]], Awaitable[None]
+        ],
+        logger: logging.Logger,
+        window_seconds: float = 0.02,
+        max_batch_size: int = 200,
+    ):
+        self.handler = handler
+        self.logger = logger
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.queue: "asyncio.Queue[aio_pika.abc.AbstractIncomingMessage]" = (
+            asyncio.Queue()
+        )
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def __call__(self, message: aio_pika.abc.AbstractIncomingMessage):
+        await self.queue.put(message)
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                self.logger.error(
+                    f"Error while handling a batch of {len(batch)} messages: {e}"
+                )
+                for message in batch:
+                    await message.nack(requeue=True)
+                continue
+            for message in batch:
+                await message.ack()
+
+
+def first_per_job(messages: Iterable) -> Dict:
+    """
+    Pick the first of the messages about each job, in the order they were received.
+
+    :return: A mapping of job ID to its first message.
+    """
+    firsts = {}
+    for msg in messages:
+        firsts.setdefault(msg.job_id, msg)
+    return firsts
+
+
+async def claim_jobs(claims: List[JobTransitionMessage]) -> Dict[str, int]:
+    """
+    Start the attempts workers are asking to run, with a single compare-and-set
+    update which also hands each claim a new fencing token. Of several claims on one
+    job, only the first can be granted. Whether a claim was granted is read back from
+    the job afterwards, see holds_claim.
+
+    :param claims: The claims, of jobs that aren't already running.
+    :return: A mapping of the IDs of the jobs claimed to their fencing tokens.
+    """
+    firsts = first_per_job(claims)
+    if not firsts:
+        return {}
+    rows = await Job._meta.db.execute_query_dict(
+        f'UPDATE "{Job._meta.db_table}" j SET "state" = $4, "attempts" = c.attempt, '
+        f'"worker_id" = c.worker_id, "claim_token" = j."claim_token" + 1, '
+        f'"transcode_started_at" = $5, "updated_at" = $5 '
+        f"FROM unnest($1::text[], $2::int[], $3::text[]) AS c(job_id, attempt, worker_id) "
+        f'WHERE j."job_id" = c.job_id AND j."state" = ANY($6::text[]) '
+        f'RETURNING j."job_id" AS job_id, j."claim_token" AS claim_token',
+        [
+            list(firsts),
+            [claim.attempt for claim in firsts.values()],
+            [claim.worker_id for claim in firsts.values()],
+            Job.STATE_IN_PROGRESS,
+            datetime.now(),
+            list(CLAIMABLE_STATES),
+        ],
+    )
+    return {row["job_id"]: row["claim_token"] for row in rows}
+
+
+async def release_jobs(releases: List[JobTransitionMessage]) -> Set[str]:
+    """
+    Hand running jobs back to be picked up again, with a single conditional update.
+    Jobs which were cancelled, finished or claimed again meanwhile are left as they
+    are.
+
+    :param releases: The releases, each with the state to hand its job back in.
+    :return: The IDs of the jobs released.
+    """
+    firsts = first_per_job(releases)
+    if not firsts:
+        return set()
+    rows = await Job._meta.db.execute_query_dict(
+        f'UPDATE "{Job._meta.db_table}" j SET "state" = r.state, '
+        f'"error" = COALESCE(r.error, j."error"), '
+        f'"error_type" = COALESCE(r.error_type, j."error_type"), "updated_at" = $6 '
+        f"FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::int[]) "
+        f"AS r(job_id, state, error, error_type, claim_token) "
+        f'WHERE j."job_id" = r.job_id AND j."state" = $7 AND {FENCED} '
+        f'RETURNING j."job_id" AS job_id',
+        [
+            list(firsts),
+            [release.state for release in firsts.values()],
+            [release.error for release in firsts.values()],
+            [release.error_type for release in firsts.values()],
+            [release.claim_token for release in firsts.values()],
+            datetime.now(),
+            Job.STATE_IN_PROGRESS,
+        ],
+    )
+    return {row["job_id"] for row in rows}
+
+
+async def record_checkpoints(checkpoints: List[JobTransitionMessage]):
+    """
+    Record the checkpoint manifests of jobs with a single update. Of several for one
+    job, the last one received wins, and checkpoints made under a superseded claim are
+    refused.
+
+    :param checkpoints: The checkpoints, a None manifest clears the job's.
+    :return: The IDs of the jobs whose checkpoints were recorded.
+    """
+    latest = {msg.job_id: msg for msg in checkpoints}
+    if not latest:
+        return set()
+    rows = await Job._meta.db.execute_query_dict(
+        f'UPDATE "{Job._meta.db_table}" j SET "checkpoint" = r.checkpoint::jsonb '
+        f"FROM unnest($1::text[], $2::text[], $3::int[]) "
+        f"AS r(job_id, checkpoint, claim_token) "
+        f'WHERE j."job_id" = r.job_id AND {FENCED} '
+        f'RETURNING j."job_id" AS job_id',
+        [
+            list(latest),
+            [
+                json.dumps(msg.checkpoint) if msg.checkpoint is not None else None
+                for msg in latest.values()
+            ],
+            [msg.claim_token for msg in latest.values()],
+        ],
+    )
+    return {row["job_id"] for row in rows}
+
+
+async def record_results(results: List[JobResultMessage]) -> Set[str]:
+    """
+    Record the results of running jobs with a single conditional update. Results for
+    jobs which were cancelled meanwhile are dropped, as are results of attempts whose
+    claim was superseded, and of several results for one job only the first is
+    recorded.
+
+    :param results: The results to record.
+    :return: The IDs of the jobs whose results were recorded.
+    """
+    firsts = first_per_job(results)
+    if not firsts:
+        return set()
+    rows = await Job._meta.db.execute_query_dict(
+        f'UPDATE "{Job._meta.db_table}" j SET "state" = r.state, "error" = r.error, '
+        f'"error_type" = r.error_type, "transcode_completed_at" = $6, "updated_at" = $6 '
+        f"FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::int[]) "
+        f"AS r(job_id, state, error, error_type, claim_token) "
+        f'WHERE j."job_id" = r.job_id AND j."state" = $7 AND {FENCED} '
+        f'RETURNING j."job_id" AS job_id',
+        [
+            list(firsts),
+            [result.status for result in firsts.values()],
+            [result.error for result in firsts.values()],
+            [result.error_type for result in firsts.values()],
+            [result.claim_token for result in firsts.values()],
+            datetime.now(),
+            Job.STATE_IN_PROGRESS,
+        ],
+    )
+    return {row["job_id"] for row in rows}
+
+
+async def record_heartbeats(job_ids: Set[str]):
+    """
+    Record that running jobs have reported progress since the last heartbeat, with a
+    single update of their modification times. The stall check reads these, so that
+    it doesn't depend on which API instance consumed a job's progress.
+
+    :param job_ids: The IDs of the jobs which reported progress.
+    """
+    if not job_ids:
+        return
+    await Job.filter(job_id__in=job_ids, state=Job.STATE_IN_PROGRESS).update(
+        updated_at=datetime.now()
+    )
+
+
+async def record_media(probes: Dict[str, Dict]):
+    """
+    Insert or replace the probed properties of sources with a single upsert.
+
+    :param probes: A mapping of S3 path to the fields of its MediaInfo row.
+    """
+    if not probes:
+        return
+    columns = ", ".join(f'"{column}"' for column, _ in MEDIA_COLUMNS)
+    arrays = ", ".join(
+        f"${index}::{column_type}[]"
+        for index, (_, column_type) in enumerate(MEDIA_COLUMNS, start=3)
+    )
+    updates = ", ".join(
+        f'"{column}" = EXCLUDED."{column}"' for column, _ in MEDIA_COLUMNS
+    )
+    probed_at = len(MEDIA_COLUMNS) + 3
+    await MediaInfo._meta.db.execute_query_dict(
+        f'INSERT INTO "{MediaInfo._meta.db_table}" ("id", "s3_path", {columns}, "probed_at") '
+        f"SELECT *, ${probed_at}::timestamptz FROM unnest($1::uuid[], $2::text[], {arrays}) "
+        f'ON CONFLICT ("s3_path") DO UPDATE SET {updates}, "probed_at" = EXCLUDED."probed_at"',
+        [
+            [uuid.uuid4() for _ in probes],
+            list(probes),
+            *(
+                [media.get(column) for media in probes.values()]
+                for column, _ in MEDIA_COLUMNS
+            ),
+            datetime.now(),
+        ],
+    )
+
+
+def media_fields(media: MediaInfo) -> Dict:
+    "The fields of a MediaInfo row workers are told about, apart from its S3 path."
+    return {column: getattr(media, column) for column, _ in MEDIA_COLUMNS}
+
+
+def holds_claim(job: Optional[Job], claim: JobTransitionMessage) -> bool:
+    """
+    Whether a job is running under a claim, either as it was just granted or because
+    the worker resent a claim granted before it lost the reply. Either way the worker
+    holds the claim, so it is answered as granted.
+    """
+    return (
+        job is not None
+        and job.state == Job.STATE_IN_PROGRESS
+        and job.worker_id == claim.worker_id
+        and job.attempts == claim.attempt
+    )
+
+
+def transition_reply(
+    msg: JobTransitionMessage,
+    job: Optional[Job],
+    released: Set[str],
+    checkpointed: Set[str],
+    sources: Dict[str, MediaInfo],
+) -> JobTransitionReplyMessage:
+    """
+    Answer a worker's request once its batch has been applied.
+
+    :param msg: The request.
+    :param job: The job as it is after the batch, None if there is no such job.
+    :param released: The IDs of the jobs released by the batch.
+    :param checkpointed: The IDs of the jobs whose checkpoints were recorded.
+    :param sources: The probed sources of the jobs claimed, by S3 path.
+    :return: The reply.
+    """
+    reply = JobTransitionReplyMessage(
+        job_id=msg.job_id,
+        applied=False,
+        state=job.state if job is not None else None,
+    )
+    if msg.action == JobTransitionMessage.ACTION_CLAIM:
+        if msg.speculative:
+            # Backup copies race the original attempt under its claim, so a win only
+            # counts while that claim stands
+            reply.applied = job is not None and job.state == Job.STATE_IN_PROGRESS
+        else:
+            reply.applied = holds_claim(job, msg)
+            if reply.applied:
+                reply.checkpoint = job.checkpoint
+        if reply.applied:
+            reply.claim_token = job.claim_token
+            source = sources.get(job.input_s3_path)
+            if source is not None:
+                reply.media = media_fields(source)
+    elif msg.action == JobTransitionMessage.ACTION_RELEASE:
+        reply.applied = not msg.speculative and msg.job_id in released
+    elif msg.action == JobTransitionMessage.ACTION_CHECKPOINT:
+        reply.applied = not msg.speculative and msg.job_id in checkpointed
+    return reply
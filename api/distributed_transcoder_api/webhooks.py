@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import socket
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Collection, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+
+SIGNATURE_HEADER = "X-Transcoder-Signature"
+TIMESTAMP_HEADER = "X-Transcoder-Timestamp"
+
+# Responses worth delivering again, anything else below 400 is a success and anything
+# else at or above it is the receiver rejecting the events for good
+RETRYABLE_STATUSES = (408, 429)
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    """
+    Sign a delivery over its timestamp and body, so receivers can reject forged and
+    replayed deliveries. Receivers recompute this and compare it with the signature
+    header in constant time.
+    """
+    digest = hmac.new(
+        secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256
+    ).hexdigest()
+    return f"sha256={digest}"
+
+
+def is_public_address(address: str) -> bool:
+    "Whether an IP address is routable on the internet, as callback targets must be."
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global
+
+
+def check_callback_url(url: str, allowed_hosts: Collection[str] = ()):
+    """
+    Check that a callback URL doesn't point the API at itself or at the private
+    network it runs in, as far as can be told without resolving it. Hostnames are
+    checked again as they are resolved for each delivery, see PublicResolver.
+
+    :param url: The callback URL.
+    :param allowed_hosts: Hosts callbacks may go to even if they are private.
+    :raises ValueError: If the URL isn't http(s), or its host is private.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise ValueError(f"Unsupported callback URL scheme {parts.scheme!r}")
+    host = (parts.hostname or "").lower()
+    if not host:
+        raise ValueError("Callback URL has no host")
+    if host in allowed_hosts:
+        return
+    if host == "localhost" or host.endswith(".localhost"):
+        raise ValueError(f"Callback URL host {host} is not public")
+    try:
+        public = is_public_address(host)
+    except ValueError:
+        # A hostname, left to the resolver
+        return
+    if not public:
+        raise ValueError(f"Callback URL host {host} is not public")
+
+
+class PublicResolver(AbstractResolver):
+    """
+    Resolves callback hosts to their public addresses only, so that a hostname can't
+    lead deliveries into the private network, even if its DNS changes after it was
+    submitted.
+    """
+
+    def __init__(self, allowed_hosts: Collection[str] = ()):
+        self.resolver = aiohttp.DefaultResolver()
+        self.allowed_hosts = allowed_hosts
+
+    async def resolve(
+        self, host: str, port: int = 0, family: int = socket.AF_INET
+    ) -> List[Dict[str, Any]]:
+        addresses = await self.resolver.resolve(host, port, family)
+        if host.lower() in self.allowed_hosts:
+            return addresses
+        addresses = [
+            address for address in addresses if is_public_address(address["host"])
+        ]
+        if not addresses:
+            raise OSError(f"Callback host {host} has no public address")
+        return addresses
+
+    async def close(self):
+        await self.resolver.close()
+
+
+class WebhookDispatcher:
+    """
+    Delivers job completion events to client callback URLs in the background. Events
+    queued within a short window are batched into one request per URL, and failed
+    deliveries are retried with exponential backoff on a pooled HTTP client.
+
+    Deliveries only go to public addresses, or to hosts in allowed_hosts.
+    """
+
+    def __init__(
+        self,
+        secret: Optional[str],
+        logger: logging.Logger,
+        batch_window_seconds: float = 1.0,
+        max_batch_size: int = 100,
+        max_attempts: int = 6,
+        base_delay_seconds: float = 1.0,
+        timeout_seconds: float = 10.0,
+        max_concurrent_deliveries: int = 50,
+        max_queued_events: int = 10_000,
+        allowed_hosts: Collection[str] = (),
+    ):
+        self.secret = secret
+        self.allowed_hosts = {host.lower() for host in allowed_hosts}
+        self.logger = logger
+        self.batch_window_seconds = batch_window_seconds
+        self.max_batch_size = max_batch_size
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.timeout_seconds = timeout_seconds
+        self.queue: "asyncio.Queue[tuple]" = asyncio.Queue(max_queued_events)
+        self.deliveries = asyncio.Semaphore(max_concurrent_deliveries)
+        self.in_flight: Set[asyncio.Task] = set()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.task: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.dropped = 0
+
+    async def start(self):
+        if self.secret is None:
+            self.logger.warning("WEBHOOK_SECRET is not set, webhooks will be unsigned")
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=10,
+                resolver=PublicResolver(self.allowed_hosts),
+            ),
+            timeout=aiohttp.ClientTimeout(total=self.timeout_seconds),
+        )
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self, flush_timeout_seconds: float = 5.0):
+        """
+        Give queued and in-flight deliveries a moment to go out, then stop.
+        """
+        try:
+            await asyncio.wait_for(self.queue.join(), flush_timeout_seconds)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"Dropping {self.queue.qsize()} undelivered webhook events on shutdown"
+            )
+        if self.task is not None:
+            self.task.cancel()
+        for task in list(self.in_flight):
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+
+    def enqueue(self, url: str, event: Dict):
+        """
+        Queue an event for delivery without waiting on the receiver.
+
+        :param url: The callback URL to deliver to.
+        :param event: The event payload.
+        """
+        event = {"event_id": uuid.uuid4().hex, "created_at": time.time(), **event}
+        try:
+            self.queue.put_nowait((url, event))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.logger.error(f"Webhook queue is full, dropping event for {url}")
+
+    async def run(self):
+        while True:
+            batches: Dict[str, List[Dict]] = defaultdict(list)
+            url, event = await self.queue.get()
+            batches[url].append(event)
+            taken = 1
+            # Gather whatever else arrives within the window into the same requests
+            deadline = time.monotonic() + self.batch_window_seconds
+            while taken < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    url, event = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batches[url].append(event)
+                taken += 1
+
+            for url, events in batches.items():
+                await self.deliveries.acquire()
+                task = asyncio.create_task(self.deliver(url, events))
+                self.in_flight.add(task)
+                task.add_done_callback(self.in_flight.discard)
+
+    async def deliver(self, url: str, events: List[Dict]):
+        """
+        Post a batch of events to a callback URL, retrying with backoff until it is
+        accepted, rejected, or out of attempts.
+        """
+        body = json.dumps({"events": events}).encode()
+        try:
+            # Addresses skip the resolver, and URLs stored before they were checked
+            # might be private
+            try:
+                check_callback_url(url, self.allowed_hosts)
+            except ValueError as e:
+                self.logger.error(f"Not delivering {len(events)} events to {url}: {e}")
+                self.dropped += len(events)
+                return
+            for attempt in range(self.max_attempts):
+                timestamp = str(int(time.time()))
+                headers = {
+                    "Content-Type": "application/json",
+                    TIMESTAMP_HEADER: timestamp,
+                }
+                if self.secret is not None:
+                    headers[SIGNATURE_HEADER] = sign(self.secret, timestamp, body)
+                try:
+                    async with self.session.post(
+                        url, data=body, headers=headers
+                    ) as resp:
+                        if resp.status < 400:
+                            self.delivered += len(events)
+                            return
+                        if resp.status < 500 and resp.status not in RETRYABLE_STATUSES:
+                            self.logger.error(
+                                f"Webhook {url} rejected {len(events)} events with {resp.status}"
+                            )
+                            self.dropped += len(events)
+                            return
+                        error = f"status {resp.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = str(e) or type(e).__name__
+
+                if attempt + 1 < self.max_attempts:
+                    # Full jitter keeps retries from a receiver's outage from arriving in lockstep
+                    delay = random.uniform(0, self.base_delay_seconds * 2**attempt)
+                    self.logger.info(
+                        f"Webhook delivery to {url} failed ({error}), retrying in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+            self.logger.error(
+                f"Giving up on delivering {len(events)} webhook events to {url} ({error})"
+            )
+            self.dropped += len(events)
+        finally:
+            self.deliveries.release()
+            for _ in events:
+                self.queue.task_done()
@@ -1,24 +1,75 @@
 import asyncio
 from datetime import datetime, timedelta
-import json
 import logging
+import time
 from dataclasses import asdict
-from typing import Dict, Tuple
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
 
 import aio_pika
 from distributed_transcoder_common.message_types import (
+    CONTENT_TYPE_JSON,
+    JobControlMessage,
     JobProgressMessage,
     JobResultMessage,
+    JobTransitionMessage,
+    JobTransitionReplyMessage,
+    MediaInfoMessage,
+    MessageDecodeError,
+    decode_message,
+    encode_message,
 )
-from distributed_transcoder_common.models import Job
+from distributed_transcoder_common.models import Job, MediaInfo, Playlist
+from distributed_transcoder_common.tracing import published_at, record_span, span
+from tortoise.expressions import F
 
+from .dedup import OutputDeduplicator
+from .dispatch import (
+    CONTROL_EXCHANGE_NAME,
+    DEAD_LETTER_QUEUE_NAME,
+    JOB_QUEUE_NAME,
+    RETRY_DELAYS_SECONDS,
+    publish_control,
+    publish_job,
+    retry_job,
+    retry_queue_name,
+)
+from .eta import EtaEstimator
 from .managers import EventManager
+from .preset_cache import PRESET_INVALIDATION_EXCHANGE, PresetCache
+from .queries import TERMINAL_STATES, UNFINISHED_STATES
+from .speculation import StragglerDetector
+from .transitions import (
+    JOB_TRANSITIONS_QUEUE_NAME,
+    MEDIA_INFO_QUEUE_NAME,
+    MessageBatcher,
+    claim_jobs,
+    record_checkpoints,
+    record_heartbeats,
+    record_media,
+    record_results,
+    release_jobs,
+    transition_reply,
+)
+from .webhooks import WebhookDispatcher
 
 # Define constants for queues
-JOB_QUEUE_NAME = "transcoding_jobs"
 PROGRESS_QUEUE_NAME = "transcoding_progress"
 RESULTS_QUEUE_NAME = "transcoding_results"
 
+# Running jobs which haven't reported progress for this long are requeued
+STALL_TIMEOUT = timedelta(minutes=1)
+# How often the jobs which reported progress are recorded as alive, well within the
+# stall timeout
+HEARTBEAT_INTERVAL_SECONDS = 15
+
+# States a job can still be cancelled from
+CANCELLABLE_STATES = UNFINISHED_STATES
+
+# States of dependencies that mean a waiting job can never run
+FAILED_DEPENDENCY_STATES = tuple(
+    state for state in TERMINAL_STATES if state != Job.STATE_COMPLETED
+)
+
 
 async def init_channels(
     rmq_host: str,
@@ -59,6 +110,19 @@ async def init_channels(
     # Initialize a standard queue for jobs
     await channel.declare_queue(JOB_QUEUE_NAME)
 
+    # Initialize a delay queue per retry backoff, which hands jobs back to the job queue
+    for delay in RETRY_DELAYS_SECONDS:
+        await channel.declare_queue(
+            retry_queue_name(delay),
+            arguments={
+                "x-message-ttl": delay * 1000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": JOB_QUEUE_NAME,
+            },
+        )
+    # Initialize a queue for jobs that ran out of attempts
+    await channel.declare_queue(DEAD_LETTER_QUEUE_NAME)
+
     # Initialize a topic exchange for progress logs
     await channel.declare_exchange("progress_logs", aio_pika.ExchangeType.TOPIC)
     # Initialize a queue for progress logs
@@ -71,6 +135,19 @@ async def init_channels(
     results_queue = await channel.declare_queue(RESULTS_QUEUE_NAME)
     await results_queue.bind("results_logs", routing_key=f"{RESULTS_QUEUE_NAME}.*")
 
+    # Initialize a queue for workers' requests to move jobs between states, and one for
+    # the properties of the sources they probe
+    await channel.declare_queue(JOB_TRANSITIONS_QUEUE_NAME)
+    await channel.declare_queue(MEDIA_INFO_QUEUE_NAME)
+
+    # Initialize a fanout exchange for preset cache invalidations across API instances
+    await channel.declare_exchange(
+        PRESET_INVALIDATION_EXCHANGE, aio_pika.ExchangeType.FANOUT
+    )
+
+    # Initialize a fanout exchange for control messages to workers
+    await channel.declare_exchange(CONTROL_EXCHANGE_NAME, aio_pika.ExchangeType.FANOUT)
+
     return (channel, connection)
 
 
@@ -78,13 +155,243 @@ class WorkQueue:
     def __init__(
         self,
         channel: aio_pika.Channel,
+        presets: PresetCache,
         event_manager: EventManager,
         logger: logging.Logger,
+        deduplicator: Optional[OutputDeduplicator] = None,
+        straggler_detector: Optional[StragglerDetector] = None,
+        webhooks: Optional[WebhookDispatcher] = None,
+        eta_estimator: Optional[EtaEstimator] = None,
     ):
         self.channel = channel
+        self.presets = presets
         self.event_manager = event_manager
         self.last_progress_messages: Dict[str, JobProgressMessage] = {}
         self.logger = logger
+        self.deduplicator = deduplicator
+        self.straggler_detector = straggler_detector
+        self.webhooks = webhooks
+        self.eta_estimator = eta_estimator
+        # Probed durations of the sources of running jobs, which progress rates are
+        # normalized by
+        self.source_durations: Dict[str, Optional[float]] = {}
+        # Jobs which reported progress since the last heartbeat was recorded
+        self.heartbeats: Set[str] = set()
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        # Workers' reports are applied to the database in batches, so that the number
+        # of queries doesn't grow with the number of workers
+        self.transition_batcher = MessageBatcher(self.apply_transitions, logger)
+        self.result_batcher = MessageBatcher(self.apply_results, logger)
+        self.media_batcher = MessageBatcher(
+            self.apply_media, logger, window_seconds=1.0
+        )
+
+    def forget_progress(self, job_id: str):
+        "Drop what was tracked of a job's progress, once it is no longer running."
+        self.last_progress_messages.pop(job_id, None)
+        self.source_durations.pop(job_id, None)
+        if self.eta_estimator is not None:
+            self.eta_estimator.forget(job_id)
+
+    async def source_duration(self, job: Job) -> Optional[float]:
+        """
+        The duration of a running job's source in seconds, looked up once per job. Workers
+        probe the source before they start encoding, so it is known by the time the job
+        reports progress unless the probe failed.
+        """
+        if job.job_id not in self.source_durations:
+            duration_ns = (
+                await MediaInfo.filter(s3_path=job.input_s3_path)
+                .first()
+                .values_list("duration_ns", flat=True)
+            )
+            self.source_durations[job.job_id] = (
+                duration_ns / 1_000_000_000 if duration_ns else None
+            )
+        return self.source_durations[job.job_id]
+
+    def eta(self, job_id: str) -> Optional[float]:
+        "The estimated seconds left of a running job, if its progress has been seen."
+        if self.eta_estimator is not None:
+            eta = self.eta_estimator.eta(job_id)
+            if eta is not None:
+                return eta
+        # Fall back on the estimate of the worker running it
+        progress = self.last_progress_messages.get(job_id)
+        return progress.eta_seconds if progress is not None else None
+
+    def progress_frame(self, msg: JobProgressMessage) -> Dict:
+        "A progress message as sent to websocket clients, with the job's estimated ETA."
+        eta = self.eta(msg.job_id)
+        if eta is None:
+            eta = msg.eta_seconds
+        return {**asdict(msg), "eta_seconds": eta}
+
+    async def send_completion(self, job: Job, result: JobResultMessage):
+        """
+        Tell the clients watching a job that it has finished, over their websockets and
+        through the callback URLs of the job and its playlists.
+
+        :param job: The job that finished.
+        :param result: The result to send.
+        :return: None
+        """
+        await self.event_manager.send_message(job.job_id, "completion", asdict(result))
+        if self.webhooks is None:
+            return
+        event = {"type": f"job.{result.status}", **asdict(result)}
+        if job.callback_url:
+            self.webhooks.enqueue(job.callback_url, event)
+        for playlist_id, callback_url in await Playlist.filter(
+            jobs__id=job.id, callback_url__isnull=False
+        ).values_list("id", "callback_url"):
+            self.webhooks.enqueue(
+                callback_url, {**event, "playlist_id": str(playlist_id)}
+            )
+
+    async def cancel_job(self, job: Job, reason: str) -> bool:
+        """
+        Cancel a job which hasn't finished, and tell whichever worker is running it to
+        stop. Queued copies of the job are dropped by the worker that picks them up.
+
+        :param job: The job to cancel.
+        :param reason: Why the job was cancelled, passed on to the worker.
+        :return: True if the job was cancelled, False if it had already finished.
+        """
+        # Conditional so that a result recorded meanwhile isn't overwritten
+        cancelled = await Job.filter(
+            job_id=job.job_id, state__in=CANCELLABLE_STATES
+        ).update(state=Job.STATE_CANCELLED, updated_at=datetime.now())
+        if not cancelled:
+            return False
+
+        await publish_control(
+            self.channel,
+            JobControlMessage(
+                action=JobControlMessage.ACTION_CANCEL,
+                job_id=job.job_id,
+                reason=reason,
+                timestamp=time.time(),
+            ),
+        )
+        self.forget_progress(job.job_id)
+        if self.straggler_detector is not None:
+            self.straggler_detector.forget(job.job_id)
+        await self.send_completion(
+            job,
+            JobResultMessage(
+                job_id=job.job_id,
+                status=Job.STATE_CANCELLED,
+                timestamp=time.time(),
+                error=reason,
+                error_type="cancelled",
+            ),
+        )
+        await self.settle_followers(job, Job.STATE_CANCELLED)
+        await self.release_dependents(job)
+        return True
+
+    async def settle_followers(self, job: Job, status: str):
+        """
+        Settle the jobs waiting to reuse the output of a job which is no longer running.
+
+        Followers of a completed job get a copy of its output. Followers of a job which
+        failed, stalled or was cancelled are enqueued to run on their own.
+
+        :param job: The job that finished.
+        :param status: The state the job finished in.
+        :return: None
+        """
+        if self.deduplicator is None:
+            return
+        if status == Job.STATE_COMPLETED:
+            for follower in await self.deduplicator.complete_followers(job):
+                await self.send_completion(
+                    follower,
+                    JobResultMessage(
+                        job_id=follower.job_id,
+                        status=follower.state,
+                        output_s3_path=follower.output_s3_path,
+                        error=follower.error,
+                        error_type=follower.error_type,
+                    ),
+                )
+                await self.release_dependents(follower)
+        else:
+            for follower in await self.deduplicator.release_followers(job):
+                self.logger.info(
+                    f"Job {job.job_id} did not complete, enqueueing follower {follower.job_id}"
+                )
+                await publish_job(self.channel, follower, self.presets)
+
+    async def settle_dependencies(self, job: Job):
+        """
+        Dispatch a waiting job once every job it depends on has completed, or fail it as
+        soon as one of them finishes without completing.
+
+        :param job: The waiting job.
+        :return: None
+        """
+        # Read through the job's own relation, as filtering jobs across the relation
+        # to themselves joins the job table twice under one alias
+        dependencies = [
+            (dependency.job_id, dependency.state)
+            for dependency in await job.dependencies.all()
+        ]
+        failed = [
+            (job_id, state)
+            for job_id, state in dependencies
+            if state in FAILED_DEPENDENCY_STATES
+        ]
+        if failed:
+            dependency_id, dependency_state = failed[0]
+            error = f"Dependency {dependency_id} {dependency_state}"
+            # Conditional so that only one of several finishing dependencies fails it
+            settled = await Job.filter(id=job.id, state=Job.STATE_WAITING).update(
+                state=Job.STATE_FAILED,
+                error=error,
+                error_type="dependency_failed",
+                updated_at=datetime.now(),
+            )
+            if not settled:
+                return
+            self.logger.info(
+                f"Job {job.job_id} failed, as its dependency {dependency_id} {dependency_state}"
+            )
+            await self.send_completion(
+                job,
+                JobResultMessage(
+                    job_id=job.job_id,
+                    status=Job.STATE_FAILED,
+                    timestamp=time.time(),
+                    error=error,
+                    error_type="dependency_failed",
+                ),
+            )
+            await self.release_dependents(job)
+            return
+
+        if any(state != Job.STATE_COMPLETED for _, state in dependencies):
+            return
+        # Conditional so that only one of several finishing dependencies dispatches it
+        settled = await Job.filter(id=job.id, state=Job.STATE_WAITING).update(
+            state=Job.STATE_QUEUED, updated_at=datetime.now()
+        )
+        if settled:
+            self.logger.info(
+                f"Dependencies of job {job.job_id} completed, enqueueing it"
+            )
+            await publish_job(self.channel, job, self.presets)
+
+    async def release_dependents(self, job: Job):
+        """
+        Settle the jobs waiting on a job which has finished.
+
+        :param job: The job that finished.
+        :return: None
+        """
+        for dependent in await job.dependents.filter(state=Job.STATE_WAITING):
+            await self.settle_dependencies(dependent)
 
     async def progress_callback(self, message: aio_pika.abc.AbstractIncomingMessage):
         """
@@ -97,92 +404,333 @@ class WorkQueue:
 
         :return: None
         """
-        msg = JobProgressMessage(**json.loads(message.body.decode()))
-        # Store the progress message in a dictionary so we can serve it to newly connected clients
-        self.last_progress_messages[msg.job_id] = msg
+        msg = decode_message(JobProgressMessage, message.body, message.content_type)
+        # Store the progress message in a dictionary so we can serve it to newly connected clients.
+        # While a speculative copy races the original, keep whichever is further along.
+        last_msg = self.last_progress_messages.get(msg.job_id)
+        if (
+            last_msg is None
+            or last_msg.worker_id == msg.worker_id
+            or msg.progress >= last_msg.progress
+        ):
+            self.last_progress_messages[msg.job_id] = msg
 
         # Confirm the job exists in the database
         job = await Job.get_or_none(job_id=msg.job_id)
         if job is None:
             self.logger.info(f"Received progress message for unknown job {msg.job_id}")
             return
-        await self.event_manager.send_message(msg.job_id, "progress", asdict(msg))
+        self.heartbeats.add(msg.job_id)
+        duration_seconds = await self.source_duration(job)
+        if self.straggler_detector is not None:
+            self.straggler_detector.record_progress(
+                msg, job.preset_id, duration_seconds
+            )
+        if self.eta_estimator is not None:
+            self.eta_estimator.record(msg, job.preset_id, duration_seconds)
+        await self.event_manager.send_message(
+            msg.job_id, "progress", self.progress_frame(msg)
+        )
 
-    async def result_callback(self, message: aio_pika.abc.AbstractIncomingMessage):
+    async def apply_transitions(
+        self, messages: List[aio_pika.abc.AbstractIncomingMessage]
+    ):
         """
-        Callback for when a result message is received from the work queue.
-
-        :param ch: The channel the message was received on.
-        :param method: The method used to deliver the message.
-        :param properties: The message properties.
-        :param body: The message body.
+        Apply a batch of workers' requests to move jobs between states, and answer each
+        of them once applied.
 
+        :param messages: The request messages.
         :return: None
         """
-        result = JobResultMessage(**json.loads(message.body.decode()))
-        # Remove the job from the in-progress tracker
-        self.last_progress_messages.pop(result.job_id, None)
-        # Confirm the job exists in the database
-        job = await Job.get_or_none(job_id=result.job_id)
-        if job is None:
-            self.logger.info(f"Received result message for unknown job {result.job_id}")
-            return
-        if result.status == Job.STATE_COMPLETED or result.status == Job.STATE_FAILED:
-            await self.event_manager.send_message(
-                result.job_id, "completion", asdict(result)
+        requests = []
+        for message in messages:
+            try:
+                msg = decode_message(
+                    JobTransitionMessage, message.body, message.content_type
+                )
+            except MessageDecodeError as e:
+                self.logger.error(f"Discarding undecodable transition request: {e}")
+                continue
+            requests.append((message, msg))
+
+        def with_action(action: str) -> List[JobTransitionMessage]:
+            return [msg for _, msg in requests if msg.action == action]
+
+        def owned(transitions: List[JobTransitionMessage]):
+            # Speculative copies share the original attempt's claim token, but the job
+            # is only the original's to hand back or checkpoint
+            return [msg for msg in transitions if not msg.speculative]
+
+        claims = with_action(JobTransitionMessage.ACTION_CLAIM)
+        await claim_jobs(owned(claims))
+        released = await release_jobs(
+            owned(with_action(JobTransitionMessage.ACTION_RELEASE))
+        )
+        checkpointed = await record_checkpoints(
+            owned(with_action(JobTransitionMessage.ACTION_CHECKPOINT))
+        )
+        for job_id in released:
+            self.forget_progress(job_id)
+            if self.straggler_detector is not None:
+                self.straggler_detector.forget(job_id)
+
+        # Claims are answered from the jobs as they are now, so that a claim resent
+        # after its reply was lost is granted again rather than refused
+        jobs = {
+            job.job_id: job
+            for job in await Job.filter(job_id__in={msg.job_id for _, msg in requests})
+        }
+        sources = {
+            media.s3_path: media
+            for media in await MediaInfo.filter(
+                s3_path__in={
+                    jobs[claim.job_id].input_s3_path
+                    for claim in claims
+                    if claim.job_id in jobs
+                }
+            )
+        }
+
+        for message, msg in requests:
+            if msg.action not in (
+                JobTransitionMessage.ACTION_CLAIM,
+                JobTransitionMessage.ACTION_RELEASE,
+                JobTransitionMessage.ACTION_CHECKPOINT,
+            ):
+                self.logger.error(
+                    f"Unknown transition {msg.action} for job {msg.job_id}"
+                )
+            reply = transition_reply(
+                msg, jobs.get(msg.job_id), released, checkpointed, sources
             )
+            await self.reply(message, reply)
+
+    async def reply(
+        self,
+        message: aio_pika.abc.AbstractIncomingMessage,
+        reply: JobTransitionReplyMessage,
+    ):
+        """
+        Answer a worker's request on the queue it asked to be answered on.
+        """
+        if not message.reply_to:
+            return
+        # Answer in the encoding the worker asked in, which it is known to understand
+        content_type = message.content_type or CONTENT_TYPE_JSON
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                encode_message(reply, content_type),
+                content_type=content_type,
+                correlation_id=message.correlation_id,
+            ),
+            routing_key=message.reply_to,
+        )
+
+    async def apply_results(self, messages: List[aio_pika.abc.AbstractIncomingMessage]):
+        """
+        Record a batch of job results from the workers, then tell the clients watching
+        each job and settle the jobs waiting on it.
+
+        :param messages: The result messages.
+        :return: None
+        """
+        started_at = time.time()
+        results: List[JobResultMessage] = []
+        # Headers carrying the trace of each job, continued by the spans recording it
+        trace_parents: Dict[str, Mapping[str, Any]] = {}
+        for message in messages:
+            try:
+                result = decode_message(
+                    JobResultMessage, message.body, message.content_type
+                )
+            except MessageDecodeError as e:
+                self.logger.error(f"Discarding undecodable result: {e}")
+                continue
+            headers = message.headers or {}
+            sent_at = published_at(headers)
+            if sent_at is not None:
+                record_span(
+                    "result_queue_wait",
+                    sent_at,
+                    started_at,
+                    parent=headers,
+                    attributes={"job.id": result.job_id},
+                )
+            trace_parents[result.job_id] = headers
+            if result.speculative and result.status != Job.STATE_COMPLETED:
+                # The original attempt is still running, so only a win ends the job
+                self.logger.info(
+                    f"Speculative copy of job {result.job_id} on worker {result.worker_id} ended as {result.status}"
+                )
+                if self.straggler_detector is not None:
+                    await self.straggler_detector.record_result(
+                        result.job_id, result.status, result.worker_id, final=False
+                    )
+                continue
+            if result.status == Job.STATE_CANCELLED:
+                self.logger.info(
+                    f"Job {result.job_id} was cancelled on worker {result.worker_id}"
+                )
+                continue
+            # Remove the job from the in-progress tracker
+            self.forget_progress(result.job_id)
+            results.append(result)
+
+        recorded = await record_results(results)
+        jobs = {job.job_id: job for job in await Job.filter(job_id__in=recorded)}
+        for result in results:
+            job = jobs.pop(result.job_id, None)
+            if self.straggler_detector is not None:
+                await self.straggler_detector.record_result(
+                    result.job_id,
+                    result.status,
+                    result.worker_id,
+                    final=job is not None,
+                )
+            if job is None:
+                # The job was cancelled while the worker was finishing it, another
+                # copy's result was recorded first, or the attempt was superseded
+                self.logger.info(
+                    f"Ignoring {result.status} result for job {result.job_id}, which is no longer running"
+                )
+                continue
+            # The span covers the batch's shared write of the results too
+            with span(
+                "apply_result",
+                parent=trace_parents.get(result.job_id),
+                attributes={"job.id": result.job_id, "job.status": result.status},
+                start_time=started_at,
+            ):
+                if (
+                    result.status == Job.STATE_COMPLETED
+                    or result.status == Job.STATE_FAILED
+                ):
+                    await self.send_completion(job, result)
+                    await self.settle_followers(job, result.status)
+                    await self.release_dependents(job)
+
+    async def apply_media(self, messages: List[aio_pika.abc.AbstractIncomingMessage]):
+        """
+        Record a batch of sources' probed properties from the workers.
+
+        :param messages: The media info messages.
+        :return: None
+        """
+        probes: Dict[str, Dict] = {}
+        for message in messages:
+            try:
+                msg = decode_message(
+                    MediaInfoMessage, message.body, message.content_type
+                )
+            except MessageDecodeError as e:
+                self.logger.error(f"Discarding undecodable media info: {e}")
+                continue
+            probes[msg.s3_path] = msg.media
+        await record_media(probes)
+
+    async def record_heartbeats(self, interval_seconds: float):
+        "Record the jobs which reported progress as alive, every interval."
+        while True:
+            await asyncio.sleep(interval_seconds)
+            job_ids, self.heartbeats = self.heartbeats, set()
+            try:
+                await record_heartbeats(job_ids)
+            except Exception as e:
+                self.logger.error(f"Error while recording job heartbeats: {e}")
+                self.heartbeats |= job_ids
 
     async def consume_events(self):
+        # Held here, as the event loop only keeps a weak reference to its tasks
+        self.heartbeat_task = asyncio.create_task(
+            self.record_heartbeats(HEARTBEAT_INTERVAL_SECONDS)
+        )
         try:
             progress_queue = await self.channel.get_queue(PROGRESS_QUEUE_NAME)
             await progress_queue.consume(self.progress_callback)
 
-            results_queue = await self.channel.get_queue(RESULTS_QUEUE_NAME)
-            await results_queue.consume(self.result_callback)
+            for batcher, queue_name in [
+                (self.result_batcher, RESULTS_QUEUE_NAME),
+                (self.transition_batcher, JOB_TRANSITIONS_QUEUE_NAME),
+                (self.media_batcher, MEDIA_INFO_QUEUE_NAME),
+            ]:
+                batcher.start()
+                queue = await self.channel.get_queue(queue_name)
+                await queue.consume(batcher)
         except Exception as e:
             self.logger.error(f"Error while consuming events: {e}")
 
-        # Loop every 60 seconds to check if there are any in-progress jobs which have not made progress
+        # Loop every 60 seconds to check if there are any in-progress jobs which have not
+        # made progress. Progress is judged from the heartbeats recorded in the database
+        # by whichever instance consumed it, never from this instance's own view.
         while True:
             self.logger.info("Checking for stalled jobs...")
+            cutoff = datetime.now() - STALL_TIMEOUT
             async for job in Job.filter(
-                state=Job.STATE_IN_PROGRESS,
-                updated_at__lt=datetime.now() - timedelta(minutes=1),
+                state=Job.STATE_IN_PROGRESS, updated_at__lt=cutoff
             ):
-                self.logger.info(f"Checking job {job.job_id}...")
-                # If the job has not made progress in more than a minute, mark it as stalled
-                job_has_progress = job.job_id in self.last_progress_messages
-                job_progress_too_old = False
-                if job_has_progress:
-                    job_progress_too_old = datetime.fromtimestamp(
-                        self.last_progress_messages[job.job_id].timestamp
-                    ) < (datetime.now() - timedelta(minutes=1))
-                if not job_has_progress or job_progress_too_old:
+                self.logger.info(
+                    f"Job {job.job_id} has not made progress in more than a minute, requeueing it."
+                )
+                self.forget_progress(job.job_id)
+                if self.straggler_detector is not None:
+                    self.straggler_detector.forget(job.job_id)
+
+                # Stalls are usually down to the worker, so give the job another
+                # attempt which resumes from its last checkpoint. Only while the
+                # attempt that stalled still holds the job, as a result or release
+                # may have been recorded since it was read. The claim is revoked,
+                # so the stalled worker can't report on the job if it comes back.
+                job.state = Job.STATE_RETRYING
+                job.error = "Job stopped making progress"
+                job.error_type = "stalled"
+                requeued = await Job.filter(
+                    job_id=job.job_id,
+                    state=Job.STATE_IN_PROGRESS,
+                    claim_token=job.claim_token,
+                    updated_at__lt=cutoff,
+                ).update(
+                    state=job.state,
+                    error=job.error,
+                    error_type=job.error_type,
+                    claim_token=F("claim_token") + 1,
+                    updated_at=datetime.now(),
+                )
+                if not requeued:
+                    self.logger.info(
+                        f"Job {job.job_id} moved on while it was being checked, leaving it."
+                    )
+                    continue
+                if await retry_job(self.channel, job, self.presets):
                     self.logger.info(
-                        f"Job {job.job_id} has not made progress in more than a minute, marking it as stalled."
+                        f"Job {job.job_id} requeued for attempt {job.attempts + 1}."
+                    )
+                    continue
+
+                job.state = Job.STATE_STALLED
+                await Job.filter(
+                    job_id=job.job_id,
+                    state=Job.STATE_RETRYING,
+                    claim_token=job.claim_token + 1,
+                ).update(state=job.state, updated_at=datetime.now())
+                await self.settle_followers(job, Job.STATE_STALLED)
+                await self.release_dependents(job)
+                try:
+                    await self.send_completion(
+                        job,
+                        JobResultMessage(
+                            timestamp=None,
+                            worker_id=None,
+                            job_id=job.job_id,
+                            status=Job.STATE_STALLED,
+                            output_s3_path=None,
+                            error=None,
+                            error_type=None,
+                        ),
                     )
-                    job.state = Job.STATE_STALLED
-                    await job.save()
-                    try:
-                        await self.event_manager.send_message(
-                            job.job_id,
-                            "completion",
-                            asdict(
-                                JobResultMessage(
-                                    timestamp=None,
-                                    worker_id=None,
-                                    job_id=job.job_id,
-                                    status=Job.STATE_STALLED,
-                                    output_s3_path=None,
-                                    error=None,
-                                    error_type=None,
-                                )
-                            ),
-                        )
-                    except Exception as e:
-                        self.logger.error(
-                            f"Error while sending completion message: {e}"
-                        )
-                    self.logger.info(f"Job {job.job_id} marked as stalled.")
+                except Exception as e:
+                    self.logger.error(f"Error while sending completion message: {e}")
+                self.logger.info(
+                    f"Job {job.job_id} ran out of attempts and was marked as stalled."
+                )
             self.logger.info("Finished checking for stalled jobs.")
             await asyncio.sleep(60)
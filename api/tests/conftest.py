@@ -0,0 +1,30 @@
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+import pytest
+from tortoise import Tortoise
+
+T = TypeVar("T")
+
+
+@pytest.fixture
+def run_with_db() -> Callable[[Callable[[], Awaitable[T]]], T]:
+    """
+    Run a coroutine function against a fresh in-memory database of the models.
+    """
+
+    def run(test: Callable[[], Awaitable[T]]) -> T:
+        async def main():
+            await Tortoise.init(
+                db_url="sqlite://:memory:",
+                modules={"models": ["distributed_transcoder_common.models"]},
+            )
+            await Tortoise.generate_schemas()
+            try:
+                return await test()
+            finally:
+                await Tortoise.close_connections()
+
+        return asyncio.run(main())
+
+    return run
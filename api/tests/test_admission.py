@@ -0,0 +1,69 @@
+import pytest
+from distributed_transcoder_api import admission
+from distributed_transcoder_api.admission import TokenBucket, client_key, parse_networks
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_allows_a_burst(clock):
+    bucket = TokenBucket(rate=2, capacity=5)
+    for _ in range(5):
+        assert bucket.take(1) == 0
+    assert bucket.take(1) == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_its_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=5)
+    assert bucket.take(5) == 0
+    clock.now += 1
+    assert bucket.take(3) == pytest.approx(0.5)
+    assert bucket.take(2) == 0
+    assert bucket.take(1) == pytest.approx(0.5)
+
+
+def test_bucket_is_capped_at_its_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=5)
+    clock.now += 3600
+    assert bucket.take(5) == 0
+    assert bucket.take(1) == pytest.approx(0.5)
+
+
+def test_refused_takes_keep_the_tokens(clock):
+    bucket = TokenBucket(rate=1, capacity=4)
+    assert bucket.take(3) == 0
+    assert bucket.take(2) == pytest.approx(1)
+    assert bucket.take(1) == 0
+
+
+def test_parse_networks():
+    networks = parse_networks(" 10.0.0.0/8, 192.168.1.10 ,,::1")
+    assert [str(network) for network in networks] == [
+        "10.0.0.0/8",
+        "192.168.1.10/32",
+        "::1/128",
+    ]
+    assert parse_networks("") == []
+    with pytest.raises(ValueError):
+        parse_networks("proxy.internal")
+
+
+def test_client_key_takes_claims_from_trusted_proxies_only():
+    proxies = parse_networks("10.0.0.0/8")
+    assert client_key("10.1.2.3", "tenant-a", proxies) == "tenant-a"
+    assert client_key("203.0.113.5", "tenant-a", proxies) == "203.0.113.5"
+    assert client_key("10.1.2.3", None, proxies) == "10.1.2.3"
+    assert client_key("203.0.113.5", "tenant-a", []) == "203.0.113.5"
+    assert client_key(None, "tenant-a", proxies) == "unknown"
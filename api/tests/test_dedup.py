@@ -0,0 +1,38 @@
+import logging
+
+from distributed_transcoder_api.dedup import OutputDeduplicator, normalize_pipeline
+from distributed_transcoder_common import LocalStorage
+
+PIPELINE = (
+    "filesrc location={{input_file}} ! qtdemux name=d "
+    "d.video_0 ! decodebin ! video/x-raw,width=1280,height=720 ! "
+    "x264enc bitrate=1024 ! mp4mux ! filesink location={{output_file}}"
+)
+
+
+def test_normalize_collapses_whitespace():
+    messy = (
+        "  filesrc location = {{input_file}}  !  qtdemux name=d\n"
+        "d.video_0 ! decodebin !\tvideo/x-raw, width=1280, height=720 ! "
+        "x264enc   bitrate=1024 ! mp4mux ! filesink location={{output_file}} "
+    )
+    assert normalize_pipeline(messy) == normalize_pipeline(PIPELINE)
+
+
+def test_normalize_keeps_meaningful_differences():
+    other = PIPELINE.replace("bitrate=1024", "bitrate=2048")
+    assert normalize_pipeline(other) != normalize_pipeline(PIPELINE)
+
+
+def test_key_ignores_cosmetic_differences(tmp_path):
+    (tmp_path / "in.mp4").write_bytes(b"source")
+    deduplicator = OutputDeduplicator(LocalStorage(str(tmp_path)), logging.getLogger())
+    key = deduplicator.compute_key("in.mp4", PIPELINE)
+    assert key is not None
+    assert deduplicator.compute_key("in.mp4", PIPELINE.replace(" ! ", "  !  ")) == key
+    assert deduplicator.compute_key("in.mp4", PIPELINE.replace("1024", "2048")) != key
+
+
+def test_key_of_missing_input(tmp_path):
+    deduplicator = OutputDeduplicator(LocalStorage(str(tmp_path)), logging.getLogger())
+    assert deduplicator.compute_key("missing.mp4", PIPELINE) is None
@@ -0,0 +1,84 @@
+import logging
+
+from distributed_transcoder_api import work_queue
+from distributed_transcoder_api.work_queue import WorkQueue
+from distributed_transcoder_common.models import Job
+
+
+class FakeEventManager:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, job_id, event, data):
+        self.sent.append((job_id, event, data["status"]))
+
+
+def make_queue(monkeypatch):
+    "A work queue which records the jobs it dispatches and the completions it sends."
+    published = []
+
+    async def publish_job(channel, job, presets, **kwargs):
+        published.append(job.job_id)
+
+    monkeypatch.setattr(work_queue, "publish_job", publish_job)
+    queue = WorkQueue(None, None, FakeEventManager(), logging.getLogger(__name__))
+    return queue, published
+
+
+async def create_job(job_id: str, state: str, depends_on=()) -> Job:
+    job = await Job.create(
+        job_id=job_id,
+        input_s3_path=f"{job_id}.mp4",
+        output_s3_path=f"{job_id}-out.mp4",
+        pipeline="",
+        state=state,
+    )
+    if depends_on:
+        await job.dependencies.add(*depends_on)
+    return job
+
+
+def test_dependent_waits_for_every_dependency(run_with_db, monkeypatch):
+    async def test():
+        queue, published = make_queue(monkeypatch)
+        first = await create_job("first", Job.STATE_COMPLETED)
+        second = await create_job("second", Job.STATE_IN_PROGRESS)
+        await create_job("dependent", Job.STATE_WAITING, [first, second])
+
+        await queue.release_dependents(first)
+        assert (await Job.get(job_id="dependent")).state == Job.STATE_WAITING
+        assert published == []
+
+        second.state = Job.STATE_COMPLETED
+        await second.save()
+        await queue.release_dependents(second)
+        # Finishing dependencies racing to release it only dispatch it once
+        await queue.release_dependents(first)
+        assert (await Job.get(job_id="dependent")).state == Job.STATE_QUEUED
+        assert published == ["dependent"]
+
+    run_with_db(test)
+
+
+def test_failed_dependency_fails_its_dependents(run_with_db, monkeypatch):
+    async def test():
+        queue, published = make_queue(monkeypatch)
+        failed = await create_job("failed", Job.STATE_FAILED)
+        running = await create_job("running", Job.STATE_IN_PROGRESS)
+        dependent = await create_job("dependent", Job.STATE_WAITING, [failed, running])
+        await create_job("grandchild", Job.STATE_WAITING, [dependent])
+
+        await queue.release_dependents(failed)
+        dependent = await Job.get(job_id="dependent")
+        assert dependent.state == Job.STATE_FAILED
+        assert dependent.error == "Dependency failed failed"
+        assert dependent.error_type == "dependency_failed"
+        # The failure carries on down the chain, without waiting on the running job
+        assert (await Job.get(job_id="grandchild")).state == Job.STATE_FAILED
+        assert published == []
+        assert queue.event_manager.sent == [
+            ("dependent", "completion", Job.STATE_FAILED),
+            ("grandchild", "completion", Job.STATE_FAILED),
+        ]
+
+    run_with_db(test)
@@ -0,0 +1,81 @@
+import pytest
+from distributed_transcoder_api.eta import EtaEstimator, ProgressHistory
+from distributed_transcoder_api.throughput import PresetThroughput
+from distributed_transcoder_common import JobProgressMessage
+
+
+def progress(timestamp, percent, worker_id="worker-1"):
+    return JobProgressMessage(timestamp, worker_id, "job-1", percent)
+
+
+def test_slope_of_steady_progress():
+    history = ProgressHistory("worker-1", None)
+    for t in range(10):
+        history.add(100.0 + t, 2.0 * t)
+    assert history.rate() == pytest.approx(2.0)
+
+
+def test_slope_smooths_jitter():
+    history = ProgressHistory("worker-1", None)
+    for t, jitter in zip(range(10), [0.5, -0.5] * 5):
+        history.add(float(t), t + jitter)
+    assert history.rate() == pytest.approx(1.0, abs=0.1)
+
+
+def test_slope_needs_progress():
+    history = ProgressHistory("worker-1", None)
+    assert history.rate() is None
+    history.add(0.0, 10.0)
+    assert history.rate() is None
+    history.add(5.0, 10.0)
+    assert history.rate() is None
+
+
+def test_ring_buffer_keeps_latest_samples():
+    history = ProgressHistory("worker-1", None, capacity=4)
+    # A slow start, which falls out of the buffer
+    for t in range(4):
+        history.add(float(t), 0.1 * t)
+    for t in range(4, 8):
+        history.add(float(t), 3.0 * t)
+    assert history.count == 4
+    assert history.last() == (7.0, 21.0)
+    assert history.rate() == pytest.approx(3.0)
+    assert history.first_timestamp == 0.0
+
+
+def test_eta_from_the_jobs_own_rate():
+    estimator = EtaEstimator(PresetThroughput())
+    for t in range(5):
+        estimator.record(progress(float(t), 10.0 * t), None)
+    # 60 percent left at 10 percent per second
+    assert estimator.eta("job-1", now=4.0) == pytest.approx(6.0)
+    assert estimator.eta("job-1", now=6.0) == pytest.approx(4.0)
+
+
+def test_eta_leans_on_the_preset_for_the_sources_duration():
+    throughput = PresetThroughput()
+    # The preset encodes at twice real time
+    throughput.record("preset", 2.0)
+    estimator = EtaEstimator(throughput, blend_seconds=60)
+    estimator.record(progress(0.0, 0.0), "preset", duration_seconds=200)
+    # 200 seconds of media at 2x is 100 seconds, the job alone can't tell yet
+    assert estimator.eta("job-1", now=0.0) == pytest.approx(100.0)
+    assert estimator.eta("unknown") is None
+
+
+def test_eta_without_a_known_duration():
+    throughput = PresetThroughput()
+    throughput.record("preset", 2.0)
+    estimator = EtaEstimator(throughput)
+    estimator.record(progress(0.0, 0.0), "preset")
+    assert estimator.eta("job-1", now=0.0) is None
+
+
+def test_history_follows_the_attempt_further_along():
+    estimator = EtaEstimator(PresetThroughput())
+    estimator.record(progress(0.0, 50.0), None)
+    estimator.record(progress(1.0, 10.0, worker_id="worker-2"), None)
+    assert estimator.percent("job-1") == 50.0
+    estimator.record(progress(2.0, 60.0, worker_id="worker-2"), None)
+    assert estimator.percent("job-1") == 60.0
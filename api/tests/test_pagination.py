@@ -0,0 +1,25 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from distributed_transcoder_api.pagination import decode_cursor, encode_cursor
+from fastapi import HTTPException
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2023, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    id = uuid.uuid4()
+    assert decode_cursor(encode_cursor(created_at, id)) == (created_at, id)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(datetime(2023, 5, 1), uuid.uuid4())
+    assert "=" not in cursor
+    assert "+" not in cursor and "/" not in cursor
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "bm90IGEgY3Vyc29y"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor)
+    assert e.value.status_code == 400
@@ -0,0 +1,84 @@
+import pytest
+from distributed_transcoder_api.pipelines import (
+    SPEED_TIER_BALANCED,
+    SPEED_TIER_FAST,
+    SPEED_TIER_QUALITY,
+    apply_speed_tier,
+    compile_pipeline,
+)
+
+FIELDS = {
+    "input_type": "mkv",
+    "output_type": "mp4",
+    "resolution": "1280x720",
+    "video_encoding": "h264",
+    "video_bitrate": "2048",
+    "audio_encoding": "aac",
+    "audio_bitrate": "128",
+}
+
+
+def test_compile_pipeline():
+    assert compile_pipeline(**FIELDS) == (
+        "filesrc location={{input_file}} ! matroskademux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} "
+        "d.audio_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! audioconvert ! avenc_aac bitrate=128000 ! mux.audio_0 "
+        "d.video_0 ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+        "decodebin ! videoscale ! video/x-raw,width=1280,height=720 ! "
+        "x264enc bitrate=2048 ! {{progress}} ! h264parse ! mux.video_0"
+    )
+
+
+def test_compile_pipeline_is_case_insensitive():
+    pipeline = compile_pipeline(**{**FIELDS, "video_encoding": "H265"})
+    assert "x265enc bitrate=2048 ! {{progress}} ! h265parse" in pipeline
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("input_type", "avi"),
+        ("output_type", "webm"),
+        ("video_encoding", "vp9"),
+        ("audio_encoding", "mp3"),
+        ("resolution", "720p"),
+        ("video_bitrate", "2 mbit"),
+        ("audio_bitrate", "0"),
+    ],
+)
+def test_compile_pipeline_rejects_unsupported_fields(field, value):
+    with pytest.raises(ValueError):
+        compile_pipeline(**{**FIELDS, field: value})
+
+
+def test_balanced_tier_keeps_the_pipeline():
+    pipeline = compile_pipeline(**FIELDS)
+    assert apply_speed_tier(pipeline, None) == pipeline
+    assert apply_speed_tier(pipeline, SPEED_TIER_BALANCED) == pipeline
+
+
+def test_fast_tier_on_x264():
+    pipeline = apply_speed_tier(compile_pipeline(**FIELDS), SPEED_TIER_FAST)
+    assert (
+        "x264enc bitrate=2048 speed-preset=veryfast rc-lookahead=10 ! {{progress}}"
+        in pipeline
+    )
+
+
+def test_tier_overrides_the_pipelines_own_settings():
+    pipeline = "d.video_0 ! x264enc speed-preset=medium bitrate=512 ! h264parse"
+    assert apply_speed_tier(pipeline, SPEED_TIER_QUALITY) == (
+        "d.video_0 ! x264enc bitrate=512 speed-preset=slow rc-lookahead=60 ! h264parse"
+    )
+
+
+def test_tier_folds_lookahead_into_x265_options():
+    pipeline = (
+        'd.video_0 ! x265enc bitrate=768 option-string="keyint=60:rc-lookahead=20" ! '
+        "h265parse"
+    )
+    assert apply_speed_tier(pipeline, SPEED_TIER_FAST) == (
+        "d.video_0 ! x265enc bitrate=768 speed-preset=veryfast "
+        'option-string="keyint=60:rc-lookahead=10" ! h265parse'
+    )
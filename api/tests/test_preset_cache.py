@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import uuid
+from types import SimpleNamespace
+
+from distributed_transcoder_api import preset_cache
+from distributed_transcoder_api.preset_cache import PresetCache
+
+
+def test_reload_racing_an_invalidation_is_discarded(monkeypatch):
+    preset_id = str(uuid.uuid4())
+    cache = PresetCache(60, "instance-1", logging.getLogger(__name__))
+    snapshots = [
+        [SimpleNamespace(preset_id=preset_id, pipeline="old")],
+        [SimpleNamespace(preset_id=preset_id, pipeline="new")],
+    ]
+
+    class Preset:
+        @staticmethod
+        async def all():
+            presets = snapshots.pop(0)
+            if presets[0].pipeline == "old":
+                # The preset is updated while the query is in flight
+                cache.invalidate()
+            return presets
+
+    monkeypatch.setattr(preset_cache, "Preset", Preset)
+    preset = asyncio.run(cache.get(preset_id))
+    assert preset.pipeline == "new"
+    assert cache.is_fresh()
+
+
+def test_invalidation_forces_a_reload(monkeypatch):
+    cache = PresetCache(60, "instance-1", logging.getLogger(__name__))
+    loads = []
+
+    class Preset:
+        @staticmethod
+        async def all():
+            loads.append(None)
+            return []
+
+    monkeypatch.setattr(preset_cache, "Preset", Preset)
+    asyncio.run(cache.load())
+    asyncio.run(cache.load())
+    cache.invalidate()
+    asyncio.run(cache.load())
+    assert len(loads) == 2
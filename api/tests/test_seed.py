@@ -0,0 +1,61 @@
+import logging
+
+from distributed_transcoder_api.pipelines import compile_pipeline, preset_fields
+from distributed_transcoder_api.seed import SEEDED_PIPELINES, seed_presets
+from distributed_transcoder_common.models import Preset
+
+LOGGER = logging.getLogger(__name__)
+SEEDED_NAME = "Scale to 720p x264 (1 mbit) mp4->mp4"
+FIELDS = {
+    "input_type": "mp4",
+    "output_type": "mp4",
+    "video_encoding": "h264",
+    "resolution": "1280x720",
+    "video_bitrate": "1024",
+    "audio_encoding": "aac",
+    "audio_bitrate": "128",
+}
+
+
+def test_seeds_compiled_presets(run_with_db):
+    async def test():
+        await seed_presets(LOGGER)
+        presets = await Preset.all()
+        assert len(presets) == len(SEEDED_PIPELINES)
+        for preset in presets:
+            assert preset.compiled
+            assert preset.pipeline == compile_pipeline(**preset_fields(preset))
+
+    run_with_db(test)
+
+
+def test_recompiles_pipelines_left_as_seeded(run_with_db):
+    async def test():
+        await Preset.create(
+            name=SEEDED_NAME, pipeline=SEEDED_PIPELINES[SEEDED_NAME], **FIELDS
+        )
+        await seed_presets(LOGGER)
+        preset = await Preset.get(name=SEEDED_NAME)
+        assert preset.compiled
+        assert preset.pipeline == compile_pipeline(**FIELDS)
+        assert "x264enc bitrate=1024" in preset.pipeline
+
+    run_with_db(test)
+
+
+def test_keeps_tuned_pipelines(run_with_db):
+    async def test():
+        tuned = SEEDED_PIPELINES[SEEDED_NAME].replace(
+            "x264enc bitrate=1536", "x264enc bitrate=1536 key-int-max=60"
+        )
+        await Preset.create(name=SEEDED_NAME, pipeline=tuned, **FIELDS)
+        await seed_presets(LOGGER)
+        preset = await Preset.get(name=SEEDED_NAME)
+        assert preset.compiled is False
+        assert preset.pipeline == tuned
+
+        # and leaves it alone from then on
+        await seed_presets(LOGGER)
+        assert (await Preset.get(name=SEEDED_NAME)).pipeline == tuned
+
+    run_with_db(test)
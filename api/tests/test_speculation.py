@@ -0,0 +1,78 @@
+import asyncio
+import logging
+
+import pytest
+from distributed_transcoder_api import speculation
+from distributed_transcoder_api.speculation import StragglerDetector
+from distributed_transcoder_api.throughput import PresetThroughput
+from distributed_transcoder_common import JobControlMessage, JobProgressMessage
+from distributed_transcoder_common.models import Job
+
+
+@pytest.fixture
+def cancels(monkeypatch):
+    sent = []
+
+    async def publish_control(channel, msg: JobControlMessage):
+        sent.append(msg)
+
+    monkeypatch.setattr(speculation, "publish_control", publish_control)
+    return sent
+
+
+def racing_detector() -> StragglerDetector:
+    "A detector which has backed up job-1, originally running on worker-1."
+    detector = StragglerDetector(
+        None, None, PresetThroughput(), logging.getLogger(__name__), 0.5, 0.0
+    )
+    detector.record_progress(
+        JobProgressMessage(100.0, "worker-1", "job-1", 10.0), "preset-1", 60.0
+    )
+    detector.speculated["job-1"] = "worker-1"
+    detector.backed_up.add("job-1")
+    return detector
+
+
+def test_winner_cancels_the_other_copy(cancels):
+    detector = racing_detector()
+    asyncio.run(
+        detector.record_result("job-1", Job.STATE_COMPLETED, "worker-2", final=True)
+    )
+    assert [msg.except_worker_id for msg in cancels] == ["worker-2"]
+    assert "job-1" not in detector.speculated
+    assert "job-1" not in detector.attempts
+
+
+def test_failed_original_cancels_the_backup(cancels):
+    detector = racing_detector()
+    asyncio.run(
+        detector.record_result("job-1", Job.STATE_FAILED, "worker-1", final=True)
+    )
+    assert [msg.except_worker_id for msg in cancels] == ["worker-1"]
+    assert "job-1" not in detector.speculated
+    assert "job-1" not in detector.attempts
+
+
+def test_superseded_original_leaves_the_backup_running(cancels):
+    detector = racing_detector()
+    asyncio.run(
+        detector.record_result("job-1", Job.STATE_FAILED, "worker-1", final=False)
+    )
+    assert cancels == []
+    assert "job-1" not in detector.speculated
+    # The backup's progress is tracked from here on, but it isn't backed up again
+    detector.record_progress(
+        JobProgressMessage(130.0, "worker-2", "job-1", 40.0), "preset-1", 60.0
+    )
+    assert detector.attempts["job-1"].worker_id == "worker-2"
+    assert "job-1" in detector.backed_up
+
+
+def test_failed_backup_leaves_the_original_running(cancels):
+    detector = racing_detector()
+    asyncio.run(
+        detector.record_result("job-1", Job.STATE_FAILED, "worker-2", final=False)
+    )
+    assert cancels == []
+    assert "job-1" not in detector.speculated
+    assert detector.attempts["job-1"].worker_id == "worker-1"
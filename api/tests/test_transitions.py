@@ -0,0 +1,230 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+from distributed_transcoder_api.transitions import (
+    FENCED,
+    MessageBatcher,
+    first_per_job,
+    record_heartbeats,
+    record_results,
+    release_jobs,
+    transition_reply,
+)
+from distributed_transcoder_common import JobResultMessage, JobTransitionMessage
+from distributed_transcoder_common.models import Job
+
+
+def running_job(**fields) -> Job:
+    return Job(
+        **{
+            "job_id": "job-1",
+            "input_s3_path": "in.mp4",
+            "output_s3_path": "out.mp4",
+            "pipeline": "",
+            "state": Job.STATE_IN_PROGRESS,
+            "worker_id": "worker-1",
+            "attempts": 1,
+            "claim_token": 7,
+            **fields,
+        }
+    )
+
+
+class FencedDb:
+    """
+    Stands in for Postgres in the fenced updates, matching each unnested report
+    against the claim token its job currently holds.
+    """
+
+    def __init__(self, claim_tokens):
+        self.claim_tokens = claim_tokens
+        self.reports = []
+
+    async def execute_query_dict(self, query, params):
+        assert FENCED in query
+        job_ids, claim_tokens = params[0], params[4]
+        self.reports.extend(zip(job_ids, claim_tokens))
+        return [
+            {"job_id": job_id}
+            for job_id, claim_token in zip(job_ids, claim_tokens)
+            if claim_token is not None and self.claim_tokens.get(job_id) == claim_token
+        ]
+
+
+@pytest.fixture
+def fenced_db(monkeypatch):
+    db = FencedDb({"job-1": 7, "job-2": 3, "job-3": 5})
+    monkeypatch.setattr(type(Job._meta), "db", property(lambda meta: db))
+    return db
+
+
+def claim(worker_id="worker-1", attempt=1, **fields) -> JobTransitionMessage:
+    return JobTransitionMessage(
+        action=JobTransitionMessage.ACTION_CLAIM,
+        job_id="job-1",
+        worker_id=worker_id,
+        attempt=attempt,
+        **fields,
+    )
+
+
+def test_resent_claim_is_granted_again():
+    # The claim was applied, but the worker lost the reply and asked again
+    job = running_job(checkpoint={"segments": []})
+    reply = transition_reply(claim(), job, set(), set(), {})
+    assert reply.applied
+    assert reply.claim_token == 7
+    assert reply.checkpoint == {"segments": []}
+
+
+def test_claim_held_by_another_worker_is_refused():
+    reply = transition_reply(
+        claim(worker_id="worker-2"), running_job(), set(), set(), {}
+    )
+    assert not reply.applied
+    assert reply.claim_token is None
+    assert reply.state == Job.STATE_IN_PROGRESS
+
+
+def test_claim_of_an_earlier_attempt_is_refused():
+    job = running_job(attempts=2)
+    assert not transition_reply(claim(attempt=1), job, set(), set(), {}).applied
+
+
+def test_heartbeats_refresh_running_jobs_only(run_with_db):
+    async def test():
+        stale = datetime.now() - timedelta(minutes=5)
+        await running_job().save()
+        await running_job(job_id="job-2", state=Job.STATE_COMPLETED).save()
+        await Job.all().update(updated_at=stale)
+        await record_heartbeats({"job-1", "job-2"})
+        running = await Job.get(job_id="job-1")
+        completed = await Job.get(job_id="job-2")
+        assert running.updated_at.replace(tzinfo=None) > stale
+        assert completed.updated_at.replace(tzinfo=None) == stale
+
+    run_with_db(test)
+
+
+def release(job_id="job-1", **fields) -> JobTransitionMessage:
+    return JobTransitionMessage(
+        action=JobTransitionMessage.ACTION_RELEASE,
+        job_id=job_id,
+        worker_id="worker-1",
+        state=Job.STATE_QUEUED,
+        **fields,
+    )
+
+
+def test_first_per_job_keeps_the_first_message_of_each_job():
+    messages = [release("job-1"), release("job-2"), release("job-1", error="late")]
+    firsts = first_per_job(messages)
+    assert list(firsts) == ["job-1", "job-2"]
+    assert firsts["job-1"] is messages[0]
+
+
+def test_speculative_claim_races_the_running_attempt():
+    reply = transition_reply(
+        claim(worker_id="worker-2", speculative=True),
+        running_job(checkpoint={"segments": []}),
+        set(),
+        set(),
+        {},
+    )
+    assert reply.applied
+    assert reply.claim_token == 7
+    # Backup copies start from scratch rather than from the original's checkpoint
+    assert reply.checkpoint is None
+
+
+def test_claim_of_an_unknown_job_is_refused():
+    reply = transition_reply(claim(), None, set(), set(), {})
+    assert not reply.applied
+    assert reply.state is None
+
+
+def test_release_and_checkpoint_replies_follow_what_was_applied():
+    job = running_job(state=Job.STATE_QUEUED)
+    checkpoint = JobTransitionMessage(
+        action=JobTransitionMessage.ACTION_CHECKPOINT,
+        job_id="job-1",
+        worker_id="worker-1",
+    )
+    assert transition_reply(release(), job, {"job-1"}, set(), {}).applied
+    assert not transition_reply(release(), job, set(), set(), {}).applied
+    assert transition_reply(checkpoint, job, set(), {"job-1"}, {}).applied
+    assert not transition_reply(checkpoint, job, set(), set(), {}).applied
+
+
+def test_speculative_copies_cant_release_or_checkpoint():
+    job = running_job()
+    reply = transition_reply(release(speculative=True), job, {"job-1"}, set(), {})
+    assert not reply.applied
+
+
+def test_results_of_superseded_claims_are_refused(fenced_db):
+    results = [
+        JobResultMessage("job-1", Job.STATE_COMPLETED, claim_token=7),
+        JobResultMessage("job-2", Job.STATE_COMPLETED, claim_token=2),
+        JobResultMessage("job-3", Job.STATE_FAILED),
+        # Only the first result for a job is recorded
+        JobResultMessage("job-1", Job.STATE_FAILED, claim_token=7),
+    ]
+    assert asyncio.run(record_results(results)) == {"job-1"}
+    assert fenced_db.reports == [("job-1", 7), ("job-2", 2), ("job-3", None)]
+
+
+def test_releases_of_superseded_claims_are_refused(fenced_db):
+    releases = [release("job-1", claim_token=6), release("job-2", claim_token=3)]
+    assert asyncio.run(release_jobs(releases)) == {"job-2"}
+
+
+class FakeMessage:
+    def __init__(self):
+        self.acked = False
+        self.nacked = False
+
+    async def ack(self):
+        self.acked = True
+
+    async def nack(self, requeue=False):
+        self.nacked = requeue
+
+
+def run_batcher(messages, handler, max_batch_size):
+    async def main():
+        batcher = MessageBatcher(
+            handler, logging.getLogger(__name__), max_batch_size=max_batch_size
+        )
+        for message in messages:
+            await batcher(message)
+        batcher.start()
+        while not all(message.acked or message.nacked for message in messages):
+            await asyncio.sleep(0.01)
+        batcher.task.cancel()
+
+    asyncio.run(main())
+
+
+def test_batches_are_split_at_their_maximum_size():
+    messages = [FakeMessage() for _ in range(5)]
+    batches = []
+
+    async def handler(batch):
+        batches.append(batch)
+
+    run_batcher(messages, handler, max_batch_size=2)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert all(message.acked for message in messages)
+
+
+def test_failed_batches_are_requeued():
+    messages = [FakeMessage() for _ in range(3)]
+
+    async def handler(batch):
+        raise RuntimeError("database unavailable")
+
+    run_batcher(messages, handler, max_batch_size=2)
+    assert all(message.nacked and not message.acked for message in messages)
@@ -0,0 +1,44 @@
+import hashlib
+import hmac
+
+import pytest
+from distributed_transcoder_api.webhooks import check_callback_url, sign
+
+
+def test_sign():
+    expected = hmac.new(b"secret", b"1700000000.{}", hashlib.sha256).hexdigest()
+    assert sign("secret", "1700000000", b"{}") == f"sha256={expected}"
+
+
+@pytest.mark.parametrize(
+    "url",
+    ["https://hooks.example.com/transcoder", "http://93.184.216.34:8080/hook"],
+)
+def test_public_callback_urls(url):
+    check_callback_url(url)
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "ftp://hooks.example.com/",
+        "http:///hook",
+        "http://localhost:8000/hook",
+        "http://api.localhost/hook",
+        "http://127.0.0.1/hook",
+        "http://10.1.2.3/hook",
+        "http://192.168.0.10/hook",
+        "http://169.254.169.254/latest/meta-data/",
+        "http://[::1]/hook",
+        "http://[fe80::1]/hook",
+        "http://[::ffff:10.0.0.1]/hook",
+    ],
+)
+def test_private_callback_urls(url):
+    with pytest.raises(ValueError):
+        check_callback_url(url)
+
+
+def test_allowed_hosts_may_be_private():
+    check_callback_url("http://receiver:8000/hook", {"receiver"})
+    check_callback_url("http://10.1.2.3/hook", {"10.1.2.3"})
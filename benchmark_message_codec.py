@@ -0,0 +1,105 @@
+"""
+Micro-benchmark of the queue message codecs: the cost of encoding and decoding each
+message type and the size of its body, with the totals they add up to at a given
+number of concurrently running jobs.
+
+    $ python benchmark_message_codec.py --jobs 500
+"""
+import argparse
+import time
+import timeit
+
+from distributed_transcoder_common import (
+    CONTENT_TYPES,
+    JobProgressMessage,
+    JobResultMessage,
+    JobSubmissionMessage,
+    decode_message,
+    encode_message,
+)
+
+# Workers report progress every 10 seconds (progressreport update-freq=10)
+PROGRESS_INTERVAL_SECONDS = 10
+
+MESSAGES = {
+    "progress": JobProgressMessage(
+        timestamp=time.time(),
+        worker_id="worker-k3b9x2",
+        job_id="V1StGXR8_Z5jdHi6B-myT",
+        progress=42.1875,
+        eta_seconds=87.3,
+    ),
+    "result": JobResultMessage(
+        job_id="V1StGXR8_Z5jdHi6B-myT",
+        status="completed",
+        timestamp=time.time(),
+        worker_id="worker-k3b9x2",
+        output_s3_path="outputs/V1StGXR8_Z5jdHi6B-myT/720p.mp4",
+    ),
+    "submission": JobSubmissionMessage(
+        job_id="V1StGXR8_Z5jdHi6B-myT",
+        input_s3_path="inputs/V1StGXR8_Z5jdHi6B-myT/source.mp4",
+        output_s3_path="outputs/V1StGXR8_Z5jdHi6B-myT/720p.mp4",
+        transcode_options="filesrc location={{input_file}} ! qtdemux name=d "
+        "mp4mux name=mux ! filesink location={{output_file}} "
+        "d.audio_0 ! queue ! decodebin ! audioconvert ! avenc_aac bitrate=128000 ! mux.audio_0 "
+        "d.video_0 ! queue ! decodebin ! videoscale ! video/x-raw,width=1280,height=720 "
+        "! x264enc bitrate=1536 speed-preset=medium ! {{progress}} ! h264parse ! mux.video_0",
+        target={
+            "output_type": "mp4",
+            "resolution": "1280x720",
+            "video_encoding": "h264",
+            "video_bitrate": "1536",
+            "audio_encoding": "aac",
+            "audio_bitrate": "128",
+        },
+    ),
+}
+
+
+def best_of(stmt, number: int, repeat: int) -> float:
+    "The fastest run's time per call, in microseconds."
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--jobs", type=int, default=500, help="Number of jobs running at once"
+    )
+    parser.add_argument("--number", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'message':<12}{'codec':<24}{'bytes':>8}{'encode µs':>12}{'decode µs':>12}")
+    progress_costs = {}
+    for name, msg in MESSAGES.items():
+        message_type = type(msg)
+        for content_type in CONTENT_TYPES:
+            body = encode_message(msg, content_type)
+            assert decode_message(message_type, body, content_type) == msg
+            encode_us = best_of(
+                lambda: encode_message(msg, content_type), args.number, args.repeat
+            )
+            decode_us = best_of(
+                lambda: decode_message(message_type, body, content_type),
+                args.number,
+                args.repeat,
+            )
+            print(
+                f"{name:<12}{content_type:<24}{len(body):>8}{encode_us:>12.2f}{decode_us:>12.2f}"
+            )
+            if name == "progress":
+                progress_costs[content_type] = (len(body), encode_us + decode_us)
+
+    rate = args.jobs / PROGRESS_INTERVAL_SECONDS
+    print(f"\nProgress traffic with {args.jobs} running jobs ({rate:.0f} messages/s):")
+    for content_type, (size, cost_us) in progress_costs.items():
+        print(
+            f"  {content_type:<24}{size * rate / 1000:>8.1f} kB/s"
+            f"{cost_us * rate / 10_000:>8.3f}% of a core encoding and decoding"
+        )
+
+
+if __name__ == "__main__":
+    main()
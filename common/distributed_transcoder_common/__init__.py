@@ -1 +1,33 @@
-from .message_types import JobProgressMessage, JobResultMessage, JobSubmissionMessage
+from .message_types import (
+    CONTENT_TYPE_JSON,
+    CONTENT_TYPE_MSGPACK,
+    CONTENT_TYPES,
+    JobControlMessage,
+    JobProgressMessage,
+    JobResultMessage,
+    JobSubmissionMessage,
+    JobTransitionMessage,
+    JobTransitionReplyMessage,
+    MediaInfoMessage,
+    MessageDecodeError,
+    decode_message,
+    encode_message,
+)
+from .storage import (
+    LocalStorage,
+    ObjectInfo,
+    ObjectNotFound,
+    S3Storage,
+    Storage,
+    StorageError,
+    storage_from_env,
+)
+from .tracing import (
+    current_traceparent,
+    init_tracing,
+    published_at,
+    record_span,
+    shutdown_tracing,
+    span,
+    trace_headers,
+)
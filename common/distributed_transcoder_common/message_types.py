@@ -1,17 +1,55 @@
-from dataclasses import dataclass
-from typing import Optional
+import json
+from dataclasses import asdict, dataclass, fields
+from typing import ClassVar, Dict, Optional, Type, TypeVar
+
+import msgpack
+
+# Content types messages are published with. JSON bodies are objects keyed by field
+# name, msgpack bodies are arrays of the schema version followed by each field's value
+# in declaration order.
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/x-msgpack"
+CONTENT_TYPES = (CONTENT_TYPE_JSON, CONTENT_TYPE_MSGPACK)
+
+# Fields may only be appended, with a default, without bumping a message's
+# SCHEMA_VERSION. Decoders ignore trailing fields from newer senders and fill in the
+# defaults of fields older senders don't know about, so either side can deploy first.
+# Renaming, reordering or removing a field bumps the version, and decoders reject
+# versions they don't know rather than misreading them.
+
+T = TypeVar("T")
+
+
+class MessageDecodeError(ValueError):
+    "Raised when a message body can't be decoded."
 
 
 @dataclass
 class JobSubmissionMessage:
+    SCHEMA_VERSION: ClassVar[int] = 1
+
     job_id: str
     input_s3_path: str
     output_s3_path: str
     transcode_options: str
+    # Set to "hls" to write segments and a media playlist under output_s3_path's prefix
+    packaging: Optional[str] = None
+    # Set on backup copies of a job that was running slower than its preset usually does
+    speculative: bool = False
+    # Number of earlier attempts that failed with a transient error
+    attempt: int = 0
+    # Output format of the job's preset (output_type, resolution, codecs and bitrates),
+    # which lets the worker remux sources that already match it instead of transcoding
+    target: Optional[Dict[str, str]] = None
+    # Seconds between thumbnails taken from the decoded video, along with sprite sheets
+    # and a WebVTT index, or None for no thumbnails
+    thumbnail_interval: Optional[int] = None
 
 
 @dataclass
 class JobResultMessage:
+    SCHEMA_VERSION: ClassVar[int] = 1
+
     job_id: str
     status: str
     timestamp: Optional[float] = None
@@ -19,11 +57,150 @@ class JobResultMessage:
     output_s3_path: Optional[str] = None
     error: Optional[str] = None
     error_type: Optional[str] = None
+    speculative: bool = False
+    # Fencing token of the claim the attempt ran under, results of attempts whose claim
+    # was superseded are dropped
+    claim_token: Optional[int] = None
 
 
 @dataclass
 class JobProgressMessage:
+    SCHEMA_VERSION: ClassVar[int] = 1
+
     timestamp: float
     worker_id: str
     job_id: str
     progress: float
+    # Seconds left at the current pace, once the source's duration is known
+    eta_seconds: Optional[float] = None
+
+
+@dataclass
+class JobControlMessage:
+    SCHEMA_VERSION: ClassVar[int] = 1
+    ACTION_CANCEL: ClassVar[str] = "cancel"
+
+    action: str
+    job_id: str
+    # Lets the worker which won a speculative race keep running
+    except_worker_id: Optional[str] = None
+    reason: Optional[str] = None
+    timestamp: Optional[float] = None
+
+
+@dataclass
+class JobTransitionMessage:
+    """
+    A worker's request for the API to move a job between states, answered with a
+    JobTransitionReplyMessage once the API has applied it. Workers hold no database
+    connections of their own.
+    """
+
+    SCHEMA_VERSION: ClassVar[int] = 1
+    # Start an attempt at a queued or retrying job
+    ACTION_CLAIM: ClassVar[str] = "claim"
+    # Hand a claimed job back to be picked up again, in state
+    ACTION_RELEASE: ClassVar[str] = "release"
+    # Record the manifest of a job's checkpointed segments
+    ACTION_CHECKPOINT: ClassVar[str] = "checkpoint"
+
+    action: str
+    job_id: str
+    worker_id: str
+    # The attempt being claimed
+    attempt: int = 0
+    # Set when claiming a backup copy of a job that is already running, and on the
+    # copy's other requests, which are refused as the job isn't the copy's to release
+    # or checkpoint
+    speculative: bool = False
+    # The state a released job goes back to, along with why it was released
+    state: Optional[str] = None
+    error: Optional[str] = None
+    error_type: Optional[str] = None
+    # The manifest to record, None clears it
+    checkpoint: Optional[Dict] = None
+    # Fencing token of the claim releases and checkpoints are made under, they are
+    # refused once another claim has superseded it
+    claim_token: Optional[int] = None
+
+
+@dataclass
+class JobTransitionReplyMessage:
+    SCHEMA_VERSION: ClassVar[int] = 1
+
+    job_id: str
+    # Whether the transition was applied, claims of a job that was cancelled or claimed
+    # by another worker meanwhile are refused
+    applied: bool
+    # The job's state once the request was handled, None if there is no such job
+    state: Optional[str] = None
+    # For granted claims, the job's checkpoint manifest and the probed properties of
+    # its source if it has been probed, so that the worker needn't look them up
+    checkpoint: Optional[Dict] = None
+    media: Optional[Dict] = None
+    # For granted claims, the fencing token to send along with everything reported
+    # about the attempt. Every claim of a job gets a higher token than the last.
+    claim_token: Optional[int] = None
+
+
+@dataclass
+class MediaInfoMessage:
+    "The probed properties of a source, published by the worker that probed it."
+
+    SCHEMA_VERSION: ClassVar[int] = 1
+
+    s3_path: str
+    # The fields of a MediaInfo row, apart from its S3 path
+    media: Dict
+
+
+def encode_message(msg, content_type: str = CONTENT_TYPE_JSON) -> bytes:
+    """
+    Serialize a message for publishing.
+
+    :param msg: The message.
+    :param content_type: The content type to encode it as, which must also be set on
+        the published message.
+    :return: The message body.
+    """
+    if content_type == CONTENT_TYPE_MSGPACK:
+        values = [getattr(msg, field.name) for field in fields(msg)]
+        return msgpack.packb([msg.SCHEMA_VERSION, *values], use_bin_type=True)
+    if content_type == CONTENT_TYPE_JSON:
+        return json.dumps(asdict(msg)).encode()
+    raise ValueError(f"Unsupported content type: {content_type}")
+
+
+def decode_message(
+    message_type: Type[T], body: bytes, content_type: Optional[str] = None
+) -> T:
+    """
+    Deserialize a message body in either encoding.
+
+    :param message_type: The message class the body holds.
+    :param body: The message body.
+    :param content_type: The content type it was published with. Messages published
+        without one are JSON.
+    :return: The message.
+    :raises MessageDecodeError: If the body is malformed or has an unknown schema
+        version.
+    """
+    names = [field.name for field in fields(message_type)]
+    try:
+        if content_type == CONTENT_TYPE_MSGPACK:
+            version, *values = msgpack.unpackb(body, raw=False)
+            if version != message_type.SCHEMA_VERSION:
+                raise MessageDecodeError(
+                    f"Unknown {message_type.__name__} schema version {version}"
+                )
+            return message_type(*values[: len(names)])
+        if content_type in (None, CONTENT_TYPE_JSON):
+            data = json.loads(body)
+            return message_type(**{name: data[name] for name in names if name in data})
+    except MessageDecodeError:
+        raise
+    except (ValueError, TypeError) as e:
+        raise MessageDecodeError(
+            f"Malformed {message_type.__name__} message: {e}"
+        ) from e
+    raise MessageDecodeError(f"Unsupported content type: {content_type}")
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from tortoise import fields, Tortoise
 from tortoise.models import Model
 from tortoise.contrib.pydantic import pydantic_model_creator
@@ -14,6 +16,11 @@ class Preset(Model):
     audio_encoding = fields.CharField(max_length=30)
     audio_bitrate = fields.CharField(max_length=30)
     pipeline = fields.TextField()
+    # Whether the pipeline is compiled from the fields above, and so follows them when
+    # they change. None for presets created before this was recorded.
+    compiled = fields.BooleanField(null=True)
+    # Seconds between thumbnails for jobs using the preset, None for no thumbnails
+    thumbnail_interval = fields.IntField(null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now=True)
 
@@ -31,6 +38,10 @@ class Job(Model):
     STATE_FAILED = "failed"
     STATE_CANCELLED = "cancelled"
     STATE_STALLED = "stalled"
+    # Waiting out a backoff before another attempt after a transient error
+    STATE_RETRYING = "retrying"
+    # Waiting for the jobs it depends on to complete before it is dispatched
+    STATE_WAITING = "waiting"
 
     id = fields.UUIDField(pk=True)
     job_id = fields.CharField(max_length=50, unique=True)
@@ -47,14 +58,104 @@ class Job(Model):
     updated_at = fields.DatetimeField(auto_now=True)
     transcode_started_at = fields.DatetimeField(null=True)
     transcode_completed_at = fields.DatetimeField(null=True)
+    # Hash of the input object and normalized pipeline, used to reuse identical outputs
+    dedup_key = fields.CharField(max_length=64, null=True, index=True)
+    # job_id of the in-flight job whose output this job is waiting to reuse
+    dedup_of = fields.CharField(max_length=50, null=True, index=True)
+    # Segmented output format, when the job writes a playlist instead of a single file
+    packaging = fields.CharField(max_length=20, null=True)
+    # Number of the attempt currently or last running, starting at 0
+    attempts = fields.IntField(default=0)
+    # Worker which last claimed the job, and the fencing token of that claim, which
+    # goes up with every claim and every requeue by the API so that reports from
+    # superseded attempts are refused
+    worker_id = fields.CharField(max_length=50, null=True)
+    claim_token = fields.IntField(default=0)
+    # Manifest of the segments completed so far, which a retried attempt resumes after
+    checkpoint = fields.JSONField(null=True)
+    # Seconds between thumbnails written next to the output, None for no thumbnails
+    thumbnail_interval = fields.IntField(null=True)
+    # URL notified when the job finishes
+    callback_url = fields.CharField(max_length=2048, null=True)
+    # Trade-off between encoding speed and compression efficiency the job was
+    # submitted with, None for its pipeline's own
+    speed_tier = fields.CharField(max_length=20, null=True)
+    # W3C traceparent of the submission, which every attempt at the job continues
+    trace_parent = fields.CharField(max_length=100, null=True)
+    # Jobs that must complete before this one is dispatched, usually because their
+    # outputs are its input
+    dependencies: fields.ManyToManyRelation["Job"] = fields.ManyToManyField(
+        "models.Job",
+        related_name="dependents",
+        through="job_dependency",
+        forward_key="dependency_id",
+        backward_key="job_id",
+    )
 
     class Meta:
         ordering = ["-created_at"]
+        # Composite indexes backing keyset pagination and filtering on GET /jobs
+        # as well as the stalled job scan, which filters on (state, updated_at)
+        indexes = (
+            ("created_at", "id"),
+            ("state", "created_at", "id"),
+            ("preset_id", "created_at", "id"),
+            ("error_type", "created_at", "id"),
+            ("state", "updated_at"),
+        )
+
+    class PydanticMeta:
+        exclude = ("dependencies", "dependents")
+
+
+class MediaInfo(Model):
+    """
+    Probed properties of a source file, cached per S3 object.
+    """
+
+    id = fields.UUIDField(pk=True)
+    s3_path = fields.CharField(max_length=255, unique=True)
+    # Size of the probed object, a different size means the object was replaced
+    size = fields.BigIntField()
+    duration_ns = fields.BigIntField(null=True)
+    container = fields.CharField(max_length=30, null=True)
+    video_codec = fields.CharField(max_length=30, null=True)
+    width = fields.IntField(null=True)
+    height = fields.IntField(null=True)
+    frame_rate = fields.FloatField(null=True)
+    # Bitrates in kbit/s, matching the preset fields
+    video_bitrate = fields.IntField(null=True)
+    audio_codec = fields.CharField(max_length=30, null=True)
+    audio_bitrate = fields.IntField(null=True)
+    probed_at = fields.DatetimeField(auto_now=True)
+
+    @property
+    def resolution(self) -> Optional[str]:
+        if self.width is None or self.height is None:
+            return None
+        return f"{self.width}x{self.height}"
+
+    @property
+    def bitrate(self) -> Optional[int]:
+        """
+        Overall bitrate in kbit/s, derived from the size as containers don't always
+        report per-stream bitrates.
+        """
+        if not self.duration_ns:
+            return None
+        return int(self.size * 8 / (self.duration_ns / 1_000_000_000) / 1000)
 
 
 class Playlist(Model):
+    PACKAGING_HLS = "hls"
+
     id = fields.UUIDField(pk=True)
     name = fields.CharField(max_length=250, unique=True)
+    packaging = fields.CharField(max_length=20, null=True)
+    # Master playlist listing every rendition, for packaged playlists
+    manifest_s3_path = fields.CharField(max_length=255, null=True)
+    # URL notified as each of the playlist's jobs finishes
+    callback_url = fields.CharField(max_length=2048, null=True)
     jobs: fields.ManyToManyRelation[Job] = fields.ManyToManyField(
         "models.Job", related_name="playlists"
     )
@@ -69,3 +170,4 @@ Tortoise.init_models(["distributed_transcoder_common.models"], "models")
 PresetOut = pydantic_model_creator(Preset, name="PresetOut")
 JobOut = pydantic_model_creator(Job, name="JobOut")
 PlaylistOut = pydantic_model_creator(Playlist, name="PlaylistOut")
+MediaInfoOut = pydantic_model_creator(MediaInfo, name="MediaInfoOut")
@@ -0,0 +1,315 @@
+import os
+from abc import ABC, abstractmethod
+import tempfile
+from dataclasses import dataclass
+from typing import Callable, List, Mapping, Optional
+
+try:
+    import boto3
+    from boto3.exceptions import S3UploadFailedError
+    from botocore.exceptions import ClientError
+except ImportError:  # Only the S3 backend needs boto3
+    boto3 = None
+
+STORAGE_BACKEND_S3 = "s3"
+STORAGE_BACKEND_LOCAL = "local"
+
+# Mode of files written by the local backend, which other hosts read over the share
+FILE_MODE = 0o644
+
+# Called with the number of bytes moved since the last call, like boto3's Callback
+ProgressCallback = Callable[[int], None]
+
+
+class StorageError(Exception):
+    "Raised when a storage operation fails."
+
+
+class ObjectNotFound(StorageError):
+    "Raised when an object doesn't exist."
+
+
+@dataclass
+class ObjectInfo:
+    size: int
+    # Changes whenever the object's content does
+    etag: str
+
+
+class Storage(ABC):
+    """
+    Where inputs and outputs live, addressed by key. Keys are the *_s3_path values
+    stored on jobs and playlists, whichever backend holds them.
+    """
+
+    @abstractmethod
+    def head(self, key: str) -> ObjectInfo:
+        ...
+
+    @abstractmethod
+    def download(
+        self, key: str, path: str, callback: Optional[ProgressCallback] = None
+    ):
+        ...
+
+    @abstractmethod
+    def upload(
+        self,
+        path: str,
+        key: str,
+        content_type: Optional[str] = None,
+        callback: Optional[ProgressCallback] = None,
+    ):
+        ...
+
+    @abstractmethod
+    def get_bytes(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def put_bytes(
+        self,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+    ):
+        ...
+
+    @abstractmethod
+    def copy(self, source_key: str, key: str):
+        ...
+
+    @abstractmethod
+    def delete(self, keys: List[str]):
+        ...
+
+    def presigned_url(self, key: str, expires_in: int) -> Optional[str]:
+        """
+        :return: A URL the object can be fetched from directly, or None if the backend
+            has no such thing.
+        """
+        return None
+
+    def local_path(self, key: str) -> Optional[str]:
+        """
+        :return: A path the object can be read and written at in place, or None if it
+            has to be downloaded and uploaded.
+        """
+        return None
+
+
+class S3Storage(Storage):
+    def __init__(self, client, bucket: str):
+        self.client = client
+        self.bucket = bucket
+
+    def _call(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise ObjectNotFound(str(e)) from e
+            raise StorageError(str(e)) from e
+        except S3UploadFailedError as e:
+            raise StorageError(str(e)) from e
+
+    def head(self, key: str) -> ObjectInfo:
+        head = self._call(self.client.head_object, Bucket=self.bucket, Key=key)
+        return ObjectInfo(size=head["ContentLength"], etag=head["ETag"])
+
+    def download(
+        self, key: str, path: str, callback: Optional[ProgressCallback] = None
+    ):
+        self._call(self.client.download_file, self.bucket, key, path, Callback=callback)
+
+    def upload(
+        self,
+        path: str,
+        key: str,
+        content_type: Optional[str] = None,
+        callback: Optional[ProgressCallback] = None,
+    ):
+        extra_args = {"ContentType": content_type} if content_type else None
+        self._call(
+            self.client.upload_file,
+            path,
+            self.bucket,
+            key,
+            ExtraArgs=extra_args,
+            Callback=callback,
+        )
+
+    def get_bytes(self, key: str) -> bytes:
+        obj = self._call(self.client.get_object, Bucket=self.bucket, Key=key)
+        return obj["Body"].read()
+
+    def put_bytes(
+        self,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+    ):
+        kwargs = {}
+        if content_type:
+            kwargs["ContentType"] = content_type
+        if cache_control:
+            kwargs["CacheControl"] = cache_control
+        self._call(
+            self.client.put_object, Bucket=self.bucket, Key=key, Body=data, **kwargs
+        )
+
+    def copy(self, source_key: str, key: str):
+        self._call(
+            self.client.copy,
+            {"Bucket": self.bucket, "Key": source_key},
+            self.bucket,
+            key,
+        )
+
+    def delete(self, keys: List[str]):
+        self._call(
+            self.client.delete_objects,
+            Bucket=self.bucket,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+
+    def presigned_url(self, key: str, expires_in: int) -> Optional[str]:
+        return self._call(
+            self.client.generate_presigned_url,
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires_in,
+        )
+
+
+class LocalStorage(Storage):
+    """
+    Keeps objects as files under a root directory, such as a shared NFS volume mounted
+    on the API and every worker, or a scratch directory for running offline.
+    """
+
+    def __init__(self, root: str, chunk_size: int = 8 * 1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.chunk_size = chunk_size
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise StorageError(f"Key {key} is outside of the storage root")
+        return path
+
+    def _copy_file(
+        self, source: str, destination: str, callback: Optional[ProgressCallback]
+    ):
+        # Write next to the destination and swap it in, so readers never see half a file
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination))
+        try:
+            with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+                while True:
+                    chunk = src.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    if callback is not None:
+                        callback(len(chunk))
+            os.chmod(temp_path, FILE_MODE)
+            os.replace(temp_path, destination)
+        except FileNotFoundError as e:
+            os.unlink(temp_path)
+            raise ObjectNotFound(str(e)) from e
+        except OSError as e:
+            os.unlink(temp_path)
+            raise StorageError(str(e)) from e
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def head(self, key: str) -> ObjectInfo:
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError as e:
+            raise ObjectNotFound(str(e)) from e
+        return ObjectInfo(
+            size=stat.st_size, etag=f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        )
+
+    def download(
+        self, key: str, path: str, callback: Optional[ProgressCallback] = None
+    ):
+        self._copy_file(self._path(key), path, callback)
+
+    def upload(
+        self,
+        path: str,
+        key: str,
+        content_type: Optional[str] = None,
+        callback: Optional[ProgressCallback] = None,
+    ):
+        self._copy_file(path, self._path(key), callback)
+
+    def get_bytes(self, key: str) -> bytes:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError as e:
+            raise ObjectNotFound(str(e)) from e
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def put_bytes(
+        self,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+    ):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(temp_path, FILE_MODE)
+            os.replace(temp_path, path)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def copy(self, source_key: str, key: str):
+        self._copy_file(self._path(source_key), self._path(key), None)
+
+    def delete(self, keys: List[str]):
+        for key in keys:
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                raise StorageError(str(e)) from e
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+
+def storage_from_env(environ: Mapping[str, str] = os.environ) -> Storage:
+    """
+    Build the storage backend selected by STORAGE_BACKEND, "s3" (the default) or
+    "local". The S3 backend reads S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY,
+    S3_BUCKET_NAME and S3_ENDPOINT_URL, and the local backend reads STORAGE_LOCAL_ROOT.
+    """
+    backend = environ.get("STORAGE_BACKEND", STORAGE_BACKEND_S3)
+    if backend == STORAGE_BACKEND_LOCAL:
+        return LocalStorage(environ["STORAGE_LOCAL_ROOT"])
+    if backend != STORAGE_BACKEND_S3:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    if boto3 is None:
+        raise ImportError("The S3 storage backend requires boto3")
+    client = boto3.client(
+        service_name="s3",
+        aws_access_key_id=environ["S3_ACCESS_KEY_ID"],
+        aws_secret_access_key=environ["S3_SECRET_ACCESS_KEY"],
+        endpoint_url=environ["S3_ENDPOINT_URL"],
+    )
+    return S3Storage(client, environ["S3_BUCKET_NAME"])
@@ -0,0 +1,217 @@
+"""
+Traces each job from its submission through the queue and the worker to its result,
+continuing the trace across AMQP hops in W3C traceparent message headers.
+
+Tracing is off unless TRACING_EXPORTER is set, to "otlp" to export spans to the
+collector at OTEL_EXPORTER_OTLP_ENDPOINT, or to "file" to write them to TRACING_FILE
+as one JSON span per line. Without the tracing extra installed every span is a no-op.
+"""
+import contextlib
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.propagate import extract, inject
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        SpanExporter,
+        SpanExportResult,
+    )
+except ImportError:  # Only tracing needs opentelemetry
+    trace = None
+    SpanExporter = object
+
+TRACING_EXPORTER_OTLP = "otlp"
+TRACING_EXPORTER_FILE = "file"
+
+TRACER_NAME = "distributed_transcoder"
+TRACEPARENT_HEADER = "traceparent"
+# When a message was published, which its wait is timed from. In integer milliseconds
+# since the epoch, as some clients encode float headers in single precision.
+PUBLISHED_AT_HEADER = "x-published-at-ms"
+
+
+class JsonFileSpanExporter(SpanExporter):
+    """
+    Appends finished spans to a file as one JSON object per line, for tracing without
+    a collector.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans) -> "SpanExportResult":
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self.lock, open(self.path, "a") as f:
+                f.write(lines)
+        except OSError:
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def init_tracing(
+    service_name: str,
+    instance_id: Optional[str] = None,
+    environ: Mapping[str, str] = os.environ,
+) -> bool:
+    """
+    Set up span export for this process as configured by its environment.
+
+    :param service_name: The service the spans are reported under.
+    :param instance_id: Tells apart the processes of the service, such as worker ids.
+    :param environ: The environment to read the config from.
+    :return: Whether spans will be exported.
+    :raises ValueError: If TRACING_EXPORTER names an unknown exporter.
+    """
+    exporter_name = environ.get("TRACING_EXPORTER", "").lower()
+    if not exporter_name or exporter_name == "none":
+        return False
+    if trace is None:
+        raise ValueError(
+            "Tracing requires the tracing extra of distributed-transcoder-common"
+        )
+    if exporter_name == TRACING_EXPORTER_OTLP:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        # The endpoint and headers come from the standard OTEL_EXPORTER_OTLP_* variables
+        exporter = OTLPSpanExporter()
+    elif exporter_name == TRACING_EXPORTER_FILE:
+        exporter = JsonFileSpanExporter(environ.get("TRACING_FILE", "traces.jsonl"))
+    else:
+        raise ValueError(
+            f"Unknown TRACING_EXPORTER {exporter_name!r}, expected "
+            f"{TRACING_EXPORTER_OTLP} or {TRACING_EXPORTER_FILE}"
+        )
+
+    attributes = {"service.name": service_name}
+    if instance_id is not None:
+        attributes["service.instance.id"] = instance_id
+    provider = TracerProvider(resource=Resource.create(attributes))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return True
+
+
+def shutdown_tracing():
+    "Export the spans still buffered, before the process exits."
+    if trace is None:
+        return
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
+
+
+def _context(parent: Optional[Mapping[str, Any]]):
+    if parent is None:
+        # Continue the current span, if any
+        return None
+    # Header values arrive as bytes from some clients, and other headers aren't strings
+    carrier = {}
+    for key, value in parent.items():
+        if isinstance(value, bytes):
+            value = value.decode(errors="replace")
+        if isinstance(value, str):
+            carrier[key] = value
+    return extract(carrier)
+
+
+def _nanoseconds(timestamp: Optional[float]) -> Optional[int]:
+    return int(timestamp * 1e9) if timestamp is not None else None
+
+
+@contextlib.contextmanager
+def span(
+    name: str,
+    parent: Optional[Mapping[str, Any]] = None,
+    attributes: Optional[Mapping[str, Any]] = None,
+    start_time: Optional[float] = None,
+) -> Iterator[Any]:
+    """
+    Time a stage as a span, the current span within it.
+
+    :param name: The stage.
+    :param parent: Headers carrying the parent span, defaulting to the current span.
+    :param attributes: Attributes of the span, such as the job id.
+    :param start_time: When the stage began in seconds since the epoch, if before now.
+    :return: The span, or None while tracing isn't installed.
+    """
+    if trace is None:
+        yield None
+        return
+    with trace.get_tracer(TRACER_NAME).start_as_current_span(
+        name,
+        context=_context(parent),
+        attributes=attributes,
+        start_time=_nanoseconds(start_time),
+    ) as current:
+        yield current
+
+
+def record_span(
+    name: str,
+    start_time: float,
+    end_time: Optional[float] = None,
+    parent: Optional[Mapping[str, Any]] = None,
+    attributes: Optional[Mapping[str, Any]] = None,
+):
+    """
+    Record a stage which has already happened, such as a message's wait in its queue.
+
+    :param start_time: When the stage began in seconds since the epoch.
+    :param end_time: When it ended, defaulting to now.
+    """
+    if trace is None:
+        return
+    finished = trace.get_tracer(TRACER_NAME).start_span(
+        name,
+        context=_context(parent),
+        attributes=attributes,
+        start_time=_nanoseconds(start_time),
+    )
+    finished.end(end_time=_nanoseconds(end_time))
+
+
+def current_traceparent() -> Optional[str]:
+    "The traceparent of the current span, to continue its trace later."
+    if trace is None:
+        return None
+    carrier: Dict[str, str] = {}
+    inject(carrier)
+    return carrier.get(TRACEPARENT_HEADER)
+
+
+def trace_headers(traceparent: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Headers for a message continuing a trace, and stamped with its publish time.
+
+    :param traceparent: The span to continue, defaulting to the current span.
+    :return: The message headers.
+    """
+    headers: Dict[str, Any] = {PUBLISHED_AT_HEADER: int(time.time() * 1000)}
+    if traceparent is None:
+        traceparent = current_traceparent()
+    if traceparent is not None:
+        headers[TRACEPARENT_HEADER] = traceparent
+    return headers
+
+
+def published_at(headers: Optional[Mapping[str, Any]]) -> Optional[float]:
+    "When a message was published in seconds since the epoch, if its publisher said."
+    if not headers or headers.get(PUBLISHED_AT_HEADER) is None:
+        return None
+    try:
+        return int(headers[PUBLISHED_AT_HEADER]) / 1000
+    except (TypeError, ValueError):
+        return None
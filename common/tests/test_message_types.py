@@ -0,0 +1,87 @@
+import json
+
+import msgpack
+import pytest
+from distributed_transcoder_common import (
+    CONTENT_TYPE_JSON,
+    CONTENT_TYPE_MSGPACK,
+    CONTENT_TYPES,
+    JobProgressMessage,
+    JobSubmissionMessage,
+    MessageDecodeError,
+    decode_message,
+    encode_message,
+)
+
+SUBMISSION = JobSubmissionMessage(
+    job_id="job-1",
+    input_s3_path="in.mp4",
+    output_s3_path="out.mp4",
+    transcode_options="filesrc location={{input_file}} ! fakesink",
+    speculative=True,
+    attempt=2,
+    target={"output_type": "mp4", "resolution": "1280x720"},
+)
+
+
+@pytest.mark.parametrize("content_type", CONTENT_TYPES)
+def test_round_trip(content_type):
+    body = encode_message(SUBMISSION, content_type)
+    assert decode_message(JobSubmissionMessage, body, content_type) == SUBMISSION
+
+
+def test_messages_without_a_content_type_are_json():
+    body = encode_message(SUBMISSION, CONTENT_TYPE_JSON)
+    assert decode_message(JobSubmissionMessage, body) == SUBMISSION
+
+
+def test_unknown_content_type():
+    with pytest.raises(ValueError):
+        encode_message(SUBMISSION, "text/plain")
+
+
+def test_msgpack_version_mismatch():
+    body = msgpack.packb(
+        [JobProgressMessage.SCHEMA_VERSION + 1, 1.0, "worker", "job-1", 50.0]
+    )
+    with pytest.raises(MessageDecodeError):
+        decode_message(JobProgressMessage, body, CONTENT_TYPE_MSGPACK)
+
+
+def test_msgpack_from_older_and_newer_senders():
+    version = JobProgressMessage.SCHEMA_VERSION
+    # Older senders leave off fields appended since, which take their defaults
+    older = msgpack.packb([version, 1.0, "worker", "job-1", 50.0])
+    msg = decode_message(JobProgressMessage, older, CONTENT_TYPE_MSGPACK)
+    assert msg == JobProgressMessage(1.0, "worker", "job-1", 50.0)
+    # Newer senders may append fields, which are ignored
+    newer = msgpack.packb([version, 1.0, "worker", "job-1", 50.0, 10.0, "extra"])
+    msg = decode_message(JobProgressMessage, newer, CONTENT_TYPE_MSGPACK)
+    assert msg == JobProgressMessage(1.0, "worker", "job-1", 50.0, eta_seconds=10.0)
+
+
+def test_json_ignores_unknown_fields():
+    body = json.dumps(
+        {
+            "timestamp": 1.0,
+            "worker_id": "worker",
+            "job_id": "job-1",
+            "progress": 50.0,
+            "unknown": True,
+        }
+    ).encode()
+    msg = decode_message(JobProgressMessage, body, CONTENT_TYPE_JSON)
+    assert msg == JobProgressMessage(1.0, "worker", "job-1", 50.0)
+
+
+@pytest.mark.parametrize(
+    "body, content_type",
+    [
+        (b"not json", CONTENT_TYPE_JSON),
+        (b'{"job_id": "job-1"}', CONTENT_TYPE_JSON),
+        (b"\xc1", CONTENT_TYPE_MSGPACK),
+    ],
+)
+def test_malformed_bodies(body, content_type):
+    with pytest.raises(MessageDecodeError):
+        decode_message(JobProgressMessage, body, content_type)
@@ -0,0 +1,273 @@
+"""
+Load generator for the transcoding API. Submits jobs or playlists at a fixed rate or
+concurrency, follows each job's progress over its websocket, and reports submit
+latency, queue wait, time to first progress and end-to-end latency percentiles along
+with error rates.
+
+Run the workers with TRANSCODE_MODE=simulate to measure the API, RabbitMQ and
+Postgres on one machine without encoding anything.
+
+    $ python load_test.py --input test_chunk_in_1.mp4 --preset <preset_id> --jobs 500 --rate 20
+    $ python load_test.py --input test_chunk_in_1.mp4 --preset <a> --preset <b> --playlists --concurrency 10
+
+Requires aiohttp.
+"""
+import argparse
+import asyncio
+import math
+import random
+import string
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import aiohttp
+
+# Job states the API reports as final over the websocket or GET /jobs/{job_id}
+TERMINAL_STATES = ("completed", "failed", "cancelled", "stalled")
+
+
+@dataclass
+class JobSample:
+    job_id: str
+    submitted_at: float
+    submit_latency: float
+    first_progress_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    status: Optional[str] = None
+    error_type: Optional[str] = None
+    queue_wait: Optional[float] = None
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.run_id = "load-" + "".join(
+            random.choices(string.ascii_lowercase + string.digits, k=6)
+        )
+        self.ws_url = "ws" + args.api_url[len("http") :]
+        self.samples: List[JobSample] = []
+        self.submit_errors: Counter = Counter()
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def submit(self, index: int):
+        """
+        Submit one job or playlist and follow its jobs until they finish.
+        """
+        name = f"{self.run_id}-{index}"
+        if self.args.playlists:
+            path = "/playlists"
+            payload = {
+                "name": name,
+                "input_s3_path": self.args.input,
+                "presets": self.args.preset,
+                "dedupe": self.args.dedupe,
+            }
+        else:
+            path = "/submit_job"
+            payload = {
+                "job_id": name,
+                "input_s3_path": self.args.input,
+                "output_s3_path": f"{self.run_id}/{name}.mp4",
+                "preset_id": self.args.preset[0],
+                "dedupe": self.args.dedupe,
+            }
+
+        submitted_at = time.monotonic()
+        try:
+            async with self.session.post(
+                self.args.api_url + path, json=payload
+            ) as resp:
+                if resp.status >= 400:
+                    self.submit_errors[f"http_{resp.status}"] += 1
+                    return
+                body = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.submit_errors[type(e).__name__] += 1
+            return
+        submit_latency = time.monotonic() - submitted_at
+
+        job_ids = body["jobs"] if self.args.playlists else [body["job_id"]]
+        samples = [
+            JobSample(job_id, submitted_at, submit_latency) for job_id in job_ids
+        ]
+        self.samples.extend(samples)
+        await asyncio.gather(*(self.follow(sample) for sample in samples))
+
+    async def follow(self, sample: JobSample):
+        """
+        Watch a job's progress until it finishes or times out, then look up how long
+        it waited in the queue.
+        """
+        deadline = sample.submitted_at + self.args.timeout
+        try:
+            # The API closes the socket after a completion message, reconnect if it
+            # drops before one arrives
+            while sample.status is None and time.monotonic() < deadline:
+                async with self.session.ws_connect(
+                    f"{self.ws_url}/progress/{sample.job_id}",
+                    receive_timeout=max(deadline - time.monotonic(), 0),
+                ) as ws:
+                    async for msg in ws:
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            break
+                        self.record(sample, msg.json())
+                        if sample.status is not None:
+                            break
+                if sample.status is None:
+                    await asyncio.sleep(1)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        if sample.status is None:
+            sample.status = "timeout"
+            return
+
+        try:
+            async with self.session.get(
+                f"{self.args.api_url}/jobs/{sample.job_id}"
+            ) as resp:
+                job = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return
+        if job.get("transcode_started_at"):
+            sample.queue_wait = (
+                datetime.fromisoformat(job["transcode_started_at"])
+                - datetime.fromisoformat(job["created_at"])
+            ).total_seconds()
+
+    def record(self, sample: JobSample, message: Dict):
+        now = time.monotonic()
+        if "progress" in message:
+            if sample.first_progress_at is None:
+                sample.first_progress_at = now
+        elif message.get("status") in TERMINAL_STATES:
+            sample.status = message["status"]
+            sample.error_type = message.get("error_type")
+            sample.finished_at = now
+
+    async def run(self):
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=None)
+        async with aiohttp.ClientSession(timeout=timeout) as self.session:
+            start = time.monotonic()
+            if self.args.rate:
+                # Open loop, submissions go out on schedule however slow the API gets
+                tasks = []
+                for index in range(self.args.jobs):
+                    delay = start + index / self.args.rate - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    tasks.append(asyncio.create_task(self.submit(index)))
+                await asyncio.gather(*tasks)
+            else:
+                # Closed loop, each slot submits its next job once the last one finishes
+                indexes = iter(range(self.args.jobs))
+
+                async def slot():
+                    for index in indexes:
+                        await self.submit(index)
+
+                await asyncio.gather(*(slot() for _ in range(self.args.concurrency)))
+            self.report(time.monotonic() - start)
+
+    def report(self, elapsed: float):
+        submissions = self.args.jobs
+        submitted = submissions - sum(self.submit_errors.values())
+        statuses = Counter(sample.status for sample in self.samples)
+        print(f"Run {self.run_id}: {submissions} submissions in {elapsed:.1f}s")
+        print(
+            f"  submitted {submitted}, submit errors {submissions - submitted}"
+            f" ({100 * (submissions - submitted) / submissions:.1f}%)"
+            + "".join(f", {k}: {v}" for k, v in self.submit_errors.items())
+        )
+        jobs = len(self.samples)
+        if not jobs:
+            return
+        failed = jobs - statuses["completed"]
+        print(
+            f"  jobs {jobs}, completed {statuses['completed']}, not completed {failed}"
+            f" ({100 * failed / jobs:.1f}%), {statuses['completed'] / elapsed:.2f} jobs/s"
+        )
+        for status, count in sorted(statuses.items()):
+            if status == "completed":
+                continue
+            error_types = Counter(
+                sample.error_type for sample in self.samples if sample.status == status
+            )
+            detail = ", ".join(f"{k}: {v}" for k, v in error_types.items() if k)
+            print(f"    {status}: {count}" + (f" ({detail})" if detail else ""))
+
+        completed = [sample for sample in self.samples if sample.status == "completed"]
+        print(f"\n  {'seconds':<20}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for label, values in [
+            ("submit latency", [s.submit_latency for s in self.samples]),
+            (
+                "queue wait",
+                [s.queue_wait for s in completed if s.queue_wait is not None],
+            ),
+            (
+                "first progress",
+                [
+                    s.first_progress_at - s.submitted_at
+                    for s in completed
+                    if s.first_progress_at is not None
+                ],
+            ),
+            ("end to end", [s.finished_at - s.submitted_at for s in completed]),
+        ]:
+            if not values:
+                continue
+            values.sort()
+            print(
+                f"  {label:<20}"
+                + "".join(f"{percentile(values, p):>9.3f}" for p in (50, 90, 99, 100))
+            )
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    "Nearest-rank percentile of an ascending list."
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--api-url", default="http://localhost:8000")
+    parser.add_argument("--input", required=True, help="Input S3 path of every job")
+    parser.add_argument(
+        "--preset",
+        action="append",
+        required=True,
+        help="Preset to transcode with, repeat for the renditions of each playlist",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=100, help="Number of jobs or playlists to submit"
+    )
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument("--rate", type=float, help="Submissions per second")
+    pacing.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="Submissions in flight at once, when no rate is given",
+    )
+    parser.add_argument(
+        "--playlists", action="store_true", help="Submit playlists instead of jobs"
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Let jobs reuse identical outputs, which skips most of the pipeline",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="Seconds to wait for each job"
+    )
+    asyncio.run(LoadTest(parser.parse_args()).run())
+
+
+if __name__ == "__main__":
+    main()
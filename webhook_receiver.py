@@ -0,0 +1,102 @@
+"""
+Stub webhook receiver for trying out job and playlist callback URLs locally. Logs each
+delivered event after checking its signature against WEBHOOK_SECRET, and can fail a
+share of deliveries to exercise the API's retries.
+
+    $ WEBHOOK_SECRET=changeme python webhook_receiver.py --port 8081 --failure-rate 0.3
+
+Then submit jobs with "callback_url": "http://localhost:8081/hooks".
+
+Requires aiohttp.
+"""
+import argparse
+import hashlib
+import hmac
+import logging
+import os
+import random
+import time
+
+from aiohttp import web
+
+SIGNATURE_HEADER = "X-Transcoder-Signature"
+TIMESTAMP_HEADER = "X-Transcoder-Timestamp"
+# Deliveries signed longer ago than this are treated as replays
+MAX_SIGNATURE_AGE_SECONDS = 300
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s (%(name)s) [%(levelname)s]: %(message)s",
+)
+logger = logging.getLogger("webhook_receiver")
+
+
+def verify(secret: str, request: web.Request, body: bytes) -> bool:
+    timestamp = request.headers.get(TIMESTAMP_HEADER, "")
+    signature = request.headers.get(SIGNATURE_HEADER, "")
+    if not timestamp.isdigit():
+        return False
+    if abs(time.time() - int(timestamp)) > MAX_SIGNATURE_AGE_SECONDS:
+        return False
+    expected = hmac.new(
+        secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(signature, f"sha256={expected}")
+
+
+def make_app(secret: str, failure_rate: float) -> web.Application:
+    seen_event_ids = set()
+
+    async def receive(request: web.Request) -> web.Response:
+        body = await request.read()
+        if secret and not verify(secret, request, body):
+            logger.warning("Rejected a delivery with a bad or stale signature")
+            return web.Response(status=401)
+        if random.random() < failure_rate:
+            logger.info("Failing a delivery on purpose")
+            return web.Response(status=503)
+
+        for event in (await request.json())["events"]:
+            # Retries redeliver events which may already have been received
+            if event["event_id"] in seen_event_ids:
+                continue
+            seen_event_ids.add(event["event_id"])
+            logger.info(
+                f"{event['type']} job={event['job_id']}"
+                + (
+                    f" playlist={event['playlist_id']}"
+                    if "playlist_id" in event
+                    else ""
+                )
+                + (
+                    f" error_type={event['error_type']}"
+                    if event.get("error_type")
+                    else ""
+                )
+                + f" delay={time.time() - event['created_at']:.2f}s"
+            )
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post("/{tail:.*}", receive)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Share of deliveries to answer with a 503",
+    )
+    args = parser.parse_args()
+    secret = os.environ.get("WEBHOOK_SECRET", "")
+    if not secret:
+        logger.warning("WEBHOOK_SECRET is not set, accepting unsigned deliveries")
+    web.run_app(make_app(secret, args.failure_rate), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
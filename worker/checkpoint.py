@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import posixpath
+import queue
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+from distributed_transcoder_common import Storage, StorageError
+from errors import JobCancelled
+from hls import MUX_SINK_PATTERN
+
+CHECKPOINT_S3_PREFIX = "checkpoints"
+CHECKPOINT_MANIFEST_NAME = "manifest.json"
+
+# File extension of the segments written by each muxer
+SEGMENT_EXTENSIONS = {
+    "mp4mux": "mp4",
+    "qtmux": "mp4",
+    "matroskamux": "mkv",
+    "mpegtsmux": "ts",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_s3_prefix(job_id: str) -> str:
+    return posixpath.join(CHECKPOINT_S3_PREFIX, job_id)
+
+
+def supports_checkpointing(transcode_options: str) -> bool:
+    return MUX_SINK_PATTERN.search(transcode_options) is not None
+
+
+def segment_pattern(transcode_options: str) -> str:
+    muxer = MUX_SINK_PATTERN.search(transcode_options).group("muxer")
+    return f"segment_%05d.{SEGMENT_EXTENSIONS[muxer]}"
+
+
+def checkpoint_pipeline(
+    transcode_options: str, segment_seconds: int, start_index: int
+) -> str:
+    """
+    Rewrite a pipeline template so that it writes keyframe-aligned segments instead of a
+    single muxed file.
+
+    :param transcode_options: The GStreamer pipeline template.
+    :param segment_seconds: The minimum length of each segment, segments are cut on the
+        next keyframe after it.
+    :param start_index: The index of the first segment written by this run.
+    :return: The pipeline template with its muxer and sink replaced by splitmuxsink,
+        writing to {{segment_location}}.
+    """
+    match = MUX_SINK_PATTERN.search(transcode_options)
+    name = match.group("name")
+    sink = (
+        f"splitmuxsink name={name} muxer-factory={match.group('muxer')} "
+        f"max-size-time={segment_seconds * 1_000_000_000} start-index={start_index} "
+        "location={{segment_location}}"
+    )
+    pipeline = (
+        transcode_options[: match.start()] + sink + transcode_options[match.end() :]
+    )
+    # splitmuxsink has a single video pad but keeps the numbered audio pads
+    return re.sub(rf"\b{name}\.video_\d+\b", f"{name}.video", pipeline)
+
+
+def concat_pipeline(transcode_options: str, segments_dir: str, output_file: str) -> str:
+    """
+    Build a pipeline that remuxes checkpointed segments into the job's output file.
+
+    :param transcode_options: The job's original pipeline template.
+    :param segments_dir: The directory holding every segment.
+    :param output_file: The path to write the output to.
+    :return: A pipeline string that can be launched directly.
+    """
+    match = MUX_SINK_PATTERN.search(transcode_options)
+    name = match.group("name")
+    extension = SEGMENT_EXTENSIONS[match.group("muxer")]
+    pipeline = (
+        f'splitmuxsrc name=src location="{segments_dir}/segment_*.{extension}" '
+        f'{match.group("muxer")} name=mux ! filesink location="{output_file}" '
+        "src.video_0 ! queue ! mux.video_0"
+    )
+    if re.search(rf"\b{name}\.audio_\d+\b", transcode_options):
+        pipeline += " src.audio_0 ! queue ! mux.audio_0"
+    return pipeline
+
+
+def empty_manifest(segment_seconds: int) -> Dict:
+    return {"segment_seconds": segment_seconds, "segments": []}
+
+
+class CheckpointUploader:
+    """
+    Uploads segments to storage from a background thread as the pipeline closes them, keeping
+    a manifest of every completed segment next to them.
+
+    A segment's end position is the position in the source it was encoded up to, which
+    is where a later attempt resumes from.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        job_id: str,
+        manifest: Dict,
+        transfer_callback: Optional[Callable[[int], None]] = None,
+    ):
+        self.storage = storage
+        self.transfer_callback = transfer_callback
+        self.s3_prefix = checkpoint_s3_prefix(job_id)
+        self.manifest = manifest
+        self.lock = threading.Lock()
+        self.pending: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        # Offset of this run's running time from the start of the source
+        self.resume_position_ns = self.segments[-1]["end_ns"] if self.segments else 0
+
+    @property
+    def segments(self) -> List[Dict]:
+        return self.manifest["segments"]
+
+    @property
+    def next_index(self) -> int:
+        return len(self.segments)
+
+    def start(self):
+        self.thread.start()
+
+    def segment_closed(self, location: str, running_time_ns: int):
+        """
+        Queue a segment the pipeline just closed for upload.
+
+        :param location: The local path of the segment.
+        :param running_time_ns: The pipeline's running time when the segment was closed.
+        """
+        self.pending.put((location, self.resume_position_ns + running_time_ns))
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            location, end_ns = item
+            s3_path = posixpath.join(self.s3_prefix, os.path.basename(location))
+            try:
+                self.storage.upload(location, s3_path, callback=self.transfer_callback)
+                with self.lock:
+                    self.segments.append(
+                        {
+                            "index": len(self.segments),
+                            "s3_path": s3_path,
+                            "end_ns": end_ns,
+                        }
+                    )
+                    manifest = json.dumps(self.manifest)
+                self.storage.put_bytes(
+                    posixpath.join(self.s3_prefix, CHECKPOINT_MANIFEST_NAME),
+                    manifest.encode(),
+                    content_type="application/json",
+                )
+                logger.info(f"Checkpointed segment {s3_path} ending at {end_ns}ns")
+            except StorageError as e:
+                # Later segments can't be resumed past a missing one, so stop here
+                logger.error(f"Unable to checkpoint segment {location}: {e}")
+                return
+            except JobCancelled:
+                return
+
+    def finish(self) -> Dict:
+        """
+        Wait for queued segments to finish uploading.
+
+        :return: The manifest of every segment checkpointed so far.
+        """
+        self.pending.put(None)
+        self.thread.join()
+        return self.manifest
+
+    def discard(self):
+        """
+        Stop uploading and delete everything checkpointed so far, without waiting for
+        either to finish.
+        """
+        self.pending.put(None)
+        threading.Thread(target=self._discard, daemon=True).start()
+
+    def _discard(self):
+        self.thread.join()
+        try:
+            self.cleanup()
+        except StorageError as e:
+            logger.error(f"Unable to delete checkpointed segments: {e}")
+
+    def restore(self, segments_dir: str):
+        """
+        Download segments checkpointed by earlier attempts which aren't present locally.
+
+        :param segments_dir: The directory this attempt wrote its segments to.
+        """
+        for segment in self.segments:
+            location = os.path.join(
+                segments_dir, posixpath.basename(segment["s3_path"])
+            )
+            if not os.path.exists(location):
+                self.storage.download(
+                    segment["s3_path"], location, callback=self.transfer_callback
+                )
+
+    def cleanup(self):
+        """
+        Delete the checkpointed segments and manifest once the output is uploaded.
+        """
+        keys = [segment["s3_path"] for segment in self.segments]
+        keys.append(posixpath.join(self.s3_prefix, CHECKPOINT_MANIFEST_NAME))
+        self.storage.delete(keys)
+
+
+def load_manifest(storage: Storage, job_id: str) -> Optional[Dict]:
+    """
+    Load the manifest written alongside a job's segments, for attempts that died before
+    recording it on the job.
+
+    :return: The manifest, or None if the job has no checkpoint.
+    """
+    try:
+        manifest = storage.get_bytes(
+            posixpath.join(checkpoint_s3_prefix(job_id), CHECKPOINT_MANIFEST_NAME)
+        )
+    except StorageError:
+        return None
+    return json.loads(manifest)
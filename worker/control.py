@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from typing import Callable, List, Optional
+
+import pika
+from distributed_transcoder_common import JobControlMessage, decode_message
+from errors import JobCancelled
+from pika.adapters.blocking_connection import BlockingChannel
+from pika.spec import Basic, BasicProperties
+from work_queue import connect_rabbitmq
+
+logger = logging.getLogger(__name__)
+
+# Backoff between attempts to reconnect the control listener, doubling up to the max
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 60
+
+
+class Cancellation:
+    """
+    The cancellation state of the job a worker is running. Hooks registered with it abort
+    whatever the job is doing when the cancellation arrives, and S3 transfers given its
+    transfer callback abort on their next chunk.
+
+    A job interrupted with requeue set is handed back to the queue with its checkpoint,
+    rather than cancelled for good.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reason: Optional[str] = None
+        self.requeue = False
+        self.hooks: List[Callable[[str], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str, requeue: bool = False):
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            self.requeue = requeue
+            hooks = list(self.hooks)
+        for hook in hooks:
+            hook(reason)
+
+    def on_cancel(self, hook: Callable[[str], None]):
+        """
+        Register a hook to run on cancellation, running it straight away if the job has
+        already been cancelled.
+        """
+        with self.lock:
+            if self.reason is None:
+                self.hooks.append(hook)
+                return
+            reason = self.reason
+        hook(reason)
+
+    def remove(self, hook: Callable[[str], None]):
+        with self.lock:
+            if hook in self.hooks:
+                self.hooks.remove(hook)
+
+    def check(self):
+        if self.reason is not None:
+            raise JobCancelled(f"Job cancelled: {self.reason}")
+
+    def transfer_callback(self, bytes_transferred: int):
+        """
+        Progress callback for boto3 transfers, which fail with the exception it raises.
+        """
+        self.check()
+
+
+class ControlListener:
+    """
+    Listens on the control exchange from a background thread with its own connection, so
+    control messages reach the worker while its main thread is busy transcoding. A lost
+    connection is reconnected with a backoff, and messages sent meanwhile are missed.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        credentials: pika.PlainCredentials,
+        exchange_name: str,
+        worker_id: str,
+    ):
+        self.host = host
+        self.port = port
+        self.credentials = credentials
+        self.exchange_name = exchange_name
+        self.worker_id = worker_id
+        self.lock = threading.Lock()
+        self.job_id: Optional[str] = None
+        self.on_cancel: Optional[Callable[[str], None]] = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def watch(self, job_id: str, on_cancel: Callable[[str], None]):
+        """
+        Route cancellations for a job to a callback until unwatch is called.
+
+        :param job_id: The job the worker is running.
+        :param on_cancel: Called from the listener thread with the cancellation reason.
+        """
+        with self.lock:
+            self.job_id = job_id
+            self.on_cancel = on_cancel
+
+    def unwatch(self):
+        with self.lock:
+            self.job_id = None
+            self.on_cancel = None
+
+    def on_message(
+        self,
+        ch: BlockingChannel,
+        method: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes,
+    ):
+        msg = decode_message(JobControlMessage, body, properties.content_type)
+        if msg.action != JobControlMessage.ACTION_CANCEL:
+            return
+        if msg.except_worker_id == self.worker_id:
+            return
+        with self.lock:
+            if msg.job_id != self.job_id or self.on_cancel is None:
+                return
+            on_cancel = self.on_cancel
+        logger.info(f"Received cancellation for job {msg.job_id}: {msg.reason}")
+        on_cancel(msg.reason or "cancelled")
+
+    def run(self):
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            try:
+                channel = self.connect()
+                # Connected again, so the next loss starts its backoff over
+                delay = RECONNECT_MIN_SECONDS
+                channel.start_consuming()
+            except pika.exceptions.AMQPError as e:
+                logger.warning(
+                    f"Lost the control connection, reconnecting in {delay} seconds: {e}"
+                )
+            else:
+                # The broker cancelled the consumer, but the connection may be open
+                logger.warning(
+                    f"Control consumer stopped, reconnecting in {delay} seconds"
+                )
+                if channel.connection.is_open:
+                    channel.connection.close()
+            time.sleep(delay)
+            delay = min(2 * delay, RECONNECT_MAX_SECONDS)
+
+    def connect(self) -> BlockingChannel:
+        """
+        Connect to the control exchange and start consuming from a queue of its own.
+
+        :return: The channel to consume on.
+        :raises pika.exceptions.AMQPError: If RabbitMQ can't be reached.
+        """
+        connection = connect_rabbitmq(self.host, self.port, self.credentials)
+        if connection is None:
+            raise pika.exceptions.AMQPConnectionError("Out of connection retries")
+        channel = connection.channel()
+        channel.exchange_declare(exchange=self.exchange_name, exchange_type="fanout")
+        # Each worker gets its own exclusive queue so every one sees every message
+        result = channel.queue_declare(queue="", exclusive=True, auto_delete=True)
+        channel.queue_bind(exchange=self.exchange_name, queue=result.method.queue)
+        channel.basic_consume(
+            queue=result.method.queue,
+            on_message_callback=self.on_message,
+            auto_ack=True,
+        )
+        return channel
@@ -30,3 +30,10 @@ class PipelineTimeout(TranscodeException):
 
     def __init__(self, *args):
         super().__init__("pipeline_timeout", *args)
+
+
+class JobCancelled(TranscodeException):
+    "Raised when the job is cancelled while transcoding."
+
+    def __init__(self, *args):
+        super().__init__("cancelled", *args)
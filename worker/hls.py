@@ -0,0 +1,151 @@
+import logging
+import os
+import posixpath
+import re
+import threading
+from typing import Callable, Optional, Set
+
+from distributed_transcoder_common import Storage
+from errors import FailedToParsePipeline
+
+PACKAGING_HLS = "hls"
+
+# Length of each HLS segment in seconds, segments are cut on the next keyframe after this
+HLS_TARGET_DURATION = 6
+HLS_PLAYLIST_NAME = "index.m3u8"
+HLS_SEGMENT_PATTERN = "segment_%05d.ts"
+
+# Matches the muxer and file sink that every preset pipeline ends in
+MUX_SINK_PATTERN = re.compile(
+    r"\b(?P<muxer>mp4mux|qtmux|matroskamux|mpegtsmux)\s+name=(?P<name>\w+)\s*!\s*"
+    r"filesink\s+location=\{\{output_file\}\}"
+)
+
+logger = logging.getLogger(__name__)
+
+
+def hls_pipeline(transcode_options: str) -> str:
+    """
+    Rewrite a pipeline template so that it writes HLS segments and a media playlist
+    instead of a single muxed file.
+
+    :param transcode_options: The GStreamer pipeline template.
+    :return: The pipeline template with its muxer and sink replaced by hlssink2.
+    :raises FailedToParsePipeline: If the pipeline doesn't end in a supported muxer.
+    """
+    match = MUX_SINK_PATTERN.search(transcode_options)
+    if match is None:
+        raise FailedToParsePipeline(
+            "Pipeline must mux into a filesink at {{output_file}} to be packaged as HLS"
+        )
+    name = match.group("name")
+    sink = (
+        f"hlssink2 name={name} target-duration={HLS_TARGET_DURATION} "
+        "max-files=0 playlist-length=0 "
+        "location={{segment_location}} playlist-location={{playlist_location}}"
+    )
+    pipeline = (
+        transcode_options[: match.start()] + sink + transcode_options[match.end() :]
+    )
+    # hlssink2 has a single request pad per media type
+    pipeline = re.sub(rf"\b{name}\.video_\d+\b", f"{name}.video", pipeline)
+    return re.sub(rf"\b{name}\.audio_\d+\b", f"{name}.audio", pipeline)
+
+
+class HlsUploader:
+    """
+    Uploads HLS segments and the media playlist to storage while the pipeline is still
+    running, so playback can start before the transcode finishes.
+
+    hlssink2 rewrites the playlist atomically after each segment is closed, so every
+    segment listed in it is complete and safe to upload.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        output_dir: str,
+        output_s3_path: str,
+        poll_interval: float = 1.0,
+        transfer_callback: Optional[Callable[[int], None]] = None,
+    ):
+        self.storage = storage
+        self.output_dir = output_dir
+        self.playlist_s3_path = output_s3_path
+        self.s3_prefix = posixpath.dirname(output_s3_path)
+        self.poll_interval = poll_interval
+        self.transfer_callback = transfer_callback
+        self.uploaded_segments: Set[str] = set()
+        self.last_playlist_mtime = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def playlist_file(self) -> str:
+        return os.path.join(self.output_dir, HLS_PLAYLIST_NAME)
+
+    @property
+    def segment_location(self) -> str:
+        return os.path.join(self.output_dir, HLS_SEGMENT_PATTERN)
+
+    def start(self):
+        self.thread.start()
+
+    def sync(self):
+        """
+        Upload any newly listed segments, then the playlist that lists them.
+        """
+        try:
+            mtime = os.stat(self.playlist_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.last_playlist_mtime:
+            return
+        self.last_playlist_mtime = mtime
+
+        with open(self.playlist_file, "rb") as f:
+            playlist = f.read()
+        segments = [
+            line.strip()
+            for line in playlist.decode().splitlines()
+            if line.strip() and not line.startswith("#")
+        ]
+        for segment in segments:
+            if segment in self.uploaded_segments:
+                continue
+            self.storage.upload(
+                os.path.join(self.output_dir, segment),
+                posixpath.join(self.s3_prefix, segment),
+                content_type="video/mp2t",
+                callback=self.transfer_callback,
+            )
+            self.uploaded_segments.add(segment)
+            logger.info(f"Uploaded HLS segment {segment}")
+        self.storage.put_bytes(
+            self.playlist_s3_path,
+            playlist,
+            content_type="application/vnd.apple.mpegurl",
+            cache_control="no-cache",
+        )
+
+    def run(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                # Keep transcoding, the final sync will retry and surface the error
+                logger.error(f"Unable to upload HLS output: {e}")
+
+    def finish(self):
+        """
+        Stop polling and upload whatever the pipeline wrote last, including the final
+        playlist with its end marker.
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.last_playlist_mtime = None
+        self.sync()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
@@ -0,0 +1,190 @@
+import logging
+import time
+import uuid
+from typing import Dict, Optional, Set
+
+import pika
+from distributed_transcoder_common import (
+    JobSubmissionMessage,
+    JobTransitionMessage,
+    JobTransitionReplyMessage,
+    decode_message,
+    encode_message,
+)
+from pika.adapters.blocking_connection import BlockingChannel, BlockingConnection
+from pika.spec import Basic, BasicProperties
+from work_queue import connect_rabbitmq
+
+# RabbitMQ's pseudo-queue for replies to the consuming channel, which needs no queue of
+# its own to be declared per request
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+logger = logging.getLogger(__name__)
+
+
+class JobStateUnavailable(Exception):
+    "Raised when the API doesn't answer a request to move a job between states."
+
+
+class JobStateClient:
+    """
+    Asks the API to move jobs between states over RabbitMQ, waiting for each request to
+    be applied, so that workers don't hold database connections of their own. Requests
+    go over a connection of their own, which is reopened if the broker closed it while
+    the worker was busy transcoding.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        credentials: pika.PlainCredentials,
+        queue_name: str,
+        worker_id: str,
+        content_type: str,
+        timeout_seconds: float = 30,
+    ):
+        self.host = host
+        self.port = port
+        self.credentials = credentials
+        self.queue_name = queue_name
+        self.worker_id = worker_id
+        self.content_type = content_type
+        self.timeout_seconds = timeout_seconds
+        self.connection: Optional[BlockingConnection] = None
+        self.channel: Optional[BlockingChannel] = None
+        self.correlation_id: Optional[str] = None
+        self.reply: Optional[JobTransitionReplyMessage] = None
+        # Fencing tokens of the claims this worker holds, which everything it reports
+        # about those attempts is sent with
+        self.claim_tokens: Dict[str, int] = {}
+        # Jobs this worker is running a speculative copy of
+        self.speculative: Set[str] = set()
+
+    def connect(self):
+        self.connection = connect_rabbitmq(self.host, self.port, self.credentials)
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=self.queue_name)
+        self.channel.basic_consume(
+            queue=DIRECT_REPLY_TO, on_message_callback=self.on_reply, auto_ack=True
+        )
+
+    def on_reply(
+        self,
+        ch: BlockingChannel,
+        method: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes,
+    ):
+        # Replies to requests that timed out may still turn up, ignore them
+        if properties.correlation_id != self.correlation_id:
+            return
+        self.reply = decode_message(
+            JobTransitionReplyMessage, body, properties.content_type
+        )
+
+    def request(self, msg: JobTransitionMessage) -> JobTransitionReplyMessage:
+        """
+        Send a request and wait for the API to answer it.
+
+        :param msg: The request.
+        :return: The API's answer.
+        :raises JobStateUnavailable: If the API didn't answer in time.
+        """
+        for attempt in range(2):
+            try:
+                if self.connection is None or self.connection.is_closed:
+                    self.connect()
+                return self.send(msg)
+            except pika.exceptions.AMQPError as e:
+                logger.warning(f"Lost the connection for job state requests: {e}")
+                self.connection = None
+        raise JobStateUnavailable(f"Unable to send {msg.action} of job {msg.job_id}")
+
+    def send(self, msg: JobTransitionMessage) -> JobTransitionReplyMessage:
+        self.correlation_id = uuid.uuid4().hex
+        self.reply = None
+        self.channel.basic_publish(
+            exchange="",
+            routing_key=self.queue_name,
+            properties=BasicProperties(
+                content_type=self.content_type,
+                reply_to=DIRECT_REPLY_TO,
+                correlation_id=self.correlation_id,
+            ),
+            body=encode_message(msg, self.content_type),
+        )
+        deadline = time.monotonic() + self.timeout_seconds
+        while self.reply is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise JobStateUnavailable(
+                    f"No answer to {msg.action} of job {msg.job_id} after {self.timeout_seconds} seconds"
+                )
+            self.connection.process_data_events(time_limit=remaining)
+        return self.reply
+
+    def claim(self, job_data: JobSubmissionMessage) -> JobTransitionReplyMessage:
+        """
+        Claim a job to run it. Claims of speculative copies succeed while the original
+        attempt is running, without taking the claim from it.
+        """
+        reply = self.request(
+            JobTransitionMessage(
+                action=JobTransitionMessage.ACTION_CLAIM,
+                job_id=job_data.job_id,
+                worker_id=self.worker_id,
+                attempt=job_data.attempt,
+                speculative=job_data.speculative,
+            )
+        )
+        if reply.applied and reply.claim_token is not None:
+            self.claim_tokens[job_data.job_id] = reply.claim_token
+        if reply.applied and job_data.speculative:
+            self.speculative.add(job_data.job_id)
+        return reply
+
+    def forget(self, job_id: str):
+        "Drop the claim of a job this worker is done with."
+        self.claim_tokens.pop(job_id, None)
+        self.speculative.discard(job_id)
+
+    def release(
+        self,
+        job_id: str,
+        state: str,
+        error: Optional[str] = None,
+        error_type: Optional[str] = None,
+    ) -> JobTransitionReplyMessage:
+        """
+        Hand a claimed job back in a state it can be claimed from again.
+        """
+        return self.request(
+            JobTransitionMessage(
+                action=JobTransitionMessage.ACTION_RELEASE,
+                job_id=job_id,
+                worker_id=self.worker_id,
+                state=state,
+                error=error,
+                error_type=error_type,
+                speculative=job_id in self.speculative,
+                claim_token=self.claim_tokens.get(job_id),
+            )
+        )
+
+    def checkpoint(
+        self, job_id: str, manifest: Optional[Dict]
+    ) -> JobTransitionReplyMessage:
+        """
+        Record the manifest of a job's checkpointed segments, or clear it with None.
+        """
+        return self.request(
+            JobTransitionMessage(
+                action=JobTransitionMessage.ACTION_CHECKPOINT,
+                job_id=job_id,
+                worker_id=self.worker_id,
+                checkpoint=manifest,
+                speculative=job_id in self.speculative,
+                claim_token=self.claim_tokens.get(job_id),
+            )
+        )
@@ -0,0 +1,157 @@
+import logging
+import os
+from typing import Dict, Optional
+
+import gi
+
+gi.require_version("Gst", "1.0")
+gi.require_version("GstPbutils", "1.0")
+from distributed_transcoder_common.models import MediaInfo
+from gi.repository import Gst, GstPbutils
+from hls import MUX_SINK_PATTERN
+
+# Container caps and the name presets use for them, along with the demuxer that reads them
+CONTAINERS = {
+    "video/quicktime": "mp4",
+    "video/x-matroska": "mkv",
+    "video/webm": "webm",
+    "video/mpegts": "ts",
+}
+DEMUXERS = {
+    "mp4": "qtdemux",
+    "mkv": "matroskademux",
+    "webm": "matroskademux",
+    "ts": "tsdemux",
+}
+
+# Codec caps and the name presets use for them, along with the parser for each codec
+VIDEO_CODECS = {
+    "video/x-h264": "h264",
+    "video/x-h265": "h265",
+    "video/x-vp9": "vp9",
+}
+AUDIO_CODECS = {
+    "audio/x-opus": "opus",
+    "audio/x-ac3": "ac3",
+}
+PARSERS = {
+    "h264": "h264parse",
+    "h265": "h265parse",
+    "vp9": "vp9parse",
+    "aac": "aacparse",
+    "mp3": "mpegaudioparse",
+    "opus": "opusparse",
+    "ac3": "ac3parse",
+}
+
+# How far above the target bitrate a source may be and still be remuxed as is
+BITRATE_TOLERANCE = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+def codec_name(caps: Gst.Caps) -> Optional[str]:
+    structure = caps.get_structure(0)
+    name = structure.get_name()
+    if name == "audio/mpeg":
+        ok, version = structure.get_int("mpegversion")
+        if ok and version == 1:
+            return "mp3"
+        return "aac"
+    return VIDEO_CODECS.get(name) or AUDIO_CODECS.get(name)
+
+
+def probe(path: str, timeout_seconds: int = 10) -> Dict:
+    """
+    Probe a media file for the properties presets describe their output with.
+
+    :param path: The path to the file.
+    :param timeout_seconds: How long to let the discoverer run.
+    :return: The fields of a MediaInfo row, apart from its S3 path.
+    :raises GLib.Error: If the file can't be probed.
+    """
+    discoverer = GstPbutils.Discoverer.new(timeout_seconds * Gst.SECOND)
+    info = discoverer.discover_uri(Gst.filename_to_uri(path))
+
+    media = {
+        "size": os.path.getsize(path),
+        "duration_ns": info.get_duration() or None,
+        "container": None,
+    }
+    stream = info.get_stream_info()
+    if isinstance(stream, GstPbutils.DiscovererContainerInfo):
+        media["container"] = CONTAINERS.get(
+            stream.get_caps().get_structure(0).get_name()
+        )
+
+    video_streams = info.get_video_streams()
+    if video_streams:
+        video = video_streams[0]
+        denominator = video.get_framerate_denom()
+        media.update(
+            video_codec=codec_name(video.get_caps()),
+            width=video.get_width(),
+            height=video.get_height(),
+            frame_rate=video.get_framerate_num() / denominator if denominator else None,
+            video_bitrate=video.get_bitrate() // 1000 or None,
+        )
+
+    audio_streams = info.get_audio_streams()
+    if audio_streams:
+        audio = audio_streams[0]
+        media.update(
+            audio_codec=codec_name(audio.get_caps()),
+            audio_bitrate=audio.get_bitrate() // 1000 or None,
+        )
+    return media
+
+
+def matches_target(media: MediaInfo, target: Dict[str, str]) -> bool:
+    """
+    Check whether a source already has the codecs, resolution and bitrate a preset
+    encodes to, in which case transcoding it would only cost time and quality.
+
+    :param media: The probed source.
+    :param target: The output fields of the job's preset.
+    """
+    if media.container not in DEMUXERS or media.video_codec not in PARSERS:
+        return False
+    if media.video_codec != target.get("video_encoding"):
+        return False
+    if media.resolution != target.get("resolution"):
+        return False
+    if media.audio_codec is not None and (
+        media.audio_codec != target.get("audio_encoding")
+        or media.audio_codec not in PARSERS
+    ):
+        return False
+    try:
+        target_bitrate = int(target["video_bitrate"]) + int(target["audio_bitrate"])
+    except (KeyError, ValueError):
+        return False
+    return media.bitrate is not None and media.bitrate <= target_bitrate * (
+        1 + BITRATE_TOLERANCE
+    )
+
+
+def remux_pipeline(transcode_options: str, media: MediaInfo) -> Optional[str]:
+    """
+    Build a pipeline template that copies a source's streams into the muxer of the
+    job's pipeline, without decoding them.
+
+    :param transcode_options: The job's pipeline template.
+    :param media: The probed source.
+    :return: The remux pipeline template, or None if the job's pipeline doesn't end in
+        a supported muxer.
+    """
+    match = MUX_SINK_PATTERN.search(transcode_options)
+    if match is None:
+        return None
+    pipeline = (
+        f"filesrc location={{{{input_file}}}} ! {DEMUXERS[media.container]} name=d "
+        f"{match.group('muxer')} name=mux ! filesink location={{{{output_file}}}} "
+        f"d.video_0 ! queue ! {PARSERS[media.video_codec]} ! {{{{progress}}}} ! mux.video_0"
+    )
+    if media.audio_codec is not None:
+        pipeline += f" d.audio_0 ! queue ! {PARSERS[media.audio_codec]} ! mux.audio_0"
+    return pipeline
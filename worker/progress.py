@@ -0,0 +1,42 @@
+import time
+from typing import Optional, Tuple
+
+
+class ProgressEstimator:
+    """
+    Turns the pipeline's position into percent complete and an ETA, using the probed
+    duration of the source. The ETA extrapolates the pace since the first sample, which
+    also holds for attempts resumed part way through the source.
+    """
+
+    def __init__(self, duration_ns: Optional[int]):
+        self.duration_ns = duration_ns
+        self.first_time: Optional[float] = None
+        self.first_position_ns: Optional[int] = None
+
+    def update(
+        self, position_ns: Optional[int], reported_percent: float
+    ) -> Tuple[float, Optional[float]]:
+        """
+        Estimate progress from a position sample.
+
+        :param position_ns: The pipeline's position, or None if it couldn't be queried.
+        :param reported_percent: The percent reported by the pipeline, used without a
+            duration or position.
+        :return: A tuple of the percent complete and the seconds left, if known.
+        """
+        if not self.duration_ns or position_ns is None or position_ns < 0:
+            return reported_percent, None
+        position_ns = min(position_ns, self.duration_ns)
+        percent = 100 * position_ns / self.duration_ns
+
+        now = time.monotonic()
+        if self.first_time is None:
+            self.first_time = now
+            self.first_position_ns = position_ns
+            return percent, None
+        elapsed = now - self.first_time
+        advanced_ns = position_ns - self.first_position_ns
+        if elapsed <= 0 or advanced_ns <= 0:
+            return percent, None
+        return percent, (self.duration_ns - position_ns) * elapsed / advanced_ns
@@ -0,0 +1,144 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Margin on top of the estimate, for container overhead and bitrate overshoot
+SCRATCH_HEADROOM = 1.2
+
+
+def estimate_scratch_bytes(
+    input_size: int,
+    duration_ns: Optional[int] = None,
+    target: Optional[Dict[str, str]] = None,
+    in_place: bool = False,
+) -> int:
+    """
+    Estimate the scratch space a job needs from the size of its input and, when the
+    source's duration and the preset's bitrates are known, the size of its output.
+
+    :param input_size: The size of the input in bytes.
+    :param duration_ns: The probed duration of the source, if it has been probed.
+    :param target: The output fields of the job's preset, if it has one.
+    :param in_place: Whether the input and output are read and written in place on
+        shared storage, leaving only segments in scratch space.
+    :return: The estimated number of bytes.
+    """
+    # Without a duration and bitrate assume the output is as large as the input
+    output_size = input_size
+    if duration_ns and target:
+        try:
+            kbps = int(target["video_bitrate"]) + int(target["audio_bitrate"])
+            output_size = int(kbps * 1000 / 8 * duration_ns / 1_000_000_000)
+        except (KeyError, ValueError):
+            pass
+    if in_place:
+        return int(output_size * SCRATCH_HEADROOM)
+    # Checkpointed or HLS segments sit alongside the final output
+    return int((input_size + 2 * output_size) * SCRATCH_HEADROOM)
+
+
+class ScratchReservation:
+    """
+    A job's scratch directory and the space reserved for it. The directory and
+    everything in it are removed when the reservation is released.
+    """
+
+    def __init__(
+        self, manager: "ScratchManager", path: str, size: int, in_memory: bool
+    ):
+        self.manager = manager
+        self.path = path
+        self.size = size
+        self.in_memory = in_memory
+
+    def release(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.manager.release(self)
+
+    def __enter__(self) -> "ScratchReservation":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ScratchManager:
+    """
+    Places each job's scratch files on tmpfs when they fit within a memory budget and
+    on disk otherwise, reserving the space before the job is accepted so that jobs
+    which won't fit are turned away up front rather than failing mid-transcode.
+    """
+
+    def __init__(
+        self,
+        memory_dir: Optional[str],
+        memory_budget_bytes: int,
+        disk_dir: str,
+        disk_min_free_bytes: int,
+    ):
+        self.memory_dir = memory_dir
+        self.memory_budget_bytes = memory_budget_bytes if memory_dir else 0
+        self.disk_dir = disk_dir
+        self.disk_min_free_bytes = disk_min_free_bytes
+        self.lock = threading.Lock()
+        self.memory_reserved = 0
+        self.disk_reserved = 0
+
+    def _memory_available(self) -> int:
+        if not self.memory_budget_bytes or not os.path.isdir(self.memory_dir):
+            return 0
+        return min(
+            self.memory_budget_bytes - self.memory_reserved,
+            shutil.disk_usage(self.memory_dir).free,
+        )
+
+    def _disk_available(self) -> int:
+        free = shutil.disk_usage(self.disk_dir).free
+        return free - self.disk_reserved - self.disk_min_free_bytes
+
+    def fits_when_idle(self, size: int) -> bool:
+        """
+        Check whether a job could fit at all, with nothing else reserved.
+        """
+        disk_capacity = (
+            shutil.disk_usage(self.disk_dir).free
+            + self.disk_reserved
+            - self.disk_min_free_bytes
+        )
+        return size <= max(self.memory_budget_bytes, disk_capacity)
+
+    def reserve(self, job_id: str, size: int) -> Optional[ScratchReservation]:
+        """
+        Reserve scratch space for a job, preferring memory.
+
+        :param job_id: The job the space is for.
+        :param size: The estimated number of bytes the job needs.
+        :return: The reservation, or None if neither memory nor disk has room.
+        """
+        with self.lock:
+            if size <= self._memory_available():
+                self.memory_reserved += size
+                in_memory, root = True, self.memory_dir
+            elif size <= self._disk_available():
+                self.disk_reserved += size
+                in_memory, root = False, self.disk_dir
+            else:
+                return None
+        path = tempfile.mkdtemp(prefix=f"{job_id}-", dir=root)
+        logger.info(
+            f"Reserved {size / 1_000_000:.1f}MB of {'memory' if in_memory else 'disk'} "
+            f"scratch space for job {job_id} in {path}"
+        )
+        return ScratchReservation(self, path, size, in_memory)
+
+    def release(self, reservation: ScratchReservation):
+        with self.lock:
+            if reservation.in_memory:
+                self.memory_reserved -= reservation.size
+            else:
+                self.disk_reserved -= reservation.size
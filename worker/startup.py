@@ -0,0 +1,27 @@
+import time
+from typing import List, Tuple
+
+
+class StartupTimer:
+    """
+    Times each phase of a worker's startup, so that a slow start can be pinned on
+    whichever phase caused it.
+    """
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.last_mark = started_at
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str):
+        "Record the time since the last mark as the named phase."
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last_mark))
+        self.last_mark = now
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phases)
+        return f"{self.last_mark - self.started_at:.3f}s ({phases})"
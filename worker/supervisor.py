@@ -0,0 +1,191 @@
+"""
+Runs workers as a pool of processes forked from one which has already imported
+everything and initialized GStreamer, so that each only has to connect before it can
+take jobs. A few of them are kept warm, connected but parked until the pool needs
+another consumer, which then starts on a job in well under a second.
+
+    $ WORKER_PROCESSES=2 WORKER_PROCESSES_MAX=4 WARM_POOL_SIZE=1 python supervisor.py
+
+The pool activates a warm process whenever every active one is busy, up to
+WORKER_PROCESSES_MAX, and retires active processes beyond WORKER_PROCESSES once they
+have been idle for SCALE_DOWN_IDLE_SECONDS.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import Connection, wait
+from typing import List
+
+import worker
+from startup import StartupTimer
+
+# Warm Pool Config
+# Processes consuming jobs at all times, and at most while every one of them is busy
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "1"))
+WORKER_PROCESSES_MAX = int(
+    os.environ.get("WORKER_PROCESSES_MAX", str(WORKER_PROCESSES))
+)
+# Processes kept connected and ready to be activated
+WARM_POOL_SIZE = int(os.environ.get("WARM_POOL_SIZE", "1"))
+SCALE_DOWN_IDLE_SECONDS = float(os.environ.get("SCALE_DOWN_IDLE_SECONDS", "60"))
+# Longest wait before replacing a process which failed to start
+MAX_RESTART_DELAY_SECONDS = 30
+
+logger = logging.getLogger("supervisor")
+
+
+def run_child(conn: Connection, processes: int):
+    # Shutdowns come from the supervisor, which drains the pool in an orderly way
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    worker.assign_worker_id(worker.new_worker_id())
+    worker.startup = StartupTimer(time.perf_counter())
+    # The processes share the container's tmpfs, so they share its budget too
+    worker.scratch_manager.memory_budget_bytes //= processes
+    worker.serve(conn)
+
+
+class PooledWorker:
+    def __init__(self, process: multiprocessing.Process, conn: Connection):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.active = False
+        self.busy = False
+        self.retiring = False
+        self.idle_since = time.monotonic()
+
+
+class Supervisor:
+    """
+    Keeps the pool at its sizes, replacing processes as they exit.
+    """
+
+    def __init__(self, min_active: int, max_active: int, warm_size: int):
+        self.min_active = min_active
+        self.max_active = max(min_active, max_active)
+        self.warm_size = warm_size
+        self.context = multiprocessing.get_context("fork")
+        self.workers: List[PooledWorker] = []
+        self.stopping = False
+        self.failed_starts = 0
+        self.next_spawn_at = 0.0
+
+    def spawn(self):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=run_child, args=(child_conn, self.max_active + self.warm_size)
+        )
+        process.start()
+        # Only the child's copy of its end should keep the pipe open
+        child_conn.close()
+        self.workers.append(PooledWorker(process, parent_conn))
+
+    def active_workers(self) -> List[PooledWorker]:
+        return [w for w in self.workers if w.active and not w.retiring]
+
+    def warm_workers(self) -> List[PooledWorker]:
+        return [w for w in self.workers if not w.active]
+
+    def rebalance(self):
+        now = time.monotonic()
+        active = self.active_workers()
+        needed = len(active) < self.min_active or (
+            len(active) < self.max_active and all(w.busy for w in active)
+        )
+        ready = [w for w in self.warm_workers() if w.ready]
+        if needed and ready:
+            ready[0].conn.send(worker.POOL_ACTIVATE)
+            ready[0].active = True
+            ready[0].idle_since = now
+            logger.info(f"Activated worker process {ready[0].process.pid}")
+            active.append(ready[0])
+
+        if len(active) > self.min_active:
+            for w in active:
+                if not w.busy and now - w.idle_since >= SCALE_DOWN_IDLE_SECONDS:
+                    logger.info(f"Retiring idle worker process {w.process.pid}")
+                    w.retiring = True
+                    os.kill(w.process.pid, signal.SIGTERM)
+                    break
+
+        # Top the warm pool back up, and bring up the active processes at startup
+        wanted = self.warm_size + max(0, self.min_active - len(active))
+        while len(self.warm_workers()) < wanted and now >= self.next_spawn_at:
+            self.spawn()
+
+    def handle(self, w: PooledWorker):
+        try:
+            while w.conn.poll():
+                status = w.conn.recv()
+                if status == worker.POOL_READY:
+                    w.ready = True
+                    self.failed_starts = 0
+                elif status == worker.POOL_BUSY:
+                    w.busy = True
+                elif status == worker.POOL_IDLE:
+                    w.busy = False
+                    w.idle_since = time.monotonic()
+        except EOFError:
+            # The process is exiting, its sentinel will say when it has
+            pass
+
+    def reap(self, w: PooledWorker):
+        w.process.join()
+        w.conn.close()
+        self.workers.remove(w)
+        if self.stopping or w.retiring:
+            return
+        if not w.ready:
+            # Back off from replacing processes which can't start, such as while
+            # RabbitMQ is unreachable
+            self.failed_starts += 1
+            delay = min(2**self.failed_starts, MAX_RESTART_DELAY_SECONDS)
+            self.next_spawn_at = time.monotonic() + delay
+            logger.error(
+                f"Worker process {w.process.pid} exited before it was ready, "
+                f"replacing it in {delay}s"
+            )
+        else:
+            logger.warning(
+                f"Worker process {w.process.pid} exited with code {w.process.exitcode}"
+            )
+
+    def stop(self, signum, frame):
+        if self.stopping:
+            return
+        logger.info("Shutting down, draining the worker processes")
+        self.stopping = True
+        for w in self.workers:
+            if w.process.is_alive():
+                os.kill(w.process.pid, signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.rebalance()
+        while self.workers or not self.stopping:
+            by_conn = {w.conn: w for w in self.workers}
+            by_sentinel = {w.process.sentinel: w for w in self.workers}
+            for ready in wait(list(by_conn) + list(by_sentinel), timeout=1):
+                if ready in by_conn:
+                    self.handle(by_conn[ready])
+            for w in by_sentinel.values():
+                if not w.process.is_alive():
+                    self.reap(w)
+            if not self.stopping:
+                self.rebalance()
+        logger.info("All worker processes have exited")
+
+
+def main():
+    worker.assign_worker_id("super")
+    worker.initialize()
+    logger.info(f"Initialized after {worker.startup.summary()}")
+    Supervisor(WORKER_PROCESSES, WORKER_PROCESSES_MAX, WARM_POOL_SIZE).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+from checkpoint import (
+    checkpoint_pipeline,
+    concat_pipeline,
+    segment_pattern,
+    supports_checkpointing,
+)
+
+PIPELINE = (
+    "filesrc location={{input_file}} ! matroskademux name=d matroskamux name=mux ! "
+    "filesink location={{output_file}} "
+    "d.audio_0 ! queue ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 "
+    "d.video_0 ! queue ! decodebin ! x265enc bitrate=768 ! {{progress}} ! "
+    "h265parse ! mux.video_0"
+)
+
+
+def test_supports_checkpointing():
+    assert supports_checkpointing(PIPELINE)
+    assert not supports_checkpointing("filesrc location={{input_file}} ! fakesink")
+
+
+def test_segment_pattern_follows_the_muxer():
+    assert segment_pattern(PIPELINE) == "segment_%05d.mkv"
+    mp4 = PIPELINE.replace("matroskamux", "mp4mux")
+    assert segment_pattern(mp4) == "segment_%05d.mp4"
+
+
+def test_replaces_muxer_and_sink():
+    pipeline = checkpoint_pipeline(PIPELINE, 30, 4)
+    assert "filesink" not in pipeline
+    assert (
+        "splitmuxsink name=mux muxer-factory=matroskamux "
+        "max-size-time=30000000000 start-index=4 "
+        "location={{segment_location}}"
+    ) in pipeline
+
+
+def test_links_to_the_sink_pads():
+    pipeline = checkpoint_pipeline(PIPELINE, 30, 0)
+    assert pipeline.endswith("h265parse ! mux.video")
+    # Audio pads stay numbered on splitmuxsink
+    assert "avenc_aac ! mux.audio_0" in pipeline
+
+
+def test_concat_pipeline():
+    pipeline = concat_pipeline(PIPELINE, "/tmp/segments", "/tmp/out.mkv")
+    assert 'location="/tmp/segments/segment_*.mkv"' in pipeline
+    assert 'matroskamux name=mux ! filesink location="/tmp/out.mkv"' in pipeline
+    assert "src.audio_0 ! queue ! mux.audio_0" in pipeline
+
+
+def test_concat_pipeline_without_audio():
+    video_only = (
+        "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! "
+        "filesink location={{output_file}} "
+        "d.video_0 ! queue ! decodebin ! x264enc ! h264parse ! mux.video_0"
+    )
+    pipeline = concat_pipeline(video_only, "/tmp/segments", "/tmp/out.mp4")
+    assert "audio" not in pipeline
@@ -0,0 +1,38 @@
+import pytest
+from errors import FailedToParsePipeline
+from hls import HLS_TARGET_DURATION, hls_pipeline
+
+PIPELINE = (
+    "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! "
+    "filesink location={{output_file}} "
+    "d.audio_0 ! queue ! decodebin ! audioconvert ! avenc_aac ! mux.audio_0 "
+    "d.video_0 ! queue ! decodebin ! x264enc bitrate=1024 ! {{progress}} ! "
+    "h264parse ! mux.video_0"
+)
+
+
+def test_replaces_muxer_and_sink():
+    pipeline = hls_pipeline(PIPELINE)
+    assert "mp4mux" not in pipeline
+    assert "filesink" not in pipeline
+    assert f"hlssink2 name=mux target-duration={HLS_TARGET_DURATION}" in pipeline
+    assert "location={{segment_location}}" in pipeline
+    assert "playlist-location={{playlist_location}}" in pipeline
+
+
+def test_links_to_the_sink_pads():
+    pipeline = hls_pipeline(PIPELINE)
+    assert "! mux.audio " in pipeline
+    assert pipeline.endswith("! mux.video")
+    assert "mux.audio_0" not in pipeline and "mux.video_0" not in pipeline
+
+
+def test_keeps_the_encoders():
+    pipeline = hls_pipeline(PIPELINE)
+    assert "avenc_aac ! mux.audio" in pipeline
+    assert "x264enc bitrate=1024 ! {{progress}} ! h264parse" in pipeline
+
+
+def test_rejects_pipelines_without_a_muxed_file():
+    with pytest.raises(FailedToParsePipeline):
+        hls_pipeline("filesrc location={{input_file}} ! fakesink")
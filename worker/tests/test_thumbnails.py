@@ -0,0 +1,68 @@
+from PIL import Image
+from thumbnails import (
+    SPRITE_INDEX_NAME,
+    build_sprites,
+    thumbnail_pipeline,
+    vtt_timestamp,
+)
+
+TRANSCODE = (
+    "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! "
+    "filesink location={{output_file}} "
+    "d.video_0 ! queue ! decodebin ! videoscale ! video/x-raw,width=1280,height=720 ! "
+    "x264enc bitrate=1024 ! {{progress}} ! h264parse ! mux.video_0"
+)
+REMUX = (
+    "filesrc location={{input_file}} ! qtdemux name=d mp4mux name=mux ! "
+    "filesink location={{output_file}} "
+    "d.video_0 ! queue ! h264parse ! {{progress}} ! mux.video_0"
+)
+
+
+def test_tees_the_frames_the_encoder_decodes():
+    pipeline = thumbnail_pipeline(TRANSCODE, 10)
+    assert "tee name=thumbtee ! queue ! x264enc bitrate=1024" in pipeline
+    assert "thumbtee. ! queue ! videorate ! video/x-raw,framerate=1/10" in pipeline
+    assert pipeline.endswith("multifilesink location={{thumbnail_location}}")
+    # The encode itself is unchanged
+    assert "x264enc bitrate=1024 ! {{progress}} ! h264parse ! mux.video_0" in pipeline
+
+
+def test_decodes_remuxed_video_for_thumbnails():
+    pipeline = thumbnail_pipeline(REMUX, 5)
+    assert "h264parse ! tee name=thumbtee ! queue ! {{progress}}" in pipeline
+    assert "thumbtee. ! queue ! decodebin ! queue ! videorate" in pipeline
+    assert "framerate=1/5" in pipeline
+
+
+def test_pipelines_without_video():
+    audio_only = (
+        "filesrc location={{input_file}} ! qtdemux name=d "
+        "d.audio_0 ! decodebin ! audioconvert ! avenc_aac ! mp4mux ! "
+        "filesink location={{output_file}}"
+    )
+    assert thumbnail_pipeline(audio_only, 10) is None
+
+
+def test_vtt_timestamp():
+    assert vtt_timestamp(0) == "00:00:00.000"
+    assert vtt_timestamp(3725.5) == "01:02:05.500"
+
+
+def test_build_sprites(tmp_path):
+    thumbnails = []
+    for i in range(3):
+        path = tmp_path / f"thumb_{i:05d}.jpg"
+        Image.new("RGB", (16, 9)).save(path)
+        thumbnails.append(str(path))
+
+    paths = build_sprites(thumbnails, str(tmp_path), 10, duration_seconds=25)
+    assert paths == [
+        str(tmp_path / "sprite_000.jpg"),
+        str(tmp_path / SPRITE_INDEX_NAME),
+    ]
+    with Image.open(paths[0]) as sheet:
+        assert sheet.size == (48, 9)
+    index = (tmp_path / SPRITE_INDEX_NAME).read_text()
+    assert index.startswith("WEBVTT")
+    assert "00:00:20.000 --> 00:00:25.000\nsprite_000.jpg#xywh=32,0,16,9" in index
@@ -0,0 +1,166 @@
+import glob
+import logging
+import os
+import posixpath
+import re
+from typing import Callable, List, Optional
+
+from distributed_transcoder_common import Storage
+from PIL import Image
+
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_PATTERN = "thumb_%05d.jpg"
+# Thumbnails per sprite sheet, a long source gets several sheets
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+SPRITE_PATTERN = "sprite_{:03d}.jpg"
+SPRITE_INDEX_NAME = "thumbnails.vtt"
+JPEG_QUALITY = 80
+
+# Matches the video encoder of a transcode pipeline, the decoded frames it consumes are
+# the ones thumbnails are taken from
+VIDEO_ENCODER_PATTERN = re.compile(
+    r"\b(?:x264enc|x265enc|openh264enc|vp8enc|vp9enc|av1enc|svtav1enc|rav1enc"
+    r"|nvh264enc|nvh265enc|vaapih264enc|vaapih265enc)\b"
+)
+# Matches the video parser of a remux pipeline, whose video is never decoded
+VIDEO_PARSER_PATTERN = re.compile(r"\b(?:h264parse|h265parse|vp9parse)\b")
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_s3_prefix(output_s3_path: str) -> str:
+    return f"{posixpath.splitext(output_s3_path)[0]}_thumbnails"
+
+
+def thumbnail_branch(interval_seconds: int) -> str:
+    return (
+        f"queue ! videorate ! video/x-raw,framerate=1/{interval_seconds} ! "
+        f"videoconvert ! videoscale ! "
+        f"video/x-raw,width={THUMBNAIL_WIDTH},pixel-aspect-ratio=1/1 ! "
+        f"jpegenc quality={JPEG_QUALITY} ! "
+        "multifilesink location={{thumbnail_location}}"
+    )
+
+
+def thumbnail_pipeline(transcode_options: str, interval_seconds: int) -> Optional[str]:
+    """
+    Rewrite a pipeline template so that it also writes a thumbnail every interval, from
+    a tee of the frames the encoder is already decoding.
+
+    :param transcode_options: The GStreamer pipeline template.
+    :param interval_seconds: The time between thumbnails.
+    :return: The pipeline template with a thumbnail branch writing to
+        {{thumbnail_location}}, or None if it has no video stream to branch off.
+    """
+    match = VIDEO_ENCODER_PATTERN.search(transcode_options)
+    if match is not None:
+        head, tail = (
+            transcode_options[: match.start()],
+            transcode_options[match.start() :],
+        )
+        return (
+            f"{head}tee name=thumbtee ! queue ! {tail} "
+            f"thumbtee. ! {thumbnail_branch(interval_seconds)}"
+        )
+    # Remuxed video isn't decoded, so the thumbnail branch needs a decoder of its own
+    match = VIDEO_PARSER_PATTERN.search(transcode_options)
+    if match is not None:
+        head, tail = transcode_options[: match.end()], transcode_options[match.end() :]
+        return (
+            f"{head} ! tee name=thumbtee ! queue{tail} "
+            f"thumbtee. ! queue ! decodebin ! {thumbnail_branch(interval_seconds)}"
+        )
+    return None
+
+
+def vtt_timestamp(seconds: float) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
+
+
+def build_sprites(
+    thumbnails: List[str],
+    output_dir: str,
+    interval_seconds: int,
+    duration_seconds: Optional[float] = None,
+) -> List[str]:
+    """
+    Tile thumbnails into sprite sheets and write a WebVTT index mapping each interval of
+    the source to its tile, as used by player scrub bars.
+
+    :param thumbnails: The thumbnails in order, one per interval from the start.
+    :param output_dir: Where to write the sprite sheets and index.
+    :param interval_seconds: The time between thumbnails.
+    :param duration_seconds: The duration of the source, which the last cue ends at.
+    :return: The paths of the sprite sheets followed by the index.
+    """
+    with Image.open(thumbnails[0]) as first:
+        width, height = first.size
+    per_sheet = SPRITE_COLUMNS * SPRITE_ROWS
+    sprites = []
+    cues = ["WEBVTT", ""]
+    for sheet_index, sheet_start in enumerate(range(0, len(thumbnails), per_sheet)):
+        tiles = thumbnails[sheet_start : sheet_start + per_sheet]
+        rows = (len(tiles) + SPRITE_COLUMNS - 1) // SPRITE_COLUMNS
+        sheet = Image.new(
+            "RGB", (width * min(len(tiles), SPRITE_COLUMNS), height * rows)
+        )
+        sprite_name = SPRITE_PATTERN.format(sheet_index)
+        for tile_index, thumbnail in enumerate(tiles):
+            x = (tile_index % SPRITE_COLUMNS) * width
+            y = (tile_index // SPRITE_COLUMNS) * height
+            with Image.open(thumbnail) as image:
+                sheet.paste(image, (x, y))
+
+            start = (sheet_start + tile_index) * interval_seconds
+            end = start + interval_seconds
+            if duration_seconds is not None and start < duration_seconds:
+                end = min(end, duration_seconds)
+            cues += [
+                f"{vtt_timestamp(start)} --> {vtt_timestamp(end)}",
+                f"{sprite_name}#xywh={x},{y},{width},{height}",
+                "",
+            ]
+        sprite_path = os.path.join(output_dir, sprite_name)
+        sheet.save(sprite_path, quality=JPEG_QUALITY)
+        sprites.append(sprite_path)
+
+    index_path = os.path.join(output_dir, SPRITE_INDEX_NAME)
+    with open(index_path, "w") as f:
+        f.write("\n".join(cues))
+    return sprites + [index_path]
+
+
+def upload_thumbnails(
+    storage: Storage,
+    thumbnail_dir: str,
+    output_s3_path: str,
+    interval_seconds: int,
+    duration_seconds: Optional[float] = None,
+    transfer_callback: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Upload the thumbnails a pipeline wrote, along with their sprite sheets and index,
+    under a prefix next to the job's output.
+
+    :return: The number of thumbnails uploaded.
+    """
+    thumbnails = sorted(glob.glob(os.path.join(thumbnail_dir, "thumb_*.jpg")))
+    if not thumbnails:
+        logger.warning("The pipeline didn't write any thumbnails")
+        return 0
+    s3_prefix = thumbnail_s3_prefix(output_s3_path)
+    sprites = build_sprites(
+        thumbnails, thumbnail_dir, interval_seconds, duration_seconds
+    )
+    for path in thumbnails + sprites:
+        storage.upload(
+            path,
+            posixpath.join(s3_prefix, os.path.basename(path)),
+            content_type="text/vtt" if path.endswith(".vtt") else "image/jpeg",
+            callback=transfer_callback,
+        )
+    logger.info(f"Uploaded {len(thumbnails)} thumbnails to {s3_prefix}")
+    return len(thumbnails)
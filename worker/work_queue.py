@@ -1,6 +1,6 @@
 import logging
 import time
-from typing import Tuple
+from typing import List, Tuple
 
 import pika
 from pika.adapters.blocking_connection import BlockingChannel, BlockingConnection
@@ -40,6 +40,37 @@ def connect_rabbitmq(
     raise Exception("Could not connect to RabbitMQ after multiple retries.")
 
 
+def retry_queue_name(job_queue_name: str, delay_seconds: int) -> str:
+    return f"{job_queue_name}.retry.{delay_seconds}s"
+
+
+def dead_letter_queue_name(job_queue_name: str) -> str:
+    return f"{job_queue_name}.dead"
+
+
+def declare_retry_queues(
+    channel: BlockingChannel, job_queue_name: str, retry_delays: List[int]
+):
+    """
+    Declare a delay queue per backoff step, which hands messages back to the job queue
+    once they expire, and a dead letter queue for jobs that ran out of attempts.
+
+    :param channel: The channel to declare the queues on.
+    :param job_queue_name: The name of the job queue.
+    :param retry_delays: The delay in seconds before each retry.
+    """
+    for delay in retry_delays:
+        channel.queue_declare(
+            queue=retry_queue_name(job_queue_name, delay),
+            arguments={
+                "x-message-ttl": delay * 1000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": job_queue_name,
+            },
+        )
+    channel.queue_declare(queue=dead_letter_queue_name(job_queue_name))
+
+
 def init_channels(
     rabbitmq_host: str,
     rabbitmq_port: int,
@@ -47,6 +78,7 @@ def init_channels(
     job_queue_name: str,
     progress_queue_name: str,
     results_queue_name: str,
+    retry_delays: List[int],
 ) -> Tuple[BlockingChannel, BlockingConnection]:
     """
     Initialize the channels for the worker.
@@ -60,6 +92,8 @@ def init_channels(
 
     # Initialize a standard queue for jobs
     channel.queue_declare(queue=job_queue_name)
+    # Initialize the queues jobs wait in before being retried
+    declare_retry_queues(channel, job_queue_name, retry_delays)
 
     # Initialize a topic exchange for progress logs
     channel.exchange_declare(exchange="progress_logs", exchange_type="topic")
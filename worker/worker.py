@@ -1,64 +1,160 @@
+import time
+
+# Taken before anything else is imported, so that the startup timings include imports
+STARTED_AT = time.perf_counter()
+
 import asyncio
-from datetime import datetime
-import json
 import logging
 import os
 import random
+import signal
 import string
 import tempfile
 import threading
-import time
-from dataclasses import asdict
-from typing import Tuple
+from dataclasses import replace
+from multiprocessing.connection import Connection
+from typing import Dict, Optional, Tuple
 
-import boto3
 import gi
 import pika
-from botocore.exceptions import ClientError
 from distributed_transcoder_common import (
+    CONTENT_TYPE_JSON,
     JobProgressMessage,
     JobResultMessage,
     JobSubmissionMessage,
+    JobTransitionReplyMessage,
+    MediaInfoMessage,
+    MessageDecodeError,
+    StorageError,
+    decode_message,
+    encode_message,
+    init_tracing,
+    published_at,
+    record_span,
+    shutdown_tracing,
+    span,
+    storage_from_env,
+    trace_headers,
+)
+from distributed_transcoder_common.models import Job, MediaInfo
+from checkpoint import (
+    CheckpointUploader,
+    checkpoint_pipeline,
+    concat_pipeline,
+    empty_manifest,
+    load_manifest,
+    segment_pattern,
+    supports_checkpointing,
 )
-from distributed_transcoder_common.models import Job, Preset
+from control import Cancellation, ControlListener
 from errors import (
     FailedMidTranscode,
     FailedToParsePipeline,
     FailedToPlay,
+    JobCancelled,
     PipelineTimeout,
     TranscodeException,
 )
+from hls import PACKAGING_HLS, HlsUploader, hls_pipeline
+from job_state import JobStateClient, JobStateUnavailable
+from probe import matches_target, probe, remux_pipeline
+from progress import ProgressEstimator
+from scratch import ScratchManager, ScratchReservation, estimate_scratch_bytes
+from startup import StartupTimer
+from thumbnails import THUMBNAIL_PATTERN, thumbnail_pipeline, upload_thumbnails
 from pika.channel import Channel
 from pika.spec import Basic, BasicProperties
-from tortoise import Tortoise
-from work_queue import init_channels
+from work_queue import dead_letter_queue_name, init_channels, retry_queue_name
 
 gi.require_version("Gst", "1.0")
 from gi.repository import GLib, Gst
 
-# Constants
-# S3 Config
-S3_ACCESS_KEY_ID = os.environ["S3_ACCESS_KEY_ID"]
-S3_SECRET_ACCESS_KEY = os.environ["S3_SECRET_ACCESS_KEY"]
-S3_BUCKET_NAME = os.environ["S3_BUCKET_NAME"]
-S3_ENDPOINT_URL = os.environ["S3_ENDPOINT_URL"]
+startup = StartupTimer(STARTED_AT)
+startup.mark("imports")
 
+# Constants
 # Worker Lifecycle Config
 TIMEOUT_SECONDS = 60  # 1 minute
+# How long a shutting down worker gets to finish its job before requeueing it, this
+# must leave time to upload checkpoints within the pod's termination grace period
+DRAIN_TIMEOUT_SECONDS = int(os.environ.get("DRAIN_TIMEOUT_SECONDS", "240"))
+# Length of the segments completed encodes are checkpointed in, 0 disables checkpointing
+CHECKPOINT_SEGMENT_SECONDS = int(os.environ.get("CHECKPOINT_SEGMENT_SECONDS", "60"))
+# How often pipelines report progress
+PROGRESS_INTERVAL_SECONDS = 10
+# Errors worth another attempt, after waiting out the backoff for that attempt
+TRANSIENT_ERROR_TYPES = ("s3_download", "s3_upload", "pipeline_timeout")
+RETRY_DELAYS_SECONDS = [10, 60, 300]
+
+# Scratch Space Config
+# Jobs whose estimated scratch space fits within the memory budget run on tmpfs
+SCRATCH_MEMORY_DIR = os.environ.get("SCRATCH_MEMORY_DIR", "/dev/shm")
+SCRATCH_MEMORY_BUDGET_MB = int(os.environ.get("SCRATCH_MEMORY_BUDGET_MB", "0"))
+SCRATCH_DISK_DIR = os.environ.get("SCRATCH_DISK_DIR", tempfile.gettempdir())
+# Free space to leave on the disk for everything other than jobs
+SCRATCH_DISK_MIN_FREE_MB = int(os.environ.get("SCRATCH_DISK_MIN_FREE_MB", "512"))
+# Jobs that don't fit right now are handed back to the queue for this long
+SCRATCH_DEFER_SECONDS = RETRY_DELAYS_SECONDS[0]
+
+# Simulation Config
+# "simulate" fakes transcodes instead of running GStreamer, for load testing the API,
+# RabbitMQ and Postgres without paying for encodes
+TRANSCODE_MODE = os.environ.get("TRANSCODE_MODE", "gstreamer")
+TRANSCODE_MODE_SIMULATE = "simulate"
+# Simulated transcodes take the source's probed duration, or this default, divided by
+# the speed as a multiple of realtime
+SIMULATED_SOURCE_SECONDS = float(os.environ.get("SIMULATED_SOURCE_SECONDS", "60"))
+SIMULATED_SPEED = float(os.environ.get("SIMULATED_SPEED", "2"))
+# Share of simulated transcodes that fail, to exercise error handling
+SIMULATED_FAILURE_RATE = float(os.environ.get("SIMULATED_FAILURE_RATE", "0"))
+
+# Messaging Config
+# Encoding of published messages, see the API's setting of the same name
+MESSAGE_CONTENT_TYPE = os.environ.get("MESSAGE_CONTENT_TYPE", CONTENT_TYPE_JSON)
+MESSAGE_PROPERTIES = (
+    BasicProperties(content_type=CONTENT_TYPE_JSON, content_encoding="utf-8")
+    if MESSAGE_CONTENT_TYPE == CONTENT_TYPE_JSON
+    else BasicProperties(content_type=MESSAGE_CONTENT_TYPE)
+)
+
+
+def traced_properties() -> BasicProperties:
+    "Properties of a message which continues the current span's trace."
+    return BasicProperties(
+        content_type=MESSAGE_PROPERTIES.content_type,
+        content_encoding=MESSAGE_PROPERTIES.content_encoding,
+        headers=trace_headers(),
+    )
+
+
+# Warm Pool Config
+# Messages between the supervisor and the worker processes of its pool, see supervisor.py
+POOL_READY = "ready"
+POOL_BUSY = "busy"
+POOL_IDLE = "idle"
+POOL_ACTIVATE = "activate"
+
+
+def new_worker_id() -> str:
+    "Generate a random 5-character worker ID."
+    return "".join(random.choices(string.ascii_lowercase + string.digits, k=5))
 
-# DB Config
-POSTGRES_USER = os.environ["POSTGRES_USER"]
-POSTGRES_PASSWORD = os.environ["POSTGRES_PASSWORD"]
-POSTGRES_DB = os.environ["POSTGRES_DB"]
-POSTGRES_HOST = os.environ["POSTGRES_HOST"]
 
-# Generate a random 5-character worker ID
-worker_id = "".join(random.choices(string.ascii_lowercase + string.digits, k=5))
+def log_format(worker_id: str) -> str:
+    return f"%(asctime)s |{worker_id}| (%(name)s) [%(levelname)s]: %(message)s"
+
+
+worker_id = new_worker_id()
 
 # RabbitMQ Config
 JOB_QUEUE_NAME = f"transcoding_jobs"
 PROGRESS_QUEUE_NAME = f"transcoding_progress.{worker_id}"
 RESULTS_QUEUE_NAME = f"transcoding_results.{worker_id}"
+CONTROL_EXCHANGE_NAME = "job_control"
+# Workers ask the API to claim and release jobs on this queue rather than holding
+# database connections, see the API's transitions module
+JOB_TRANSITIONS_QUEUE_NAME = "job_transitions"
+MEDIA_INFO_QUEUE_NAME = "media_info"
 RMQ_HOST = os.environ["RMQ_HOST"]
 RMQ_PORT = int(os.environ["RMQ_PORT"])
 RMQ_USER = os.environ["RMQ_USER"]
@@ -67,7 +163,7 @@ RMQ_PASSWORD = os.environ["RMQ_PASSWORD"]
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
-    format=f"%(asctime)s |{worker_id}| (%(name)s) [%(levelname)s]: %(message)s",
+    format=log_format(worker_id),
     handlers=[logging.StreamHandler()],
 )
 logger = logging.getLogger(__name__)
@@ -79,44 +175,99 @@ for log_name, log_level in [
 ]:
     logging.getLogger(log_name).setLevel(log_level)
 
-# Set up S3 client
-s3_client = boto3.client(
-    service_name="s3",
-    aws_access_key_id=S3_ACCESS_KEY_ID,
-    aws_secret_access_key=S3_SECRET_ACCESS_KEY,
-    endpoint_url=S3_ENDPOINT_URL,
+# Set up the storage backend inputs and outputs live in
+storage = storage_from_env()
+startup.mark("storage")
+
+
+scratch_manager = ScratchManager(
+    SCRATCH_MEMORY_DIR,
+    SCRATCH_MEMORY_BUDGET_MB * 1_000_000,
+    SCRATCH_DISK_DIR,
+    SCRATCH_DISK_MIN_FREE_MB * 1_000_000,
 )
 
 
-# Run an async task to connect to Tortoise
-async def connect_tortoise():
+# Moves jobs between states through the API, started in main()
+job_state: JobStateClient = None
+# Listens for cancellations of the running job, started in main()
+control_listener: ControlListener = None
+# The cancellation state of the running job, if any
+current_cancellation: Optional[Cancellation] = None
+# Set once the worker has been asked to shut down
+draining = threading.Event()
+# The pipe to the supervisor, when the worker is one of the processes of its pool
+supervisor_pipe: Optional[Connection] = None
+
+
+def assign_worker_id(new_id: str):
     """
-    Connect to the Tortoise database.
+    Take on a worker ID, along with the queue names and log prefix that go with it.
+    Processes forked by the supervisor each take on one of their own.
     """
-    await Tortoise.init(
-        db_url=f"postgres://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:5432/{POSTGRES_DB}",
-        modules={"models": ["distributed_transcoder_common.models"]},
-    )
+    global worker_id, PROGRESS_QUEUE_NAME, RESULTS_QUEUE_NAME
+    worker_id = new_id
+    PROGRESS_QUEUE_NAME = f"transcoding_progress.{worker_id}"
+    RESULTS_QUEUE_NAME = f"transcoding_results.{worker_id}"
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(log_format(worker_id)))
 
 
-# Start the async task in a coroutine
-asyncio.get_event_loop().run_until_complete(connect_tortoise())
+def report_to_supervisor(status: str):
+    if supervisor_pipe is not None:
+        supervisor_pipe.send(status)
+
+
+def publish_progress(
+    ch: Channel, job_id: str, percent: float, eta_seconds: Optional[float]
+):
+    """
+    Report a running job's progress to the API.
+
+    :param ch: The RabbitMQ channel to publish on.
+    :param job_id: The job's ID.
+    :param percent: How far through the job is.
+    :param eta_seconds: The seconds left at the current pace, if known.
+    """
+    logger.info("Progress: {:.1f}%".format(percent))
+    ch.basic_publish(
+        exchange="progress_logs",
+        routing_key=PROGRESS_QUEUE_NAME,
+        properties=MESSAGE_PROPERTIES,
+        body=encode_message(
+            JobProgressMessage(
+                timestamp=time.time(),
+                worker_id=worker_id,
+                job_id=job_id,
+                progress=round(percent, 4),
+                eta_seconds=round(eta_seconds, 1) if eta_seconds is not None else None,
+            ),
+            MESSAGE_CONTENT_TYPE,
+        ),
+    )
 
 
 def on_gst_message(
     bus: Gst.Bus,
     message: Gst.Message,
-    data: Tuple[GLib.MainLoop, Gst.Pipeline, Channel, str],
+    data: Tuple[
+        GLib.MainLoop,
+        Gst.Pipeline,
+        Channel,
+        str,
+        Optional[CheckpointUploader],
+        ProgressEstimator,
+    ],
 ) -> bool:
     """
     Handle messages received from the GStreamer pipeline.
 
     :param bus: The GStreamer bus that received the message.
     :param message: The GStreamer message.
-    :param data: A tuple containing the GLib main loop, the GStreamer pipeline, the progress channel, and the job ID.
+    :param data: A tuple containing the GLib main loop, the GStreamer pipeline, the progress channel, the job ID, the checkpoint uploader if the job is checkpointed, and the progress estimator.
     :return: True if the message was handled successfully.
     """
-    loop, pipeline, ch, job_id = data
+    loop, pipeline, ch, job_id, checkpoint, estimator = data
     message_type = message.type
     global last_progress_time
     global transcoding_error
@@ -124,7 +275,10 @@ def on_gst_message(
         error, debug = message.parse_error()
         logger.error("Error received: %s" % error)
         logger.error("Debug info: %s" % debug)
-        transcoding_error = f"Error received from Pipeline Execution: {error}"
+        transcoding_error = (
+            "mid_transcode",
+            f"Error received from Pipeline Execution: {error}",
+        )
         loop.quit()
     elif message_type == Gst.MessageType.EOS:
         logger.info("End of stream")
@@ -141,27 +295,21 @@ def on_gst_message(
     if message_type == Gst.MessageType.ELEMENT:
         structure = message.get_structure()
         if structure and structure.get_name() == "progress":
-            percent: float = structure.get_double("percent-double")[1]
-            logger.info("Progress: {:.1f}%".format(percent))
-            ch.basic_publish(
-                exchange="progress_logs",
-                routing_key=PROGRESS_QUEUE_NAME,
-                properties=BasicProperties(
-                    content_type="application/json",
-                    content_encoding="utf-8",
-                ),
-                body=json.dumps(
-                    asdict(
-                        JobProgressMessage(
-                            timestamp=time.time(),
-                            worker_id=worker_id,
-                            job_id=job_id,
-                            progress=round(percent, 4),
-                        )
-                    )
-                ),
+            ok, position = pipeline.query_position(Gst.Format.TIME)
+            percent, eta_seconds = estimator.update(
+                position if ok else None, structure.get_double("percent-double")[1]
             )
+            publish_progress(ch, job_id, percent, eta_seconds)
             last_progress_time = time.time()
+        elif (
+            structure
+            and structure.get_name() == "splitmuxsink-fragment-closed"
+            and checkpoint is not None
+        ):
+            checkpoint.segment_closed(
+                structure.get_string("location"),
+                structure.get_uint64("running-time")[1],
+            )
     else:
         logger.debug("Unexpected message: %s" % message_type)
 
@@ -192,6 +340,9 @@ def transcode(
     transcode_options: str,
     ch: Channel,
     job_id: str,
+    cancellation: Optional[Cancellation] = None,
+    checkpoint: Optional[CheckpointUploader] = None,
+    duration_ns: Optional[int] = None,
 ) -> str:
     """
     Transcode the input file to the output file using the specified transcode options and report progress to the channel.
@@ -201,6 +352,9 @@ def transcode(
     :param transcode_options: The GStreamer transcoding options.
     :param ch: The RabbitMQ channel for reporting progress.
     :param job_id: The unique identifier for the transcoding job.
+    :param cancellation: The job's cancellation state, the pipeline stops as soon as the job is cancelled.
+    :param checkpoint: The uploader for checkpointed segments, if the job is checkpointed. The transcode resumes after its last segment.
+    :param duration_ns: The probed duration of the source, which progress and ETA are computed from.
     :return: The path to the output file if successful, None otherwise.
     """
     loop = GLib.MainLoop()
@@ -208,7 +362,10 @@ def transcode(
     pipeline_str = (
         transcode_options.replace("{{output_file}}", output_file)
         .replace("{{input_file}}", input_file)
-        .replace("{{progress}}", "progressreport update-freq=10 silent=true")
+        .replace(
+            "{{progress}}",
+            f"progressreport update-freq={PROGRESS_INTERVAL_SECONDS} silent=true",
+        )
     )
 
     logger.info(f"Starting transcoding with options: {pipeline_str}")
@@ -221,7 +378,26 @@ def transcode(
 
     bus = pipeline.get_bus()
     bus.add_signal_watch()
-    bus.connect("message", on_gst_message, (loop, pipeline, ch, job_id))
+    bus.connect(
+        "message",
+        on_gst_message,
+        (loop, pipeline, ch, job_id, checkpoint, ProgressEstimator(duration_ns)),
+    )
+
+    if checkpoint is not None and checkpoint.resume_position_ns > 0:
+        # Preroll, then skip the part of the source that earlier attempts already encoded
+        logger.info(
+            f"Resuming job {job_id} from {checkpoint.resume_position_ns / Gst.SECOND:.1f}s"
+        )
+        pipeline.set_state(Gst.State.PAUSED)
+        pipeline.get_state(10 * Gst.SECOND)
+        if not pipeline.seek_simple(
+            Gst.Format.TIME,
+            Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+            checkpoint.resume_position_ns,
+        ):
+            pipeline.set_state(Gst.State.NULL)
+            raise FailedToPlay("Unable to seek to the last checkpoint.")
 
     # Initialize global variables for mid-transcode error handling
     global last_progress_time, transcoding_error, job_finished
@@ -234,10 +410,28 @@ def transcode(
     )
     timeout_checker.start()
 
+    def stop_pipeline() -> bool:
+        pipeline.set_state(Gst.State.NULL)
+        loop.quit()
+        return False
+
+    def cancel(reason: str):
+        global transcoding_error
+        transcoding_error = ("cancelled", f"Job cancelled: {reason}")
+        # Stop from the main loop, which also catches cancellations that land before it runs
+        GLib.idle_add(stop_pipeline)
+
+    if cancellation is not None:
+        cancellation.on_cancel(cancel)
+
     # Set the pipeline to the playing state
     ret = pipeline.set_state(Gst.State.PLAYING)
     if ret == Gst.StateChangeReturn.FAILURE:
         logger.error("Unable to set the pipeline to the playing state.")
+        if cancellation is not None:
+            cancellation.remove(cancel)
+        pipeline.set_state(Gst.State.NULL)
+        job_finished = True
         raise FailedToPlay("Unable to set the pipeline to the playing state.")
 
     # Start the GLib main loop
@@ -247,27 +441,263 @@ def transcode(
         logger.error(f"An error occurred while running the main loop: {e}")
         raise FailedMidTranscode(e)
     finally:
+        if cancellation is not None:
+            cancellation.remove(cancel)
         pipeline.set_state(Gst.State.NULL)
         job_finished = True
     if transcoding_error[0] is not None:
         error_type, error_msg = transcoding_error
         if error_type == "pipeline_timeout":
             raise PipelineTimeout(error_msg)
+        elif error_type == "cancelled":
+            raise JobCancelled(error_msg)
         else:
             raise FailedMidTranscode(error_msg)
 
     return output_file
 
 
-async def handle_transcode_exception(
+def remux_segments(transcode_options: str, segments_dir: str, output_file: str):
+    """
+    Join checkpointed segments into the job's output file without re-encoding them.
+
+    :param transcode_options: The job's original pipeline template.
+    :param segments_dir: The directory holding every segment.
+    :param output_file: The path to the output file.
+    """
+    pipeline_str = concat_pipeline(transcode_options, segments_dir, output_file)
+    logger.info(f"Joining checkpointed segments with: {pipeline_str}")
+    try:
+        pipeline = Gst.parse_launch(pipeline_str)
+    except GLib.Error as e:
+        raise FailedToParsePipeline(e)
+
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        pipeline.set_state(Gst.State.NULL)
+        raise FailedToPlay("Unable to set the segment joining pipeline to playing.")
+    message = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS
+    )
+    pipeline.set_state(Gst.State.NULL)
+    if message.type == Gst.MessageType.ERROR:
+        error, debug = message.parse_error()
+        raise FailedMidTranscode(f"Unable to join checkpointed segments: {error}")
+
+
+def source_media(s3_path: str, claim: JobTransitionReplyMessage) -> Optional[MediaInfo]:
+    """
+    The probed properties of a job's source the API sent along with its claim, if the
+    source has been probed before.
+    """
+    if claim.media is None:
+        return None
+    return MediaInfo(s3_path=s3_path, **claim.media)
+
+
+async def probe_source(
+    ch: Channel, s3_path: str, input_file: str, claim: JobTransitionReplyMessage
+) -> Optional[MediaInfo]:
+    """
+    Look up the probed properties of a source, probing it if it hasn't been probed
+    since it was last uploaded. Fresh probes are published for the API to record.
+
+    :param ch: The RabbitMQ channel to publish fresh probes on.
+    :param s3_path: The S3 path the source was downloaded from.
+    :param input_file: The path of the downloaded source.
+    :param claim: The API's answer to the job's claim.
+    :return: The source's properties, or None if it can't be probed.
+    """
+    media = source_media(s3_path, claim)
+    if media is not None and media.size == os.path.getsize(input_file):
+        return media
+    probe_start = time.time()
+    try:
+        fields = probe(input_file)
+    except GLib.Error as e:
+        logger.error(f"Unable to probe {s3_path}: {e}")
+        return None
+    ch.basic_publish(
+        exchange="",
+        routing_key=MEDIA_INFO_QUEUE_NAME,
+        properties=MESSAGE_PROPERTIES,
+        body=encode_message(
+            MediaInfoMessage(s3_path=s3_path, media=fields), MESSAGE_CONTENT_TYPE
+        ),
+    )
+    logger.info(f"Probed {s3_path} in {time.time() - probe_start:.2f} seconds")
+    return MediaInfo(s3_path=s3_path, **fields)
+
+
+async def save_checkpoint(job_id: str, manifest: Optional[Dict]):
+    """
+    Record the manifest of a job's checkpointed segments on the job. The manifest is
+    also kept next to the segments, which later attempts fall back on if this fails.
+
+    :param job_id: The job the segments belong to.
+    :param manifest: The manifest, or None to clear it once the job is done.
+    """
+    try:
+        job_state.checkpoint(job_id, manifest)
+    except JobStateUnavailable as e:
+        logger.error(f"Unable to record the checkpoint of job {job_id}: {e}")
+
+
+def release_job(
+    job_id: str,
+    state: str,
+    error: Optional[str] = None,
+    error_type: Optional[str] = None,
+):
+    """
+    Hand a claimed job back in a state another worker can claim it from, before its
+    message is handed back to the queue.
+    """
+    try:
+        job_state.release(job_id, state, error=error, error_type=error_type)
+    except JobStateUnavailable as e:
+        # The API requeues it once it notices that the job stopped making progress
+        logger.error(f"Unable to release job {job_id}: {e}")
+
+
+async def fail_job(
     ch: Channel,
     method: Basic.Deliver,
-    e: TranscodeException,
-    job_id: str,
+    job_data: JobSubmissionMessage,
+    error: str,
+    error_type: str,
 ):
+    """
+    Report a failed attempt at a job, requeueing it after a backoff if the error was
+    transient and it has attempts left. Jobs that run out of attempts are dead-lettered.
+    """
+    if error_type in TRANSIENT_ERROR_TYPES and not job_data.speculative:
+        body = encode_message(
+            replace(job_data, attempt=job_data.attempt + 1), MESSAGE_CONTENT_TYPE
+        )
+        if job_data.attempt < len(RETRY_DELAYS_SECONDS):
+            delay = RETRY_DELAYS_SECONDS[job_data.attempt]
+            logger.info(
+                f"Job {job_data.job_id} failed with {error_type}, retrying in {delay} seconds"
+            )
+            release_job(
+                job_data.job_id, Job.STATE_RETRYING, error=error, error_type=error_type
+            )
+            ch.basic_publish(
+                exchange="",
+                routing_key=retry_queue_name(JOB_QUEUE_NAME, delay),
+                properties=traced_properties(),
+                body=body,
+            )
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        logger.error(f"Job {job_data.job_id} ran out of attempts, dead-lettering it")
+        ch.basic_publish(
+            exchange="",
+            routing_key=dead_letter_queue_name(JOB_QUEUE_NAME),
+            properties=traced_properties(),
+            body=body,
+        )
     await send_transcode_result(
-        ch, method, Job.STATE_FAILED, job_id, error=str(e), error_type=e.error_type
+        ch,
+        method,
+        Job.STATE_FAILED,
+        job_data.job_id,
+        error=error,
+        error_type=error_type,
+        speculative=job_data.speculative,
+    )
+
+
+async def requeue_job(
+    ch: Channel,
+    method: Basic.Deliver,
+    job_data: JobSubmissionMessage,
+    reason: str,
+    delay_seconds: Optional[int] = None,
+):
+    """
+    Hand an interrupted job back to the queue, to resume from its checkpoint on another
+    worker. Speculative copies are dropped, as the original attempt is still running.
+
+    :param delay_seconds: How long to hold the job back for, this must be one of the
+        retry delays. The job is requeued immediately if unset.
+    """
+    if job_data.speculative:
+        logger.info(f"Dropping speculative copy of job {job_data.job_id}: {reason}")
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
+    logger.info(f"Requeueing job {job_data.job_id}: {reason}")
+    # Release the claim first so the next worker doesn't skip it as in progress
+    release_job(job_data.job_id, Job.STATE_QUEUED)
+    if delay_seconds is None:
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        return
+    # Deferring isn't a failed attempt, so the attempt count stays the same
+    ch.basic_publish(
+        exchange="",
+        routing_key=retry_queue_name(JOB_QUEUE_NAME, delay_seconds),
+        properties=traced_properties(),
+        body=encode_message(job_data, MESSAGE_CONTENT_TYPE),
     )
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+async def reserve_scratch(
+    ch: Channel,
+    method: Basic.Deliver,
+    job_data: JobSubmissionMessage,
+    claim: JobTransitionReplyMessage,
+) -> Optional[ScratchReservation]:
+    """
+    Reserve scratch space for a job before downloading anything. Jobs that don't fit
+    right now are deferred, and jobs that could never fit on this worker are failed.
+
+    :return: The reservation, or None if the job was deferred or failed.
+    """
+    try:
+        input_size = storage.head(job_data.input_s3_path).size
+    except StorageError as e:
+        logger.error(f"Unable to look up input chunk: {e}")
+        await fail_job(ch, method, job_data, str(e), "s3_download")
+        return None
+    # Sources probed by an earlier job give a better estimate of the output size
+    media = source_media(job_data.input_s3_path, claim)
+    size = estimate_scratch_bytes(
+        input_size,
+        media.duration_ns if media is not None and media.size == input_size else None,
+        job_data.target,
+        in_place=storage.local_path(job_data.input_s3_path) is not None,
+    )
+
+    reservation = scratch_manager.reserve(job_data.job_id, size)
+    if reservation is not None:
+        return reservation
+    if not scratch_manager.fits_when_idle(size):
+        await fail_job(
+            ch,
+            method,
+            job_data,
+            f"Job needs an estimated {size} bytes of scratch space, more than this worker has",
+            "insufficient_scratch",
+        )
+        return None
+    await requeue_job(
+        ch,
+        method,
+        job_data,
+        f"not enough scratch space for an estimated {size} bytes",
+        delay_seconds=SCRATCH_DEFER_SECONDS,
+    )
+    return None
+
+
+async def handle_transcode_exception(
+    ch: Channel,
+    method: Basic.Deliver,
+    e: TranscodeException,
+    job_data: JobSubmissionMessage,
+):
+    await fail_job(ch, method, job_data, str(e), e.error_type)
 
 
 async def send_transcode_result(
@@ -278,38 +708,32 @@ async def send_transcode_result(
     output_s3_path: str = None,
     error: str = None,
     error_type: str = None,
+    speculative: bool = False,
 ):
+    """
+    Publish the result of a job for the API to record, and acknowledge its message.
+    """
     ch.basic_publish(
         exchange="results_logs",
         routing_key=RESULTS_QUEUE_NAME,
-        properties=BasicProperties(
-            content_type="application/json",
-            content_encoding="utf-8",
-        ),
-        body=json.dumps(
-            asdict(
-                JobResultMessage(
-                    job_id=job_id,
-                    status=status,
-                    timestamp=time.time(),
-                    worker_id=worker_id,
-                    output_s3_path=output_s3_path,
-                    error=error,
-                    error_type=error_type,
-                )
-            )
+        properties=traced_properties(),
+        body=encode_message(
+            JobResultMessage(
+                job_id=job_id,
+                status=status,
+                timestamp=time.time(),
+                worker_id=worker_id,
+                output_s3_path=output_s3_path,
+                error=error,
+                error_type=error_type,
+                speculative=speculative,
+                claim_token=job_state.claim_tokens.get(job_id),
+            ),
+            MESSAGE_CONTENT_TYPE,
         ),
     )
     if error:
         logger.error(f"Transcoding failed: {error_type}")
-    # Update job state in DB
-    job = await Job.get_or_none(job_id=job_id)
-    if job is not None:
-        job.state = status
-        job.error = str(error)
-        job.error_type = error_type
-        job.transcode_completed_at = datetime.now()
-        await job.save()
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
 
@@ -325,109 +749,346 @@ async def process_workqueue_message(
     :param ch: The RabbitMQ channel.
     :param method: The delivery method.
     :param properties: The message properties.
-    :param body: The message body, containing the job data as JSON.
+    :param body: The message body, containing the encoded job data.
     """
     logger.info("Received a new transcoding job")
-    job_data = JobSubmissionMessage(**json.loads(body))
+    if draining.is_set():
+        # Delivered before consumption stopped, leave it for another worker
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        return
+    try:
+        job_data = decode_message(JobSubmissionMessage, body, properties.content_type)
+    except MessageDecodeError as e:
+        logger.error(f"Discarding undecodable job message: {e}")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
 
-    # Confirm job hasn't been cancelled or already claimed
-    job = await Job.get_or_none(job_id=job_data.job_id)
+    # Continue the trace of the job's submission, or of the attempt that retried it
+    headers = properties.headers or {}
+    attributes = {
+        "job.id": job_data.job_id,
+        "job.attempt": job_data.attempt,
+        "job.speculative": job_data.speculative,
+        "worker.id": worker_id,
+    }
+    sent_at = published_at(headers)
+    if sent_at is not None:
+        record_span("queue_wait", sent_at, parent=headers, attributes=attributes)
 
-    if job is None:
-        logger.info(
-            f"Job {job_data.job_id} could not be found in the DB, skipping processing. Message body: {job_data}"
-        )
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        return
+    with span("process_job", parent=headers, attributes=attributes):
+        # Claim the job, unless it has been cancelled or already claimed
+        try:
+            with span("claim"):
+                claim = job_state.claim(job_data)
+        except JobStateUnavailable as e:
+            logger.error(f"Unable to claim job {job_data.job_id}, handing it back: {e}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
 
-    if job.state == Job.STATE_CANCELLED:
-        logger.info(f"Job {job_data.job_id} has been cancelled, skipping processing.")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        return
+        if not claim.applied:
+            if claim.state is None:
+                reason = "could not be found in the DB"
+            elif claim.state == Job.STATE_CANCELLED:
+                reason = "has been cancelled"
+            elif claim.state == Job.STATE_IN_PROGRESS:
+                reason = "is already in progress"
+            elif claim.state == Job.STATE_STALLED:
+                reason = "stalled the last time it was attempted"
+            elif job_data.speculative:
+                reason = "is no longer running, so neither is its speculative copy"
+            else:
+                reason = f"is {claim.state}"
+            logger.info(f"Job {job_data.job_id} {reason}, skipping processing.")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        if job_data.speculative:
+            # The original attempt holds the claim, race it to the finish
+            logger.info(f"Running a speculative copy of job {job_data.job_id}")
 
-    if job.state == Job.STATE_IN_PROGRESS:
-        logger.info(
-            f"Job {job_data.job_id} is already in progress, skipping processing."
-        )
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        return
+        global current_cancellation
+        cancellation = Cancellation()
+        current_cancellation = cancellation
+        control_listener.watch(job_data.job_id, cancellation.cancel)
+        try:
+            if TRANSCODE_MODE == TRANSCODE_MODE_SIMULATE:
+                await simulate_job(ch, method, claim, job_data, cancellation)
+            else:
+                await run_job(ch, method, claim, job_data, cancellation)
+        except JobCancelled as e:
+            # Scratch files are gone by now, so the slot is free for the next job
+            if cancellation.requeue:
+                await requeue_job(ch, method, job_data, str(e))
+            else:
+                logger.info(f"Job {job_data.job_id} was cancelled: {e}")
+                await send_transcode_result(
+                    ch,
+                    method,
+                    Job.STATE_CANCELLED,
+                    job_data.job_id,
+                    speculative=job_data.speculative,
+                )
+        finally:
+            control_listener.unwatch()
+            current_cancellation = None
+            job_state.forget(job_data.job_id)
 
-    if job.state == Job.STATE_STALLED:
-        logger.info(
-            f"Job {job_data.job_id} stalled the last time it was attempted, skipping processing."
+
+def add_thumbnails(
+    job_data: JobSubmissionMessage,
+    transcode_options: str,
+    thumbnail_dir: str,
+    checkpoint: Optional[CheckpointUploader],
+) -> Optional[str]:
+    """
+    Branch thumbnails off the decoded video of a job's pipeline.
+
+    :return: The rewritten pipeline, or None if thumbnails can't be taken this attempt.
+    """
+    if checkpoint is not None and checkpoint.resume_position_ns > 0:
+        # Thumbnails from before the checkpoint went with the earlier attempt's scratch
+        logger.warning(
+            f"Job {job_data.job_id} is resuming from a checkpoint, skipping thumbnails"
         )
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        return
+        return None
+    pipeline = thumbnail_pipeline(transcode_options, job_data.thumbnail_interval)
+    if pipeline is None:
+        logger.warning(
+            f"Pipeline of job {job_data.job_id} has no video to take thumbnails from"
+        )
+        return None
+    return pipeline.replace(
+        "{{thumbnail_location}}", os.path.join(thumbnail_dir, THUMBNAIL_PATTERN)
+    )
 
-    elif job.state == Job.STATE_QUEUED:
-        # Update job state to in progress
-        job.state = Job.STATE_IN_PROGRESS
-        job.transcode_started_at = datetime.now()
-        await job.save()
 
-        with tempfile.NamedTemporaryFile() as input_file, tempfile.NamedTemporaryFile() as output_file:
+async def run_job(
+    ch: Channel,
+    method: Basic.Deliver,
+    claim: JobTransitionReplyMessage,
+    job_data: JobSubmissionMessage,
+    cancellation: Cancellation,
+):
+    """
+    Download, transcode and upload a claimed job, then report its result.
+
+    :raises JobCancelled: If the job was cancelled, once its scratch files are removed.
+    """
+    reservation = await reserve_scratch(ch, method, job_data, claim)
+    if reservation is None:
+        return
+
+    with reservation, tempfile.NamedTemporaryFile(
+        dir=reservation.path
+    ) as input_file, tempfile.NamedTemporaryFile(
+        dir=reservation.path
+    ) as output_file, tempfile.TemporaryDirectory(
+        dir=reservation.path
+    ) as output_dir, tempfile.TemporaryDirectory(
+        dir=reservation.path
+    ) as thumbnail_dir:
+        # Shared storage is read and written in place rather than copied to scratch
+        input_path = storage.local_path(job_data.input_s3_path)
+        final_output_path = storage.local_path(job_data.output_s3_path)
+        if input_path is not None:
+            logger.info(f"Reading input chunk in place: {input_path}")
+        else:
             # Download the input chunk
+            input_path = input_file.name
             dl_start = time.time()
-            logger.info(f"Downloading input chunk from S3: {job_data.input_s3_path}")
+            logger.info(f"Downloading input chunk: {job_data.input_s3_path}")
             try:
-                s3_client.download_file(
-                    S3_BUCKET_NAME, job_data.input_s3_path, input_file.name
-                )
-            except ClientError as e:
+                with span("download"):
+                    storage.download(
+                        job_data.input_s3_path,
+                        input_path,
+                        callback=cancellation.transfer_callback,
+                    )
+            except StorageError as e:
                 logger.error(f"Unable to download input chunk: {e}")
-                await send_transcode_result(
-                    ch,
-                    method,
-                    Job.STATE_FAILED,
-                    job_data.job_id,
-                    error=str(e),
-                    error_type="s3_download",
-                )
+                await fail_job(ch, method, job_data, str(e), "s3_download")
                 return
             logger.info(
-                f"Chunk finished downloading to: {input_file.name} in {time.time() - dl_start} seconds"
+                f"Chunk finished downloading to: {input_path} in {time.time() - dl_start} seconds"
             )
+        if final_output_path is not None:
+            # Written next to the output and renamed over it once complete. Named for
+            # the worker too, as a speculative copy of the job writes alongside it.
+            output_path = f"{final_output_path}.{job_data.job_id}.{worker_id}.part"
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        else:
+            output_path = output_file.name
 
-            # Transcode the input chunk
-            try:
-                transcode(
-                    input_file.name,
-                    output_file.name,
-                    job_data.transcode_options,
-                    ch,
-                    job_data.job_id,
+        with span("probe"):
+            media = await probe_source(ch, job_data.input_s3_path, input_path, claim)
+        transcode_options = job_data.transcode_options
+        remuxing = False
+        if (
+            media is not None
+            and job_data.target
+            and matches_target(media, job_data.target)
+        ):
+            # The source is already in the target format, so only its container changes
+            remux_options = remux_pipeline(transcode_options, media)
+            if remux_options is not None:
+                logger.info(
+                    f"Source matches the target of job {job_data.job_id}, remuxing"
                 )
-            except TranscodeException as e:
-                await handle_transcode_exception(ch, method, e, job_data.job_id)
-                return
+                transcode_options = remux_options
+                remuxing = True
+
+        # Transcode the input chunk
+        hls_uploader = None
+        checkpoint_uploader = None
+        try:
+            try:
+                if job_data.packaging == PACKAGING_HLS:
+                    # Segments are uploaded as they land rather than after the transcode
+                    hls_uploader = HlsUploader(
+                        storage,
+                        output_dir,
+                        job_data.output_s3_path,
+                        transfer_callback=cancellation.transfer_callback,
+                    )
+                    transcode_options = (
+                        hls_pipeline(transcode_options)
+                        .replace("{{segment_location}}", hls_uploader.segment_location)
+                        .replace("{{playlist_location}}", hls_uploader.playlist_file)
+                    )
+                    hls_uploader.start()
+                elif job_data.packaging is not None:
+                    raise TranscodeException(
+                        "unsupported_packaging",
+                        f"Unsupported packaging: {job_data.packaging}",
+                    )
+                elif (
+                    CHECKPOINT_SEGMENT_SECONDS > 0
+                    and not job_data.speculative
+                    and not remuxing
+                    and supports_checkpointing(transcode_options)
+                ):
+                    # Encode in segments that are checkpointed as they complete, picking
+                    # up after the last segment an earlier attempt completed
+                    manifest = (
+                        claim.checkpoint
+                        or load_manifest(storage, job_data.job_id)
+                        or empty_manifest(CHECKPOINT_SEGMENT_SECONDS)
+                    )
+                    checkpoint_uploader = CheckpointUploader(
+                        storage,
+                        job_data.job_id,
+                        manifest,
+                        transfer_callback=cancellation.transfer_callback,
+                    )
+                    transcode_options = checkpoint_pipeline(
+                        transcode_options,
+                        CHECKPOINT_SEGMENT_SECONDS,
+                        checkpoint_uploader.next_index,
+                    ).replace(
+                        "{{segment_location}}",
+                        os.path.join(output_dir, segment_pattern(transcode_options)),
+                    )
+                    checkpoint_uploader.start()
+                if job_data.thumbnail_interval:
+                    thumbnails = add_thumbnails(
+                        job_data, transcode_options, thumbnail_dir, checkpoint_uploader
+                    )
+                    if thumbnails is not None:
+                        transcode_options = thumbnails
+                with span("transcode", attributes={"transcode.remux": remuxing}):
+                    transcode(
+                        input_path,
+                        output_path,
+                        transcode_options,
+                        ch,
+                        job_data.job_id,
+                        cancellation,
+                        checkpoint_uploader,
+                        media.duration_ns if media is not None else None,
+                    )
+            except JobCancelled:
+                raise
             except Exception as e:
-                await handle_transcode_exception(
-                    ch, method, TranscodeException("unknown", str(e)), job_data.job_id
-                )
+                if hls_uploader is not None:
+                    hls_uploader.stop()
+                if checkpoint_uploader is not None:
+                    await save_checkpoint(job_data.job_id, checkpoint_uploader.finish())
+                if not isinstance(e, TranscodeException):
+                    e = TranscodeException("unknown", str(e))
+                await handle_transcode_exception(ch, method, e, job_data)
                 return
             logger.info("Transcoding completed")
 
+            if checkpoint_uploader is not None:
+                await save_checkpoint(job_data.job_id, checkpoint_uploader.finish())
+                try:
+                    with span("remux_segments"):
+                        checkpoint_uploader.restore(output_dir)
+                        cancellation.check()
+                        remux_segments(
+                            job_data.transcode_options, output_dir, output_path
+                        )
+                except StorageError as e:
+                    logger.error(f"Unable to restore checkpointed segments: {e}")
+                    await fail_job(ch, method, job_data, str(e), "s3_download")
+                    return
+                except JobCancelled:
+                    raise
+                except TranscodeException as e:
+                    await handle_transcode_exception(ch, method, e, job_data)
+                    return
+
             # Upload the output chunk
-            logger.info(f"Uploading output chunk to S3: {job_data.output_s3_path}")
+            logger.info(f"Uploading output chunk: {job_data.output_s3_path}")
             try:
-                s3_client.upload_file(
-                    output_file.name, S3_BUCKET_NAME, job_data.output_s3_path
-                )
-            except ClientError as e:
+                with span("upload"):
+                    if hls_uploader is not None:
+                        hls_uploader.finish()
+                    elif final_output_path is not None:
+                        os.replace(output_path, final_output_path)
+                    else:
+                        storage.upload(
+                            output_path,
+                            job_data.output_s3_path,
+                            callback=cancellation.transfer_callback,
+                        )
+                    if job_data.thumbnail_interval:
+                        upload_thumbnails(
+                            storage,
+                            thumbnail_dir,
+                            job_data.output_s3_path,
+                            job_data.thumbnail_interval,
+                            media.duration_ns / 1_000_000_000
+                            if media is not None and media.duration_ns
+                            else None,
+                            transfer_callback=cancellation.transfer_callback,
+                        )
+            except (StorageError, OSError) as e:
                 logger.error(f"Unable to upload output chunk: {e}")
-                await send_transcode_result(
-                    ch,
-                    method,
-                    Job.STATE_FAILED,
-                    job_data.job_id,
-                    error=str(e),
-                    error_type="s3_upload",
-                )
+                await fail_job(ch, method, job_data, str(e), "s3_upload")
                 return
-    else:
-        logger.error(f"Job {job_data.job_id} is in an unexpected state: {job.state}")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        return
+        except JobCancelled:
+            # In-flight uploads abort on their next chunk, so neither of these waits long
+            if hls_uploader is not None:
+                hls_uploader.stop()
+            if checkpoint_uploader is not None:
+                if cancellation.requeue:
+                    # Keep what was checkpointed for whichever worker picks the job up
+                    await save_checkpoint(job_data.job_id, checkpoint_uploader.finish())
+                else:
+                    checkpoint_uploader.discard()
+                    await save_checkpoint(job_data.job_id, None)
+            raise
+        finally:
+            if final_output_path is not None and os.path.exists(output_path):
+                os.unlink(output_path)
+
+        if checkpoint_uploader is not None:
+            # The output is safely uploaded, so the checkpoint is no longer needed
+            try:
+                checkpoint_uploader.cleanup()
+            except StorageError as e:
+                logger.error(f"Unable to clean up checkpointed segments: {e}")
+            await save_checkpoint(job_data.job_id, None)
 
     # Send a completion message with the output chunk's blob ID
     await send_transcode_result(
@@ -436,12 +1097,96 @@ async def process_workqueue_message(
         Job.STATE_COMPLETED,
         job_data.job_id,
         output_s3_path=job_data.output_s3_path,
+        speculative=job_data.speculative,
     )
     logger.info("Job completed and result message sent")
 
 
-def main():
+async def simulate_job(
+    ch: Channel,
+    method: Basic.Deliver,
+    claim: JobTransitionReplyMessage,
+    job_data: JobSubmissionMessage,
+    cancellation: Cancellation,
+):
+    """
+    Fake a claimed job with a transcode's timing and progress cadence, then write an
+    empty output and report its result. Nothing is downloaded or encoded.
+
+    :raises JobCancelled: If the job was cancelled.
+    """
+    media = source_media(job_data.input_s3_path, claim)
+    source_seconds = (
+        media.duration_ns / 1_000_000_000
+        if media is not None and media.duration_ns
+        else SIMULATED_SOURCE_SECONDS
+    )
+    duration = source_seconds / SIMULATED_SPEED
+    fails_at = (
+        random.uniform(0, duration)
+        if random.random() < SIMULATED_FAILURE_RATE
+        else None
+    )
+    logger.info(f"Simulating job {job_data.job_id} for {duration:.1f} seconds")
+
+    woken = threading.Event()
+    cancellation.on_cancel(lambda reason: woken.set())
+    start = time.monotonic()
+    while True:
+        elapsed = time.monotonic() - start
+        if fails_at is not None and elapsed >= fails_at:
+            await fail_job(
+                ch, method, job_data, "Simulated transcode failure", "mid_transcode"
+            )
+            return
+        if elapsed >= duration:
+            break
+        if elapsed > 0:
+            publish_progress(
+                ch, job_data.job_id, 100 * elapsed / duration, duration - elapsed
+            )
+        woken.wait(min(PROGRESS_INTERVAL_SECONDS, duration - elapsed))
+        cancellation.check()
+
+    try:
+        await asyncio.to_thread(storage.put_bytes, job_data.output_s3_path, b"")
+    except StorageError as e:
+        logger.error(f"Unable to upload output chunk: {e}")
+        await fail_job(ch, method, job_data, str(e), "s3_upload")
+        return
+    await send_transcode_result(
+        ch,
+        method,
+        Job.STATE_COMPLETED,
+        job_data.job_id,
+        output_s3_path=job_data.output_s3_path,
+        speculative=job_data.speculative,
+    )
+
+
+def initialize():
+    """
+    Initialize GStreamer, which loads the plugin registry. Processes forked by the
+    supervisor afterwards share this instead of paying for it again.
+    """
     Gst.init(None)
+    startup.mark("gst_init")
+
+
+def serve(supervisor: Optional[Connection] = None):
+    """
+    Connect to RabbitMQ and the API, and consume jobs until asked to shut down.
+
+    :param supervisor: The pipe to the supervisor, when the worker is one of the
+        processes of its pool. The worker then waits for the supervisor to activate it
+        before consuming, and reports when it is busy with a job.
+    """
+    global supervisor_pipe
+    supervisor_pipe = supervisor
+
+    # Set up after forking, as the exporter's thread doesn't survive a fork
+    if init_tracing("transcoder-worker", worker_id):
+        logger.info("Exporting traces")
 
     # Connect to RabbitMQ and set up a channel
     credentials = pika.PlainCredentials(RMQ_USER, RMQ_PASSWORD)
@@ -454,19 +1199,91 @@ def main():
             JOB_QUEUE_NAME,
             RESULTS_QUEUE_NAME,
             PROGRESS_QUEUE_NAME,
+            RETRY_DELAYS_SECONDS,
         )
+        # Probes are published for the API to record as they happen
+        channel.queue_declare(queue=MEDIA_INFO_QUEUE_NAME)
         logger.info(f"Connected to RabbitMQ on {RMQ_HOST}:{RMQ_PORT}")
     except Exception:
         logger.error(f"Unable to connect to RabbitMQ on {RMQ_HOST}:{RMQ_PORT}")
         return
+    startup.mark("rabbitmq")
+
+    global job_state
+    job_state = JobStateClient(
+        RMQ_HOST,
+        RMQ_PORT,
+        credentials,
+        JOB_TRANSITIONS_QUEUE_NAME,
+        worker_id,
+        MESSAGE_CONTENT_TYPE,
+    )
+    # Connect up front rather than on the first claim, which would delay the first job
+    try:
+        job_state.connect()
+    except pika.exceptions.AMQPError as e:
+        logger.warning(f"Unable to connect for job state requests yet: {e}")
+    startup.mark("job_state")
+
+    global control_listener
+    control_listener = ControlListener(
+        RMQ_HOST, RMQ_PORT, credentials, CONTROL_EXCHANGE_NAME, worker_id
+    )
+    control_listener.start()
+    startup.mark("control_listener")
+
+    def drain_deadline_reached():
+        cancellation = current_cancellation
+        if cancellation is not None:
+            cancellation.cancel("worker shutting down", requeue=True)
+
+    def on_sigterm(signum, frame):
+        if draining.is_set():
+            return
+        logger.info(
+            f"Received SIGTERM, draining for up to {DRAIN_TIMEOUT_SECONDS} seconds"
+        )
+        draining.set()
+        # Stop taking jobs once the current one, if any, is done
+        connection.add_callback_threadsafe(channel.stop_consuming)
+        deadline = threading.Timer(DRAIN_TIMEOUT_SECONDS, drain_deadline_reached)
+        deadline.daemon = True
+        deadline.start()
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    if supervisor is not None:
+        logger.info(f"Warm after {startup.summary()}, waiting to be activated")
+        report_to_supervisor(POOL_READY)
+        # Keep servicing the connection, so that heartbeats don't lapse while parked
+        while not draining.is_set() and not supervisor.poll():
+            connection.process_data_events(time_limit=0.1)
+        if draining.is_set():
+            logger.info("Shutting down before being activated")
+            connection.close()
+            shutdown_tracing()
+            return
+        supervisor.recv()
+        logger.info(f"Activated after {startup.elapsed():.3f}s")
+    else:
+        logger.info(f"Ready after {startup.summary()}")
+
+    def on_job_message(
+        ch: Channel, method: Basic.Deliver, properties: BasicProperties, body: bytes
+    ):
+        report_to_supervisor(POOL_BUSY)
+        try:
+            asyncio.get_event_loop().run_until_complete(
+                process_workqueue_message(ch, method, properties, body)
+            )
+        finally:
+            report_to_supervisor(POOL_IDLE)
 
     channel.basic_qos(prefetch_count=1)
     channel.basic_consume(
         queue=JOB_QUEUE_NAME,
         consumer_tag="worker-{}".format(worker_id),
-        on_message_callback=lambda ch, method, properties, body: asyncio.get_event_loop().run_until_complete(
-            process_workqueue_message(ch, method, properties, body)
-        ),
+        on_message_callback=on_job_message,
     )
 
     try:
@@ -474,7 +1291,15 @@ def main():
     except KeyboardInterrupt:
         channel.stop_consuming()
 
+    if draining.is_set():
+        logger.info("Drained, shutting down")
     connection.close()
+    shutdown_tracing()
+
+
+def main():
+    initialize()
+    serve()
 
 
 if __name__ == "__main__":